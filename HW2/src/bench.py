@@ -0,0 +1,404 @@
+import argparse
+import copy
+import gc
+import json
+import os
+import random
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from bril import parse_bril, serialize_bril
+from cfg import CFG, Function, Node, Program, func_blocks
+from dominance import dom_frontier, dom_tree, dominators, idom_frontier, idom_tree, iterative_idom, semi_nca
+from driver import transform
+from is_ssa import is_ssa
+from ssa_construct import place_phis, SSAStats
+
+def random_func(n: int, seed: int = 0, window: int = 8, back: float = 0.1) -> Function:
+    rng = random.Random(seed)
+    instrs: list[Any] = []
+
+    for i in range(n):
+        instrs.append({'label': f'b{i}'})
+        instrs.append({'op': 'const', 'dest': 'v', 'type': 'int', 'value': i})
+
+        if i == n - 1:
+            instrs.append({'op': 'ret'})
+        elif rng.random() < 0.5:
+            instrs.append({'op': 'jmp', 'labels': [f'b{i + 1}']})
+        else:
+            if rng.random() < back:
+                other = rng.randint(max(0, i - window), i)
+            else:
+                other = rng.randint(i + 1, min(n - 1, i + window))
+
+            instrs.append({'op': 'br', 'args': ['c'], 'labels': [f'b{i + 1}', f'b{other}']})
+
+    return {'name': f'f{n}', 'instrs': instrs}
+
+def switch_func(n: int, depth: int = 1) -> Function:
+    instrs: list[Any] = []
+    count = 0
+
+    def fresh() -> str:
+        nonlocal count
+        count += 1
+
+        return f'l{count}'
+
+    def switch(entry: str, join: str, n: int, depth: int):
+        instrs.append({'label': entry})
+
+        for i in range(n):
+            case, rest = fresh(), fresh()
+
+            instrs.append({'op': 'br', 'args': ['c'], 'labels': [case, rest]})
+            instrs.append({'label': case})
+
+            if depth > 1:
+                inner = fresh()
+
+                instrs.append({'op': 'jmp', 'labels': [inner]})
+                switch(inner, join, max(1, n // 4), depth - 1)
+            else:
+                instrs.append({'op': 'const', 'dest': 'v', 'type': 'int', 'value': i})
+                instrs.append({'op': 'jmp', 'labels': [join]})
+
+            instrs.append({'label': rest})
+
+        instrs.append({'op': 'jmp', 'labels': [join]})
+
+    switch(fresh(), 'join', n, depth)
+    instrs.append({'label': 'join'})
+    instrs.append({'op': 'ret'})
+
+    return {'name': f'switch{n}', 'instrs': instrs}
+
+def chain_func(n: int, nested: bool = False) -> Function:
+    instrs: list[Any] = [
+        {'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+        {'op': 'const', 'dest': 'c', 'type': 'bool', 'value': True},
+    ]
+
+    for i in range(n):
+        instrs.append({'label': f'b{i}'})
+        instrs.append({'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 'one']})
+
+        if i == n - 1:
+            instrs.append({'op': 'jmp', 'labels': [f'j{i}' if nested else 'done']})
+        elif nested:
+            instrs.append({'op': 'br', 'args': ['c'], 'labels': [f'b{i + 1}', f'j{i}']})
+        else:
+            instrs.append({'op': 'jmp', 'labels': [f'b{i + 1}']})
+
+    if nested:
+        for i in reversed(range(n)):
+            instrs.append({'label': f'j{i}'})
+            instrs.append({'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 'one']})
+            instrs.append({'op': 'jmp', 'labels': [f'j{i - 1}' if i else 'done']})
+
+    instrs.append({'label': 'done'})
+    instrs.append({'op': 'print', 'args': ['x']})
+
+    return {'name': 'main', 'instrs': instrs}
+
+def run_chain(func: Function) -> list[str]:
+    # Just enough of an interpreter for chain_func's programs, before and
+    # after conversion, to check that a conversion kept their meaning.
+    instrs = func['instrs']
+    labels = {instr['label']: i for i, instr in enumerate(instrs) if 'label' in instr}
+    env: dict[str, Any] = {}
+    out: list[str] = []
+    block = prev = None
+    i = 0
+
+    while i < len(instrs):
+        instr = instrs[i]
+        i += 1
+
+        if 'label' in instr:
+            block, prev = instr['label'], block
+            continue
+
+        op = instr['op']
+        args = [env[arg] for arg in instr.get('args', [])]
+
+        if op == 'const':
+            env[instr['dest']] = instr['value']
+        elif op == 'id':
+            env[instr['dest']] = args[0]
+        elif op == 'add':
+            env[instr['dest']] = args[0] + args[1]
+        elif op == 'phi':
+            env[instr['dest']] = env[instr['args'][instr['labels'].index(prev)]]
+        elif op == 'print':
+            out.append(' '.join(str(arg).lower() for arg in args))
+        elif op == 'jmp':
+            i = labels[instr['labels'][0]]
+        elif op == 'br':
+            i = labels[instr['labels'][0 if args[0] else 1]]
+        elif op == 'ret':
+            break
+        else:
+            raise ValueError(f'run_chain: unexpected op {op}')
+
+    return out
+
+def temps_func(n: int, seed: int = 0, temps: int = 8) -> Function:
+    func = random_func(n, seed)
+    instrs: list[Any] = [
+        {'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+        {'op': 'const', 'dest': 'c', 'type': 'bool', 'value': False},
+    ]
+
+    for item in func['instrs']:
+        if 'label' in item or item['op'] != 'const':
+            instrs.append(item)
+            continue
+
+        prev = 'x'
+
+        for k in range(temps):
+            instrs.append({'op': 'add', 'dest': f't{k}', 'type': 'int', 'args': [prev, 'one']})
+            prev = f't{k}'
+
+        instrs.append({'op': 'add', 'dest': 'x', 'type': 'int', 'args': [prev, 'x']})
+
+    func['instrs'] = instrs
+
+    return func
+
+def vars_func(n: int, nvars: int, seed: int = 0, per_block: int = 4) -> Function:
+    rng = random.Random(seed)
+    func = random_func(n, seed)
+    instrs: list[Any] = [{'op': 'const', 'dest': 'c', 'type': 'bool', 'value': False}]
+
+    for item in func['instrs']:
+        if 'label' in item or item['op'] != 'const':
+            instrs.append(item)
+            continue
+
+        for k in range(per_block):
+            instrs.append({'op': 'const', 'dest': f'v{rng.randrange(nvars)}', 'type': 'int', 'value': k})
+
+    func['instrs'] = instrs
+
+    return func
+
+def timed(fn: Callable[..., Any], *args: Any) -> tuple[float, Any]:
+    start = time.perf_counter()
+    result = fn(*args)
+
+    return time.perf_counter() - start, result
+
+def bench_dominators(args: argparse.Namespace):
+    print(f'{"blocks":>8} {"semi-nca (s)":>14} {"us/block":>10} {"idom array (s)":>15} {"sets (s)":>10}')
+
+    for n in args.sizes or [1000, 5000, 10000, 20000, 50000]:
+        graph = CFG.from_blocks(func_blocks(random_func(n, args.seed)))
+        t, idom = timed(semi_nca, graph)
+        t_iter, iter_idom = timed(iterative_idom, graph)
+        old = '-'
+
+        assert iter_idom == idom, 'idom mismatch'
+
+        if n <= args.baseline_max:
+            t_old, tree = timed(lambda: dom_tree(graph, dominators(graph)))
+
+            assert [
+                node.parent and node.parent.node for node in tree
+            ] == [
+                node.parent and node.parent.node for node in idom_tree(graph, idom)
+            ], 'idom mismatch'
+
+            old = f'{t_old:.3f}'
+
+        print(f'{n:>8} {t:>14.3f} {t / n * 1e6:>10.2f} {t_iter:>15.3f} {old:>10}')
+
+def bench_frontier(args: argparse.Namespace):
+    print(f'{"cases":>8} {"blocks":>8} {"walk (s)":>10} {"dominated (s)":>14}')
+
+    for n in args.sizes or [1000, 5000, 10000, 20000, 50000]:
+        graph = CFG.from_blocks(func_blocks(switch_func(n, args.depth)))
+        idom = semi_nca(graph)
+        t, frontier = timed(idom_frontier, graph, idom)
+        old = '-'
+
+        if n <= args.baseline_max:
+            dom = dominators(graph)
+            t_old, old_frontier = timed(dom_frontier, graph, dom)
+
+            assert frontier == old_frontier, 'frontier mismatch'
+
+            old = f'{t_old:.3f}'
+
+        print(f'{n:>8} {len(graph.all):>8} {t:>10.3f} {old:>14}')
+
+def bench_stress(args: argparse.Namespace):
+    print(f'{"blocks":>8} {"shape":>8} {"to_ssa (s)":>12} {"roundtrip (s)":>14}')
+
+    for n in args.sizes or [100000]:
+        for nested in (False, True):
+            expected = run_chain(chain_func(n, nested))
+
+            func = chain_func(n, nested)
+            t, _ = timed(transform, func, False, 'lt')
+
+            assert is_ssa(parse_bril(json.dumps({'functions': [func]}))), 'not SSA'
+            assert run_chain(func) == expected, 'to_ssa changed the output'
+
+            func = chain_func(n, nested)
+            t_rt, _ = timed(transform, func, True, 'lt')
+
+            assert not any(instr.get('op') == 'phi' for instr in func['instrs']), 'phi left after roundtrip'
+            assert run_chain(func) == expected, 'roundtrip changed the output'
+
+            print(f'{n:>8} {"nested" if nested else "chain":>8} {t:>12.3f} {t_rt:>14.3f}')
+
+def program_text(functions: int, blocks: int, seed: int) -> str:
+    rng = random.Random(seed)
+    funcs = []
+
+    for i in range(functions):
+        func = random_func(blocks, rng.randrange(1 << 30))
+        func['name'] = f'f{i}'
+        func['instrs'] = [
+            {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+            {'op': 'const', 'dest': 'c', 'type': 'bool', 'value': True},
+            *({'op': 'const', 'dest': f'v{j}', 'type': 'int', 'value': j} for j in range(50)),
+            *(
+                item if 'label' in item or item['op'] != 'const' else
+                    {'op': 'add', 'dest': f'v{rng.randrange(50)}', 'type': 'int', 'args': [f'v{rng.randrange(50)}', 'one']}
+                    for item in func['instrs']
+            ),
+        ]
+        funcs.append(func)
+
+    return json.dumps({'functions': funcs})
+
+def retained(fn: Callable[..., Any], *args: Any) -> tuple[int, Any]:
+    gc.collect()
+    tracemalloc.start()
+    result = fn(*args)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return size, result
+
+def bench_bril(args: argparse.Namespace):
+    print(f'{"functions":>10} {"MB":>6} {"dicts (MB)":>11} {"Program (MB)":>13} {"parse (s)":>10} {"serialize (s)":>14}')
+
+    for n in args.sizes or [100, 500, 1000]:
+        text = program_text(n, 50, args.seed)
+
+        dict_size, _ = retained(json.loads, text)
+        prog_size, _ = retained(parse_bril, text)
+        t_parse, prog = timed(parse_bril, text)
+        t_serialize, _ = timed(serialize_bril, prog)
+
+        print(
+            f'{n:>10} {len(text) / 2**20:>6.1f} {dict_size / 2**20:>11.1f} {prog_size / 2**20:>13.1f}'
+            f' {t_parse:>10.3f} {t_serialize:>14.3f}'
+        )
+
+def bench_phis(args: argparse.Namespace):
+    progs: list[tuple[str, Program]] = []
+
+    for name in args.files:
+        with open(name) as f:
+            progs.append((os.path.basename(name), json.load(f)))
+
+    if not progs:
+        progs = [(f'temps{n}', {'functions': [temps_func(n, args.seed)]}) for n in args.sizes or [100, 1000, 5000]]
+
+    print(f'{"program":>18} {"ssa":>8} {"phis":>8} {"pruned":>8} {"local":>6} {"JSON (KB)":>10} {"to_ssa (s)":>11}')
+
+    for name, prog in progs:
+        for ssa in ('minimal', 'semi', 'pruned', 'braun'):
+            funcs = copy.deepcopy(prog['functions'])
+            stats = SSAStats()
+            start = time.perf_counter()
+
+            for func in funcs:
+                stats += transform(func, False, 'lt', ssa)
+
+            t = time.perf_counter() - start
+            size = len(json.dumps(funcs)) / 1024
+
+            print(f'{name:>18} {ssa:>8} {stats.phis:>8} {stats.pruned:>8} {stats.local:>6} {size:>10.1f} {t:>11.4f}')
+
+def set_placement(graph: CFG, frontier: list[set[Node]], defs: dict[str, list[Node]]) -> list[set[str]]:
+    vars: list[set[str]] = [set() for _ in graph.all]
+
+    for var in defs:
+        for node in defs[var]:
+            vars[node.id].add(var)
+
+    phis: list[set[str]] = [set() for _ in graph.all]
+
+    for var in defs:
+        while defs[var]:
+            for node in frontier[defs[var].pop().id]:
+                if var not in phis[node.id]:
+                    phis[node.id].add(var)
+
+                    if var not in vars[node.id]:
+                        defs[var].append(node)
+
+    return phis
+
+def bench_placement(args: argparse.Namespace):
+    print(f'{"blocks":>8} {"vars":>8} {"phis":>8} {"stamps (s)":>12} {"sets (s)":>12}')
+
+    for n in args.sizes or [1000, 5000, 10000, 20000]:
+        graph = CFG.from_blocks(func_blocks(vars_func(n, args.vars, args.seed)))
+        frontier = idom_frontier(graph, semi_nca(graph))
+
+        defs: dict[str, list[Node]] = {}
+
+        for node in graph.all:
+            for var in {item['dest'] for item in node.block if 'dest' in item}:
+                defs.setdefault(var, []).append(node)
+
+        t, placed = timed(place_phis, graph, frontier, defs)
+        count = sum(len(vars) for vars in placed)
+
+        old = '-'
+
+        if n <= args.baseline_max:
+            t_old, phis = timed(set_placement, graph, frontier, {var: list(nodes) for var, nodes in defs.items()})
+            assert phis == [set(vars) for vars in placed]
+            old = f'{t_old:.3f}'
+
+        print(f'{n:>8} {args.vars:>8} {count:>8} {t:>12.3f} {old:>12}')
+
+BENCHMARKS = {
+    'dominators': bench_dominators,
+    'frontier': bench_frontier,
+    'stress': bench_stress,
+    'bril': bench_bril,
+    'phis': bench_phis,
+    'placement': bench_placement,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the SSA pipeline.')
+
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('files', nargs='*', help='Bril JSON programs (phis only)')
+    parser.add_argument('--sizes', type=int, nargs='+')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--baseline-max', type=int, default=1000)
+    parser.add_argument('--vars', type=int, default=5000)
+
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == '__main__':
+    main()
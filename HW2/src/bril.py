@@ -1,10 +1,26 @@
 import json
-from typing import Any, Dict, List, Optional
+from sys import intern
+from typing import Any, Dict, List, Optional, Tuple
+
+# Instructions without args/funcs/labels all share this tuple rather than each
+# holding its own empty list.
+EMPTY: Tuple[str, ...] = ()
+
+def _names(instr: Dict[str, Any], key: str) -> Tuple[str, ...]:
+    names = instr.get(key)
+    if not names:
+        return EMPTY
+    return tuple([intern(name) for name in names])
+
+def _type(t: Any) -> Any:
+    return intern(t) if isinstance(t, str) else t
 
 class Instruction:
+    __slots__ = ('op',)
+
     def __init__(self, instr: Dict[str, Any]):
-        self.op: Optional[str] = instr.get('op')
-        self.instr = instr
+        op = instr.get('op')
+        self.op: Optional[str] = intern(op) if op is not None else None
 
     def to_dict(self) -> Dict[str, Any]:
         result = {}
@@ -16,14 +32,17 @@ class Instruction:
         return json.dumps(self.to_dict())
 
 class Const(Instruction):
+    __slots__ = ('dest', 'type', 'value')
+
     def __init__(self, instr: Dict[str, Any]):
-        super().__init__(instr)
-        self.dest = instr.get('dest')
-        self.type = instr.get('type')
+        self.op = intern(instr['op'])
+        dest = instr.get('dest')
+        self.dest = intern(dest) if dest is not None else None
+        self.type = _type(instr.get('type'))
         self.value = instr.get('value')
 
     def to_dict(self) -> Dict[str, Any]:
-        result = super().to_dict()
+        result: Dict[str, Any] = {'op': self.op}
         if self.dest is not None:
             result['dest'] = self.dest
         if self.type is not None:
@@ -33,16 +52,22 @@ class Const(Instruction):
         return result
 
 class ValueOperation(Instruction):
+    __slots__ = ('dest', 'type', 'args', 'funcs', 'labels')
+
     def __init__(self, instr: Dict[str, Any]):
-        super().__init__(instr)
-        self.dest = instr.get('dest')
-        self.type = instr.get('type')
-        self.args = instr.get('args', [])
-        self.funcs = instr.get('funcs', [])
-        self.labels = instr.get('labels', [])
+        op = instr.get('op')
+        self.op = intern(op) if op is not None else None
+        dest = instr.get('dest')
+        self.dest = intern(dest) if dest is not None else None
+        self.type = _type(instr.get('type'))
+        self.args = _names(instr, 'args')
+        self.funcs = _names(instr, 'funcs')
+        self.labels = _names(instr, 'labels')
 
     def to_dict(self) -> Dict[str, Any]:
-        result = super().to_dict()
+        result: Dict[str, Any] = {}
+        if self.op is not None:
+            result['op'] = self.op
         if self.dest is not None:
             result['dest'] = self.dest
         if self.type is not None:
@@ -56,14 +81,19 @@ class ValueOperation(Instruction):
         return result
 
 class EffectOperation(Instruction):
+    __slots__ = ('args', 'funcs', 'labels')
+
     def __init__(self, instr: Dict[str, Any]):
-        super().__init__(instr)
-        self.args = instr.get('args', [])
-        self.funcs = instr.get('funcs', [])
-        self.labels = instr.get('labels', [])
+        op = instr.get('op')
+        self.op = intern(op) if op is not None else None
+        self.args = _names(instr, 'args')
+        self.funcs = _names(instr, 'funcs')
+        self.labels = _names(instr, 'labels')
 
     def to_dict(self) -> Dict[str, Any]:
-        result = super().to_dict()
+        result: Dict[str, Any] = {}
+        if self.op is not None:
+            result['op'] = self.op
         if self.args:
             result['args'] = self.args
         if self.funcs:
@@ -73,9 +103,12 @@ class EffectOperation(Instruction):
         return result
 
 class Label(Instruction):
+    __slots__ = ('label',)
+
     def __init__(self, instr: Dict[str, Any]):
-        super().__init__(instr)
-        self.label = instr.get('label')
+        self.op = None
+        label = instr.get('label')
+        self.label = intern(label) if label is not None else None
 
     def to_dict(self) -> Dict[str, Any]:
         result = {}
@@ -84,6 +117,8 @@ class Label(Instruction):
         return result
 
 class Function:
+    __slots__ = ('name', 'args', 'type', 'instrs')
+
     def __init__(self, func: Dict[str, Any]):
         self.name = func.get('name')
         self.args = func.get('args', [])
@@ -112,6 +147,8 @@ class Function:
         return result
 
 class Program:
+    __slots__ = ('functions',)
+
     def __init__(self, prog: Dict[str, Any]):
         self.functions = [Function(func) for func in prog.get('functions', [])]
 
@@ -122,5 +159,6 @@ def parse_bril(json_str: str) -> Program:
     prog = json.loads(json_str)
     return Program(prog)
 
-def serialize_bril(prog: Program) -> str:
-    return json.dumps(prog.to_dict(), indent=2)
\ No newline at end of file
+def serialize_bril(prog: Program, indent: Optional[int] = 2) -> str:
+    # indent=None lets json use its C encoder, which is several times faster.
+    return json.dumps(prog.to_dict(), indent=indent)
@@ -1,21 +1,24 @@
+from array import array
 from dataclasses import dataclass
-from typing import Generator, Optional
+from typing import Generator, Iterator, Optional
 
 from cfg import CFG, Node
 
 def post_order(graph: CFG) -> Generator[Node, None, None]:
-    visited: set[int] = set()
+    visited: set[int] = {graph.entry.id}
+    stack = [(graph.entry, iter(graph.entry.outs))]
 
-    def visit(node: Node) -> Generator[Node, None, None]:
-        visited.add(node.id)
+    while stack:
+        node, successors = stack[-1]
 
-        for successor in node.outs:
+        for successor in successors:
             if successor.id not in visited:
-                yield from visit(successor)
-
-        yield node
-
-    return visit(graph.entry)
+                visited.add(successor.id)
+                stack.append((successor, iter(successor.outs)))
+                break
+        else:
+            stack.pop()
+            yield node
 
 def dominators(graph: CFG) -> list[set[Node]]:
     dom = [set(graph.all) for _ in graph.all]
@@ -74,6 +77,132 @@ def dom_tree(graph: CFG, dom: list[set[Node]]) -> list[DomTree]:
 
     return all
 
+def iterative_idom(graph: CFG) -> list[Optional[Node]]:
+    # The iterative algorithm of Cooper, Harvey and Kennedy, on an array of
+    # immediate dominators instead of dominator sets. Only nodes reachable
+    # from the entry take part; their reverse postorder numbers order the
+    # intersection walk.
+    order = list(post_order(graph))[::-1]
+    num = [-1] * len(graph.all)
+
+    for i, node in enumerate(order):
+        num[node.id] = i
+
+    # The entry is temporarily its own idom, so intersect stops there.
+    idom = [-1] * len(graph.all)
+    idom[graph.entry.id] = graph.entry.id
+
+    def intersect(a: int, b: int) -> int:
+        while a != b:
+            while num[a] > num[b]:
+                a = idom[a]
+
+            while num[b] > num[a]:
+                b = idom[b]
+
+        return a
+
+    changed = True
+
+    while changed:
+        changed = False
+
+        for node in order[1:]:
+            new = -1
+
+            for predecessor in node.ins:
+                if idom[predecessor.id] == -1:
+                    continue
+
+                new = predecessor.id if new == -1 else intersect(predecessor.id, new)
+
+            if idom[node.id] != new:
+                idom[node.id] = new
+                changed = True
+
+    idom[graph.entry.id] = -1
+
+    return [None if parent == -1 else graph.all[parent] for parent in idom]
+
+def semi_nca(graph: CFG) -> list[Optional[Node]]:
+    vertex: list[Node] = []
+    parent: list[int] = []
+    num = [-1] * len(graph.all)
+
+    stack = [(graph.entry, -1)]
+
+    while stack:
+        node, pred = stack.pop()
+
+        if num[node.id] != -1:
+            continue
+
+        num[node.id] = len(vertex)
+        vertex.append(node)
+        parent.append(pred)
+
+        for successor in reversed(node.outs):
+            if num[successor.id] == -1:
+                stack.append((successor, num[node.id]))
+
+    semi = list(range(len(vertex)))
+    label = list(range(len(vertex)))
+    ancestor = [-1] * len(vertex)
+
+    def evaluate(v: int) -> int:
+        if ancestor[v] == -1:
+            return v
+
+        path = []
+        u = v
+
+        while ancestor[ancestor[u]] != -1:
+            path.append(u)
+            u = ancestor[u]
+
+        for u in reversed(path):
+            a = ancestor[u]
+
+            if semi[label[a]] < semi[label[u]]:
+                label[u] = label[a]
+
+            ancestor[u] = ancestor[a]
+
+        return label[v]
+
+    for w in range(len(vertex) - 1, 0, -1):
+        for predecessor in vertex[w].ins:
+            if (v := num[predecessor.id]) != -1:
+                semi[w] = min(semi[w], semi[evaluate(v)])
+
+        ancestor[w] = parent[w]
+
+    idom = parent[:]
+
+    for w in range(1, len(vertex)):
+        while idom[w] > semi[w]:
+            idom[w] = idom[idom[w]]
+
+    result: list[Optional[Node]] = [None for _ in graph.all]
+
+    for w in range(1, len(vertex)):
+        result[vertex[w].id] = vertex[idom[w]]
+
+    return result
+
+def idom_tree(graph: CFG, idom: list[Optional[Node]]) -> list[DomTree]:
+    all = [DomTree(node, None, []) for node in graph.all]
+
+    for node, parent in zip(all, idom):
+        if parent is not None:
+            node.parent = all[parent.id]
+            all[parent.id].children.append(node)
+
+    return all
+
+def tree_idom(tree: list[DomTree]) -> list[Optional[Node]]:
+    return [node.parent.node if node.parent else None for node in tree]
+
 def dom_frontier(graph: CFG, dom: list[set[Node]]):
     doms = dominates(graph, dom)
     frontier: list[set[Node]] = [set() for _ in graph.all]
@@ -85,3 +214,97 @@ def dom_frontier(graph: CFG, dom: list[set[Node]]):
                     frontier[node.id].add(successor)
 
     return frontier
+
+
+def idom_frontier(graph: CFG, idom: list[Optional[Node]]) -> list[set[Node]]:
+    frontier: list[set[Node]] = [set() for _ in graph.all]
+
+    def reachable(node: Node) -> bool:
+        return node is graph.entry or idom[node.id] is not None
+
+    for node in graph.all:
+        if not reachable(node):
+            continue
+
+        for predecessor in node.ins:
+            if not reachable(predecessor):
+                continue
+
+            runner: Optional[Node] = predecessor
+
+            while runner is not None and runner is not idom[node.id]:
+                if node in frontier[runner.id]:
+                    break
+
+                frontier[runner.id].add(node)
+                runner = idom[runner.id]
+
+    return frontier
+
+class DominatorTree:
+    def __init__(self, graph: CFG, idom: list[Optional[Node]]):
+        n = len(graph.all)
+
+        self.nodes = graph.all
+        self.idom = array('i', [-1 if parent is None else parent.id for parent in idom])
+
+        self.first = array('i', [0]) * (n + 1)
+
+        for parent in self.idom:
+            if parent != -1:
+                self.first[parent + 1] += 1
+
+        for i in range(n):
+            self.first[i + 1] += self.first[i]
+
+        self.kids = array('i', [0]) * self.first[n]
+        fill = self.first[:n]
+
+        for i, parent in enumerate(self.idom):
+            if parent != -1:
+                self.kids[fill[parent]] = i
+                fill[parent] += 1
+
+        self.pre = array('i', [-1]) * n
+        self.post = array('i', [-1]) * n
+
+        root = graph.entry.id
+        pre, post = 1, 0
+        self.pre[root] = 0
+        stack = [(root, self.first[root])]
+
+        while stack:
+            i, k = stack[-1]
+
+            if k < self.first[i + 1]:
+                stack[-1] = (i, k + 1)
+                child = self.kids[k]
+
+                self.pre[child] = pre
+                pre += 1
+                stack.append((child, self.first[child]))
+            else:
+                stack.pop()
+                self.post[i] = post
+                post += 1
+
+    def parent(self, node: Node) -> Optional[Node]:
+        i = self.idom[node.id]
+
+        return None if i == -1 else self.nodes[i]
+
+    def children(self, node: Node) -> Iterator[Node]:
+        for i in self.kids[self.first[node.id]:self.first[node.id + 1]]:
+            yield self.nodes[i]
+
+    def reachable(self, node: Node) -> bool:
+        return self.pre[node.id] != -1
+
+    def dominates(self, a: Node, b: Node) -> bool:
+        return (
+            self.pre[a.id] != -1 and self.pre[b.id] != -1
+                and self.pre[a.id] <= self.pre[b.id] and self.post[b.id] <= self.post[a.id]
+        )
+
+    def strictly_dominates(self, a: Node, b: Node) -> bool:
+        return a is not b and self.dominates(a, b)
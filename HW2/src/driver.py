@@ -1,13 +1,79 @@
 import argparse
 import json
 import sys
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import Iterable, Iterator
 
-from cfg import BasicBlock, flatten_blocks, func_blocks, CFG, Node, Instruction, Program, Type
+from cfg import BasicBlock, flatten_blocks, func_blocks, CFG, Function, Node, Instruction, Program, Type
 from dominance import dom_frontier, dom_tree, dominators
-from ssa_construct import get_label, insert_labels, LabelGenerator, to_ssa, from_ssa, insert_explicit_return
+from ssa_braun import braun_ssa
+from ssa_construct import get_label, insert_labels, LabelGenerator, SSAStats, to_ssa, from_ssa, insert_explicit_return
+from stream import stream_program
 
 
+def transform(
+    func: Function,
+    roundtrip: bool = False,
+    algorithm: str = 'iterative',
+    ssa: str = 'minimal',
+    coalescing: bool = True
+) -> SSAStats:
+    func_args = func['args'] if 'args' in func else []
+
+    blocks = func_blocks(func)
+    blocks.insert(0, [{'label': '__entry'}])
+
+    graph = CFG.from_blocks(blocks)
+    gen = LabelGenerator(blocks)
+
+    insert_labels(blocks, gen)
+    insert_explicit_return(graph)
+
+    if ssa == 'braun':
+        stats = braun_ssa(graph, func_args)
+    else:
+        stats = to_ssa(graph, [arg['name'] for arg in func_args], algorithm, ssa)
+
+    if roundtrip:
+        stats += from_ssa(graph, gen, [arg['name'] for arg in func_args], coalescing)
+
+    func['instrs'] = flatten_blocks([node.block for node in graph.all])
+
+    return stats
+
+def transform_worker(func: Function, roundtrip: bool, algorithm: str, ssa: str, coalescing: bool) -> tuple[Function, SSAStats]:
+    return func, transform(func, roundtrip, algorithm, ssa, coalescing)
+
+def transform_all(
+    funcs: Iterable[Function],
+    roundtrip: bool,
+    algorithm: str,
+    ssa: str = 'minimal',
+    coalescing: bool = True,
+    jobs: int = 1
+) -> Iterator[tuple[Function, SSAStats]]:
+    if jobs <= 1:
+        for func in funcs:
+            yield func, transform(func, roundtrip, algorithm, ssa, coalescing)
+
+        return
+
+    # Results come back in input order; keeping only a few tasks per worker in
+    # flight bounds memory when funcs is streamed.
+    with ProcessPoolExecutor(jobs) as pool:
+        pending = deque()
+
+        for func in funcs:
+            pending.append(pool.submit(transform_worker, func, roundtrip, algorithm, ssa, coalescing))
+
+            if len(pending) >= 4 * jobs:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
 def main():
     parser = argparse.ArgumentParser(description='SSA conversion.')
 
@@ -21,30 +87,101 @@ def main():
         '--roundtrip',
         action='store_true'
     )
+    parser.add_argument(
+        '--dominators',
+        choices=['iterative', 'lt', 'sets'],
+        default='iterative',
+        help='how to find immediate dominators: iteratively on an idom array (iterative), by semi-NCA (lt), '
+             'or from quadratic dominator sets, to check the others against (sets)'
+    )
+
+    parser.add_argument(
+        '--no-coalesce',
+        dest='coalesce',
+        action='store_false',
+        help='with --roundtrip, give every phi argument its own copy instead of merging non-interfering names'
+    )
+
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='decode, convert and write out one function at a time'
+    )
+    parser.add_argument(
+        '--ssa',
+        choices=['minimal', 'semi', 'pruned', 'braun'],
+        default='minimal',
+        help='where to place phis: at every join (minimal), only for names live across blocks (semi), or only where the variable is live (pruned); '
+             'braun builds SSA on the fly without dominance frontiers, removing trivial phis'
+    )
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help='report the number of phis placed and pruned, of block-local names, and of copies and blocks inserted by --roundtrip, on stderr'
+    )
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='transform functions in this many worker processes'
+    )
 
     args = parser.parse_args()
-    prog: Program = json.load(args.file)
+    stats = SSAStats()
+
+    def transformed(funcs: Iterable[Function]) -> Iterator[Function]:
+        nonlocal stats
+
+        for func, func_stats in transform_all(funcs, args.roundtrip, args.dominators, args.ssa, args.coalesce, args.jobs):
+            stats += func_stats
+            yield func
+
+    if args.stream:
+        # Members are written in input order, as json.dump writes them below.
+        # The functions come as a run of ('function', func) items, each group
+        # consumed before the stream moves past it.
+        first = True
+
+        def member(key: str):
+            nonlocal first
+
+            sys.stdout.write(('' if first else ', ') + json.dumps(key) + ': ')
+            first = False
+
+        sys.stdout.write('{')
+
+        for is_function, group in groupby(stream_program(args.file), lambda item: item[0] == 'function'):
+            if not is_function:
+                for key, value in group:
+                    member(key)
+                    json.dump(value, sys.stdout)
 
-    for func in prog['functions']:
-        func_args = func['args'] if 'args' in func else []
+                continue
 
-        blocks = func_blocks(func)
-        blocks.insert(0, [{'label': '__entry'}])
+            member('functions')
+            sys.stdout.write('[')
 
-        graph = CFG.from_blocks(blocks)
-        gen = LabelGenerator(blocks)
+            for i, func in enumerate(transformed(value for _, value in group)):
+                if i:
+                    sys.stdout.write(', ')
 
-        insert_labels(blocks, gen)
-        insert_explicit_return(graph)
+                json.dump(func, sys.stdout)
 
-        to_ssa(graph, [arg['name'] for arg in func_args])
+            sys.stdout.write(']')
 
-        if args.roundtrip:
-            from_ssa(graph, gen)
+        sys.stdout.write('}')
+    else:
+        prog: Program = json.load(args.file)
+        prog['functions'] = list(transformed(prog['functions']))
 
-        func['instrs'] = flatten_blocks([node.block for node in graph.all])
+        json.dump(prog, sys.stdout)
 
-    json.dump(prog, sys.stdout)
+    if args.stats:
+        print(
+            f'phis: {stats.phis}, pruned: {stats.pruned}, local: {stats.local}, '
+            f'copies: {stats.copies}, coalesced: {stats.coalesced}, blocks: {stats.blocks}',
+            file=sys.stderr
+        )
 
 if __name__ == '__main__':
     main()
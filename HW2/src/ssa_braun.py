@@ -0,0 +1,314 @@
+from typing import Callable, Iterator, Optional, Union
+
+from cfg import Argument, CFG, Instruction, Node, Type
+from dominance import post_order
+from ssa_construct import get_label, SSAStats
+
+UNDEF = '__undef'
+
+class Phi:
+    __slots__ = ('node', 'var', 'operands', 'users', 'replaced')
+
+    def __init__(self, node: Node, var: str):
+        self.node = node
+        self.var = var
+        self.operands: Optional[list['Value']] = None
+        self.users: list['Phi'] = []
+        self.replaced: Optional['Value'] = None
+
+Value = Union[str, Phi]
+
+def phi_sccs(phis: list[Phi], resolve: Callable[[Value], Value]) -> list[list[Phi]]:
+    members = set(phis)
+    index: dict[Phi, int] = {}
+    low: dict[Phi, int] = {}
+    stack: list[Phi] = []
+    on_stack: set[Phi] = set()
+    sccs: list[list[Phi]] = []
+
+    def operands(phi: Phi) -> Iterator[Phi]:
+        assert phi.operands is not None
+
+        for operand in phi.operands:
+            operand = resolve(operand)
+
+            if isinstance(operand, Phi) and operand in members:
+                yield operand
+
+    def visit(phi: Phi) -> tuple[Phi, Iterator[Phi]]:
+        index[phi] = low[phi] = len(index)
+        stack.append(phi)
+        on_stack.add(phi)
+
+        return phi, operands(phi)
+
+    # Tarjan's algorithm with an explicit stack. An SCC is emitted only after
+    # every SCC its operands belong to.
+    for root in phis:
+        if root in index:
+            continue
+
+        work = [visit(root)]
+
+        while work:
+            phi, successors = work[-1]
+
+            for operand in successors:
+                if operand not in index:
+                    work.append(visit(operand))
+                    break
+
+                if operand in on_stack:
+                    low[phi] = min(low[phi], index[operand])
+            else:
+                work.pop()
+
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[phi])
+
+                if low[phi] == index[phi]:
+                    scc: list[Phi] = []
+
+                    while not scc or scc[-1] is not phi:
+                        on_stack.discard(top := stack.pop())
+                        scc.append(top)
+
+                    sccs.append(scc)
+
+    return sccs
+
+def remove_redundant(phis: list[Phi], resolve: Callable[[Value], Value], replace: Callable[[Phi, Value], None]):
+    # A set of phis that only refer to each other and to a single outside value
+    # is redundant as a whole, which trivial-phi removal alone can't see (for
+    # example, around irreducible loops). Phis with no outside operands are
+    # checked again on their own, nested SCCs first.
+    work = [iter(phi_sccs(phis, resolve))]
+
+    while work:
+        scc = next(work[-1], None)
+
+        if scc is None:
+            work.pop()
+            continue
+
+        scc = [phi for phi in scc if phi.replaced is None]
+        members = set(scc)
+        outer: set[Value] = set()
+        inner: list[Phi] = []
+
+        for phi in scc:
+            assert phi.operands is not None
+
+            operands = {resolve(operand) for operand in phi.operands}
+
+            if operands <= members:
+                inner.append(phi)
+            else:
+                outer |= operands - members
+
+        if len(outer) == 1:
+            value = outer.pop()
+
+            for phi in scc:
+                replace(phi, value)
+        elif len(outer) > 1 and inner:
+            work.append(iter(phi_sccs(inner, resolve)))
+
+def braun_ssa(graph: CFG, args: list[Argument]) -> SSAStats:
+    current: dict[str, dict[int, Value]] = {}
+    sealed = [False for _ in graph.all]
+    incomplete: list[list[Phi]] = [[] for _ in graph.all]
+    unfilled = [len(node.ins) for node in graph.all]
+    phis: list[list[Phi]] = [[] for _ in graph.all]
+    pending: list[Phi] = []
+    stats = SSAStats()
+
+    def resolve(value: Value) -> Value:
+        root = value
+
+        while isinstance(root, Phi) and root.replaced is not None:
+            root = root.replaced
+
+        while isinstance(value, Phi) and value.replaced is not None:
+            value.replaced, value = root, value.replaced
+
+        return root
+
+    def new_phi(node: Node, var: str) -> Phi:
+        phi = Phi(node, var)
+        phis[node.id].append(phi)
+
+        return phi
+
+    def read(var: str, node: Node) -> Value:
+        defs = current.setdefault(var, {})
+        path: list[Node] = []
+        on_path: set[int] = set()
+
+        # Walk up through single-predecessor blocks until a definition is
+        # found or a phi is needed.
+        while (value := defs.get(node.id)) is None:
+            path.append(node)
+            on_path.add(node.id)
+
+            if not sealed[node.id]:
+                value = new_phi(node, var)
+                incomplete[node.id].append(value)
+            elif len(node.ins) == 1 and node.ins[0].id not in on_path:
+                node = node.ins[0]
+                continue
+            elif not node.ins:
+                value = UNDEF
+            else:
+                # Operands are filled in later from `pending`; writing the phi
+                # first is what breaks cycles through loops (including cycles
+                # of single-predecessor blocks, which are unreachable).
+                value = new_phi(node, var)
+                pending.append(value)
+
+            break
+
+        value = resolve(value)
+
+        for visited in path:
+            defs[visited.id] = value
+
+        return value
+
+    def remove_trivial(phi: Phi):
+        check = [phi]
+
+        while check:
+            phi = check.pop()
+
+            if phi.replaced is not None or phi.operands is None:
+                continue
+
+            same: Optional[Value] = None
+            trivial = True
+
+            for operand in phi.operands:
+                operand = resolve(operand)
+
+                if operand is phi or operand == same:
+                    continue
+
+                if same is not None:
+                    trivial = False
+                    break
+
+                same = operand
+
+            if not trivial:
+                continue
+
+            replace(phi, same if same is not None else UNDEF)
+            check.extend(user for user in phi.users if user is not phi)
+
+    def replace(phi: Phi, value: Value):
+        phi.replaced = value
+        stats.pruned += 1
+
+        if isinstance(value, Phi):
+            value.users.extend(phi.users)
+
+    def fill_pending():
+        while pending:
+            phi = pending.pop()
+            phi.operands = [read(phi.var, pred) for pred in phi.node.ins]
+
+            for operand in phi.operands:
+                if isinstance(operand, Phi):
+                    operand.users.append(phi)
+
+            remove_trivial(phi)
+
+    def seal(node: Node):
+        pending.extend(incomplete[node.id])
+        incomplete[node.id] = []
+        sealed[node.id] = True
+
+        fill_pending()
+
+    # Arguments are typed here too: a phi merging one with UNDEF (from an
+    # unreachable predecessor) is never trivial, and has no dest to type it.
+    types: dict[str, Type] = {arg['name']: arg['type'] for arg in args}
+    next: dict[str, int] = {}
+    used: list[tuple[Instruction, list[Value]]] = []
+
+    for arg in args:
+        current[arg['name']] = {graph.entry.id: arg['name']}
+
+    order = list(post_order(graph))[::-1]
+    reached = {node.id for node in order}
+    order += [node for node in graph.all if node.id not in reached]
+
+    for node in order:
+        if not unfilled[node.id] and not sealed[node.id]:
+            seal(node)
+
+        for item in node.block:
+            if 'args' in item:
+                used.append((item, [read(arg, node) for arg in item['args']]))
+
+            if 'dest' in item:
+                assert 'type' in item
+
+                var = item['dest']
+                types[var] = item['type']
+                n = next.get(var, 0)
+                next[var] = n + 1
+
+                item['dest'] = f'{var}.{n}'
+                current.setdefault(var, {})[node.id] = item['dest']
+
+        fill_pending()
+
+        for successor in node.outs:
+            unfilled[successor.id] -= 1
+
+            if not unfilled[successor.id] and not sealed[successor.id]:
+                seal(successor)
+
+    remove_redundant([phi for node_phis in phis for phi in node_phis if phi.replaced is None], resolve, replace)
+
+    names: dict[int, str] = {}
+
+    def name(value: Value) -> str:
+        value = resolve(value)
+
+        if isinstance(value, str):
+            return value
+
+        return names[id(value)]
+
+    live_phis = [
+        [phi for phi in node_phis if phi.replaced is None] for node_phis in phis
+    ]
+
+    for node_phis in live_phis:
+        for phi in node_phis:
+            n = next.get(phi.var, 0)
+            next[phi.var] = n + 1
+            names[id(phi)] = f'{phi.var}.{n}'
+
+    for item, values in used:
+        item['args'] = [name(value) for value in values]
+
+    for node, node_phis in zip(graph.all, live_phis):
+        for phi in reversed(node_phis):
+            assert phi.operands is not None
+
+            instr: Instruction = {
+                'op': 'phi',
+                'dest': names[id(phi)],
+                'labels': [get_label(pred.block) for pred in node.ins],
+                'args': [name(operand) for operand in phi.operands],
+                'type': types[phi.var],
+            }
+
+            node.block.insert('label' in node.block[0], instr)
+            stats.phis += 1
+
+    return stats
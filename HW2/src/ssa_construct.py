@@ -2,9 +2,11 @@ import argparse
 import json
 import sys
 from collections import defaultdict
+from dataclasses import astuple, dataclass
+from typing import Callable, Optional, Sequence
 
-from cfg import BasicBlock, flatten_blocks, func_blocks, CFG, Node, Instruction, Program, Type
-from dominance import dom_frontier, dom_tree, dominators
+from cfg import BasicBlock, flatten_blocks, func_blocks, is_term, CFG, Node, Instruction, Program, Type
+from dominance import dom_tree, dominators, DominatorTree, idom_frontier, iterative_idom, post_order, semi_nca, tree_idom
 
 class LabelGenerator:
     def __init__(self, blocks: list[BasicBlock]):
@@ -31,69 +33,306 @@ def get_label(block: BasicBlock) -> str:
 
     return block[0]["label"]
 
-def to_ssa(graph: CFG, args: list[str]):
-    dom = dominators(graph)
-    frontier = dom_frontier(graph, dom)
-    tree = dom_tree(graph, dom)
+@dataclass
+class SSAStats:
+    phis: int = 0
+    pruned: int = 0
+    local: int = 0
+    copies: int = 0
+    coalesced: int = 0
+    blocks: int = 0
+
+    def __add__(self, other: 'SSAStats') -> 'SSAStats':
+        return SSAStats(*(a + b for a, b in zip(astuple(self), astuple(other))))
+
+def block_uses(block: BasicBlock) -> tuple[set[str], set[str]]:
+    used: set[str] = set()
+    defined: set[str] = set()
+
+    for item in block:
+        # A phi's arguments are read at the end of its predecessors.
+        if 'args' in item and item['op'] != 'phi':
+            used.update(arg for arg in item['args'] if arg not in defined)
+
+        if 'dest' in item:
+            defined.add(item['dest'])
+
+    return used, defined
+
+def global_names(graph: CFG) -> set[str]:
+    names: set[str] = set()
+
+    for node in graph.all:
+        names |= block_uses(node.block)[0]
+
+    return names
+
+def liveness(graph: CFG) -> tuple[list[set[str]], list[set[str]]]:
+    uses: list[set[str]] = []
+    kills: list[set[str]] = []
+    phi_uses: list[set[str]] = [set() for _ in graph.all]
+
+    for node in graph.all:
+        used, defined = block_uses(node.block)
+        uses.append(used)
+        kills.append(defined)
+
+        for item in node.block:
+            if 'op' in item and item['op'] == 'phi':
+                for pred, arg in zip(node.ins, item['args']):
+                    if arg != '__undef':
+                        phi_uses[pred.id].add(arg)
+
+    live = [set(used) for used in uses]
+    live_out = [set(used) for used in phi_uses]
+
+    # Pushing in reverse post order pops successors before their predecessors.
+    order = list(post_order(graph))
+    reached = {node.id for node in order}
+    work = [node for node in graph.all if node.id not in reached] + order[::-1]
+    queued = [True for _ in graph.all]
+
+    while work:
+        node = work.pop()
+        queued[node.id] = False
+
+        live_out[node.id] = phi_uses[node.id].union(*(live[successor.id] for successor in node.outs))
+        new = uses[node.id] | (live_out[node.id] - kills[node.id])
+
+        if new != live[node.id]:
+            live[node.id] = new
+
+            for pred in node.ins:
+                if not queued[pred.id]:
+                    queued[pred.id] = True
+                    work.append(pred)
+
+    return live, live_out
+
+def live_in(graph: CFG) -> list[set[str]]:
+    return liveness(graph)[0]
+
+# Merging two classes checks every pair of their members; past this many
+# pairs the merge is skipped, which keeps very long phi webs from going
+# quadratic.
+COALESCE_LIMIT = 4096
+
+def coalesce(graph: CFG, args: Sequence[str]) -> dict[str, str]:
+    tree = DominatorTree(graph, semi_nca(graph))
+    _, live_out = liveness(graph)
+
+    # Where each name is defined, as (node, position). Phis define at -1,
+    # before the block's first instruction, and arguments at -2 in the entry.
+    site: dict[str, tuple[Node, int]] = {arg: (graph.entry, -2) for arg in args}
+    last_use: list[dict[str, int]] = [{} for _ in graph.all]
+    phis: list[Instruction] = []
+
+    for node in graph.all:
+        for i, item in enumerate(node.block):
+            if 'op' not in item:
+                continue
+
+            if item['op'] == 'phi':
+                assert 'dest' in item
+
+                site[item['dest']] = (node, -1)
+                phis.append(item)
+                continue
+
+            for arg in item.get('args', []):
+                last_use[node.id][arg] = i
+
+            if 'dest' in item:
+                site[item['dest']] = (node, i)
+
+    def live_after(var: str, node: Node, i: int) -> bool:
+        return var in live_out[node.id] or last_use[node.id].get(var, -3) > i
+
+    # Two SSA names interfere iff the one defined first (which then dominates
+    # the other's definition) is still live right after the other's.
+    def interfere(a: str, b: str) -> bool:
+        (node_a, i_a), (node_b, i_b) = site[a], site[b]
+
+        if node_a is node_b and i_a == i_b:
+            return True
+
+        if tree.dominates(node_a, node_b) and (node_a is not node_b or i_a < i_b):
+            return live_after(a, node_b, i_b)
+
+        if tree.dominates(node_b, node_a):
+            return live_after(b, node_a, i_a)
+
+        return False
+
+    parent: dict[str, str] = {}
+    members: dict[str, list[str]] = {}
+
+    def find(var: str) -> str:
+        while var in parent:
+            var = parent[var]
+
+        return var
+
+    for phi in phis:
+        assert 'dest' in phi and 'args' in phi
+
+        for arg in phi['args']:
+            if arg not in site:
+                continue
+
+            a, d = find(arg), find(phi['dest'])
+
+            if a == d or a in args and d in args:
+                continue
+
+            in_a, in_d = members.get(a, [a]), members.get(d, [d])
+
+            if len(in_a) * len(in_d) > COALESCE_LIMIT:
+                continue
+
+            if any(interfere(x, y) for x in in_a for y in in_d):
+                continue
+
+            # Arguments keep their names, since the function signature uses
+            # them.
+            if a in args:
+                a, d, in_a, in_d = d, a, in_d, in_a
+
+            parent[a] = d
+            members[d] = in_d + in_a
+            members.pop(a, None)
+
+    return {var: find(var) for var in parent}
+
+def place_phis(
+    graph: CFG,
+    frontier: list[set[Node]],
+    defs: dict[str, list[Node]],
+    live: Optional[list[set[str]]] = None,
+    stats: Optional[SSAStats] = None
+) -> list[list[str]]:
+    placed: list[list[str]] = [[] for _ in graph.all]
+
+    # has_already[i] and work[i] hold the number of the last variable that got
+    # a phi at node i, or that put node i on the worklist, so neither needs
+    # clearing between variables.
+    has_already = [0 for _ in graph.all]
+    work = [0 for _ in graph.all]
+
+    for k, var in enumerate(defs, 1):
+        worklist = []
+
+        for node in defs[var]:
+            if work[node.id] != k:
+                work[node.id] = k
+                worklist.append(node)
+
+        while worklist:
+            for node in frontier[worklist.pop().id]:
+                if has_already[node.id] == k:
+                    continue
+
+                has_already[node.id] = k
+
+                if live is not None and var not in live[node.id]:
+                    if stats is not None:
+                        stats.pruned += 1
+
+                    continue
+
+                placed[node.id].append(var)
+
+                if stats is not None:
+                    stats.phis += 1
+
+                if work[node.id] != k:
+                    work[node.id] = k
+                    worklist.append(node)
+
+    return placed
+
+def to_ssa(graph: CFG, args: list[str], algorithm: str = 'iterative', ssa: str = 'minimal') -> SSAStats:
+    if algorithm == 'lt':
+        idom = semi_nca(graph)
+    elif algorithm == 'sets':
+        # Quadratic; only kept to check the other two against
+        idom = tree_idom(dom_tree(graph, dominators(graph)))
+    else:
+        idom = iterative_idom(graph)
+
+    frontier = idom_frontier(graph, idom)
+    tree = DominatorTree(graph, idom)
 
     defs: dict[str, list[Node]] = defaultdict(list)
     vars: list[set[str]] = [set() for _ in graph.all]
     types: dict[str, Type] = {}
 
+    # Semi-pruned SSA only gives phis to names that are used before being
+    # defined in some block. Every use of any other name follows a definition
+    # in the same block, so it is renamed locally and never enters the frontier
+    # iteration or the rename stacks.
+    globals = global_names(graph) if ssa == 'semi' else None
+
     for node in graph.all:
         for item in node.block:
             if 'dest' in item and (var := item['dest']) not in vars[node.id]:
                 assert 'type' in item
 
                 vars[node.id].add(var)
-                defs[var].append(node)
                 types[var] = item['type']
 
-    phis: list[set[str]] = [set() for _ in graph.all]
+                if globals is None or var in globals:
+                    defs[var].append(node)
+
     orig: dict[int, str] = {}
+    stats = SSAStats()
 
-    for var in defs:
-        while defs[var]:
-            for node in frontier[defs[var].pop().id]:
-                if var not in phis[node.id]:
-                    phis[node.id].add(var)
+    # Pruned SSA only places a phi where the variable is live on entry; any
+    # other phi would be dead.
+    live = live_in(graph) if ssa == 'pruned' else None
 
-                    instr: Instruction = {
-                        'op': 'phi',
-                        'dest': var,
-                        'labels': [get_label(pred.block) for pred in node.ins],
-                        'args': [var for _ in node.ins],
-                        'type': types[var],
-                    }
+    for node, placed in zip(graph.all, place_phis(graph, frontier, defs, live, stats)):
+        for var in placed:
+            instr: Instruction = {
+                'op': 'phi',
+                'dest': var,
+                'labels': [get_label(pred.block) for pred in node.ins],
+                'args': [var for _ in node.ins],
+                'type': types[var],
+            }
 
-                    node.block.insert('label' in node.block[0], instr)
-                    orig[id(instr)] = var
+            node.block.insert('label' in node.block[0], instr)
+            orig[id(instr)] = var
 
-                    if var not in vars[node.id]:
-                        defs[var].append(node)
+    stack: dict[str, list[str]] = {var: [] for var in types}
+    next: dict[str, int] = {var: 0 for var in types}
 
-    stack: dict[str, list[str]] = {var: [] for var in defs}
-    next: dict[str, int] = {var: 0 for var in defs}
+    if globals is not None:
+        stats.local = len(types.keys() - globals)
 
     for arg in args:
         stack[arg] = [arg]
 
-    def rename(node: Node):
+    def rename(node: Node) -> dict[str, int]:
         pop: dict[str, int] = defaultdict(lambda: 0)
+        local: dict[str, str] = {}
 
         for item in node.block:
             if 'args' in item and item['op'] != 'phi':
-                item['args'] = [stack[arg][-1] for arg in item['args']]
+                item['args'] = [local[arg] if arg in local else stack[arg][-1] for arg in item['args']]
 
             if 'dest' in item:
                 dest = item['dest']
 
                 new = f'{dest}.{next[dest]}'
                 next[dest] += 1
-                pop[dest] += 1
-
                 item['dest'] = new
-                stack[dest].append(new)
+
+                if globals is not None and dest not in globals:
+                    local[dest] = new
+                else:
+                    pop[dest] += 1
+                    stack[dest].append(new)
 
         for successor in node.outs:
             for item in successor.block:
@@ -105,57 +344,153 @@ def to_ssa(graph: CFG, args: list[str]):
 
                     item['args'][successor.ins.index(node)] = renamed
 
-        for child in tree[node.id].children:
-            rename(child.node)
+        return pop
+
+    work: list[tuple[Node, Optional[dict[str, int]]]] = [(graph.entry, None)]
+
+    while work:
+        node, pop = work.pop()
+
+        if pop is not None:
+            for var in pop:
+                del stack[var][-pop[var]:]
 
-        for var in pop:
-            del stack[var][-pop[var]:]
+            continue
 
-    rename(graph.entry)
+        work.append((node, rename(node)))
+        work.extend((child, None) for child in reversed(list(tree.children(node))))
+
+    return stats
 
 def replace_target(block: BasicBlock, old: str, new: str):
     last = block[-1]
 
     if 'labels' in last:
-        last['labels'] = [
-            new if label == old else label
-                for label in last['labels']
-        ]
+        # Only the first match: a br with both targets equal is two edges,
+        # and each may be split on its own.
+        labels = list(last['labels'])
+        labels[labels.index(old)] = new
+        last['labels'] = labels
     else:
         block.append({'op': 'jmp', 'labels': [new]})
 
-def from_ssa(graph: CFG, gen: LabelGenerator):
+Copy = tuple[str, Optional[str], Type]
+
+def sequentialize(copies: list[Copy], temp: Callable[[], str]) -> list[Instruction]:
+    pending: dict[str, tuple[Optional[str], Type]] = {
+        dest: (src, type) for dest, src, type in copies if dest != src
+    }
+    readers: dict[str, int] = defaultdict(int)
+
+    for src, _ in pending.values():
+        if src is not None:
+            readers[src] += 1
+
+    ready = [dest for dest in pending if not readers[dest]]
+    instrs: list[Instruction] = []
+
+    while pending:
+        while ready:
+            dest = ready.pop()
+            src, type = pending.pop(dest)
+
+            if src is None:
+                instrs.append({'op': 'const', 'dest': dest, 'type': type, 'value': 0})
+                continue
+
+            instrs.append({'op': 'id', 'dest': dest, 'type': type, 'args': [src]})
+            readers[src] -= 1
+
+            if not readers[src] and src in pending:
+                ready.append(src)
+
+        if pending:
+            # Everything left is part of a cycle, like a swap. Save one of its
+            # values in a temporary so that its variable can be overwritten.
+            dest = next(iter(pending))
+            saved = temp()
+            instrs.append({'op': 'id', 'dest': saved, 'type': pending[dest][1], 'args': [dest]})
+
+            for other, (src, type) in pending.items():
+                if src == dest:
+                    pending[other] = (saved, type)
+
+            readers[saved] = readers[dest]
+            readers[dest] = 0
+            ready.append(dest)
+
+    return instrs
+
+def insert_before_term(block: BasicBlock, instrs: list[Instruction]):
+    last = block[-1]
+    at = len(block) - 1 if 'op' in last and is_term(last) else len(block)
+
+    block[at:at] = instrs
+
+def from_ssa(graph: CFG, gen: LabelGenerator, args: Sequence[str] = (), coalescing: bool = True) -> SSAStats:
+    stats = SSAStats()
+    temps = 0
+
+    # Phi webs whose names don't interfere share one name, so their copies
+    # become no-ops and are dropped.
+    names = coalesce(graph, args) if coalescing else {}
+
+    if names:
+        for node in graph.all:
+            for item in node.block:
+                if 'dest' in item:
+                    item['dest'] = names.get(item['dest'], item['dest'])
+
+                if 'args' in item:
+                    item['args'] = [names.get(arg, arg) for arg in item['args']]
+
+    def temp() -> str:
+        nonlocal temps
+        temps += 1
+
+        return f'__copy{temps - 1}'
+
     for i in range(len(graph.all)):
         node = graph.all[i]
+        phis = [item for item in node.block if 'op' in item and item['op'] == 'phi']
+
+        if not phis:
+            continue
+
+        node.block = [item for item in node.block if 'op' not in item or item['op'] != 'phi']
 
         for j, pred in enumerate(node.ins):
-            assignments: list[Instruction] = []
+            copies: list[Copy] = []
 
-            for item in node.block:
-                if 'op' in item and item['op'] == 'phi':
-                    assert 'args' in item
-                    assert 'dest' in item
-                    assert 'type' in item
+            for phi in phis:
+                assert 'args' in phi
+                assert 'dest' in phi
+                assert 'type' in phi
 
-                    arg = item['args'][j]
+                arg = phi['args'][j]
+                copies.append((phi['dest'], arg if arg != '__undef' else None, phi['type']))
 
-                    if arg != '__undef':
-                        assignments.append({
-                            'op': 'id',
-                            'dest': item['dest'],
-                            'args': [arg]
-                        })
-                    else:
-                        assignments.append({
-                            'op': 'const',
-                            'dest': item['dest'],
-                            'type': item['type'],
-                            'value': 0,
-                        })
+            stats.coalesced += sum(1 for dest, src, _ in copies if dest == src)
+            assignments = sequentialize(copies, temp)
 
             if not assignments:
                 continue
 
+            stats.copies += len(assignments)
+
+            # The copies can go at the end of the predecessor if this is its
+            # only successor, or at the start of this block if that is its only
+            # predecessor. Otherwise the edge is critical and gets a block of
+            # its own.
+            if len(pred.outs) == 1:
+                insert_before_term(pred.block, assignments)
+                continue
+
+            if len(node.ins) == 1:
+                at = 'label' in node.block[0]
+                node.block[at:at] = assignments
+                continue
+
             this_label = get_label(node.block)
             new_label = gen.next()
 
@@ -174,11 +509,9 @@ def from_ssa(graph: CFG, gen: LabelGenerator):
 
             pred.outs[pred.outs.index(node)] = graph.all[-1]
             node.ins[j] = graph.all[-1]
+            stats.blocks += 1
 
-        node.block = [
-            item for item in node.block
-                if 'op' not in item or item['op'] != 'phi'
-        ]
+    return stats
 
 def insert_explicit_return(graph: CFG):
     for node in graph.exits:
@@ -0,0 +1,115 @@
+import json
+from typing import Any, Iterator, TextIO
+
+CHUNK = 1 << 16
+
+# Chars that may continue a number's token
+NUMBER_CHARS = '0123456789+-.eE'
+
+class Reader:
+    def __init__(self, file: TextIO, chunk: int = CHUNK):
+        self.file = file
+        self.chunk = chunk
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self, size: int) -> bool:
+        if self.eof:
+            return False
+
+        data = self.file.read(size)
+
+        if not data:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self.fill(self.chunk):
+                raise json.JSONDecodeError('unexpected end of input', self.buf, self.pos)
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f'expected {char!r}', self.buf, self.pos)
+
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        size = self.chunk
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+
+                # Objects, arrays and strings are complete once decoded. A
+                # number is only complete once something that can't continue
+                # it follows: '1.5e' decodes as 1.5 when the chunk ends there.
+                k = end
+                while k < len(self.buf) and self.buf[k] in NUMBER_CHARS:
+                    k += 1
+                if k < len(self.buf) or self.eof or self.buf[self.pos] in '{["':
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            # The value runs past the end of the buffer. Read more, doubling
+            # the amount each time so a large value is re-scanned only
+            # O(log n) times.
+            self.fill(size)
+            size *= 2
+
+# Yields ('function', func) for each element of the program's functions array,
+# and (key, value) for every other top-level member, in input order. An empty
+# functions array comes out as ('functions', []), so that it isn't lost.
+# HW3's driver reads programs through this module too.
+def stream_program(file: TextIO) -> Iterator[tuple[str, Any]]:
+    reader = Reader(file)
+    reader.expect('{')
+
+    if reader.peek() == '}':
+        return
+
+    while True:
+        key = reader.value()
+        reader.expect(':')
+
+        if key == 'functions':
+            reader.expect('[')
+
+            if reader.peek() == ']':
+                yield key, []
+            else:
+                while True:
+                    yield 'function', reader.value()
+
+                    if reader.peek() != ',':
+                        break
+
+                    reader.pos += 1
+
+            reader.expect(']')
+        else:
+            yield key, reader.value()
+
+        if reader.peek() != ',':
+            break
+
+        reader.pos += 1
+
+    reader.expect('}')
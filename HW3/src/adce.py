@@ -0,0 +1,141 @@
+from cfg import CFG
+from dominance import PostDominators
+
+# ------------------------------------------------------------------------------
+# Aggressive dead code elimination (Cytron et al.) on the SSA form built by
+# to_ssa.
+#
+# Instructions are assumed dead until shown live. The roots are the ones with
+# side effects, and the ends of the blocks only the function's exit
+# post-dominates (which includes a block of every infinite loop; the loop has
+# to keep looping). Marking then follows uses back to their defs, and from
+# every block holding a live instruction to the branches it is control
+# dependent on. A live phi also makes the end of each of its predecessors
+# live, since which one ran decides its value.
+#
+# Everything left unmarked is deleted, dead phi cycles included. A dead
+# branch becomes a jump to its block's nearest post-dominator that is still
+# live (no live code runs on any path in between), and blocks no longer
+# reachable from the entry are removed.
+# ------------------------------------------------------------------------------
+
+# Ops with no effect beyond defining their dest
+REMOVABLE = {'const', 'id', 'phi', 'add', 'mul', 'sub', 'div', 'eq', 'lt',
+             'gt', 'le', 'ge', 'and', 'or', 'not', 'ptradd', 'isnull',
+             'load', 'getmbr', 'alloc'}
+
+
+# func: a function in SSA form, every block labeled (as to_ssa leaves it)
+# stats: optional dict; its 'dead', 'dead_branches' and 'dead_blocks' counts
+#        are incremented with the instructions deleted, the branches turned
+#        into jumps, and the blocks removed.
+def adce(func, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('dead', 0)
+    stats.setdefault('dead_branches', 0)
+    stats.setdefault('dead_blocks', 0)
+
+    g = CFG(func)
+    pdoms = PostDominators(func, g)
+    block_of = {name: b for b, name in enumerate(g.names)}
+
+    # var -> (block, instr) defining it
+    defs = {}
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            if 'dest' in instr:
+                defs[instr['dest']] = (b, instr)
+
+    # Marks are kept by id(), as instrs are dicts
+    live = set()
+    live_blocks = [False] * g.n
+    work = []
+
+    def mark(b, instr):
+        if id(instr) not in live:
+            live.add(id(instr))
+            work.append((b, instr))
+
+    def mark_end(b):
+        end = g.blocks[b][-1]
+        if end.get('op') in ('br', 'jmp', 'ret'):
+            mark(b, end)
+        else:
+            # falls off the end of the function
+            mark_block(b)
+
+    def mark_block(b):
+        if live_blocks[b]:
+            return
+        live_blocks[b] = True
+        for c in pdoms.frontier[b]:
+            mark(c, g.blocks[c][-1])
+
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            op = instr.get('op')
+            if op is not None and op not in REMOVABLE and op not in ('br', 'jmp'):
+                mark(b, instr)
+        # A branch with no live post-dominator to jump to instead is kept
+        if not g.edges[b] or pdoms.ipdom[b] == g.n:
+            mark_end(b)
+
+    while work:
+        b, instr = work.pop()
+        mark_block(b)
+
+        args = instr.get('args', [])
+        if instr['op'] == 'getmbr':  # second arg is a member name
+            args = args[:1]
+        for a in args:
+            if a in defs:
+                mark(*defs[a])
+
+        if instr['op'] == 'phi':
+            for lbl in instr['labels']:
+                if lbl in block_of:
+                    mark_end(block_of[lbl])
+
+    # Sweep, then drop the blocks a rewritten branch no longer leads to
+    for b, block in enumerate(g.blocks):
+        newblock = []
+        for instr in block:
+            if 'label' in instr or id(instr) in live or instr['op'] == 'jmp':
+                newblock.append(instr)
+                continue
+
+            if instr['op'] == 'br':
+                # blocks only the exit post-dominates are live, so this
+                # stops short of the exit
+                target = pdoms.ipdom[b]
+                while not live_blocks[target]:
+                    target = pdoms.ipdom[target]
+                newblock.append({'op': 'jmp', 'labels': [g.names[target]]})
+                stats['dead_branches'] += 1
+                continue
+            stats['dead'] += 1
+        g.blocks[b] = newblock
+
+    reachable = set()
+    stack = [0]
+    while stack:
+        b = stack.pop()
+        if b in reachable:
+            continue
+        reachable.add(b)
+        end = g.blocks[b][-1]
+        if end.get('op') in ('br', 'jmp'):
+            stack.extend(block_of[lbl] for lbl in end['labels'])
+        elif end.get('op') != 'ret' and b + 1 < g.n:
+            stack.append(b + 1)
+
+    newinstrs = []
+    for b, block in enumerate(g.blocks):
+        if b not in reachable:
+            stats['dead_blocks'] += 1
+            continue
+        newinstrs += block
+
+    func['instrs'] = newinstrs
+    return func
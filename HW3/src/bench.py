@@ -0,0 +1,850 @@
+"""Benchmarks for the passes in this directory.
+
+Usage: python3 bench.py <benchmark> [options]
+
+Each benchmark builds synthetic Bril functions (as json-style dicts) so that
+it can be run without the Bril toolchain installed.
+"""
+import argparse
+import contextlib
+import copy
+import gc
+import io
+import json
+import os
+import random
+import time
+
+from cfg import CFG, loop_forest, rd_init, rd_merge, rd_xfer, run_worklist
+from dataflow import available_expressions, liveness, reaching_definitions
+from dominance import Dominators, idom_frontier
+from driver import PASSES
+from ssa_construct import from_ssa, place_phis, to_ssa
+from ssa_to_llvm import OPS, Context, Module, TextSink, emit_func, is_ptr_type
+
+
+def random_func(n, seed=0, window=8, back=0.1, ssa=False):
+    """A function of n blocks in a single chain, where each block may also
+    branch forward (or, with probability back, backward) to a block at most
+    window blocks away. Every block is reachable from the entry.
+    With ssa, every block defines its own variable and reads one defined by a
+    block in the window before it.
+    """
+    rng = random.Random(seed)
+    instrs = []
+    for i in range(n):
+        instrs.append({'label': 'b{}'.format(i)})
+        if ssa:
+            used = 'v{}'.format(rng.randint(max(0, i - window), max(0, i - 1)))
+            instrs.append({'op': 'add', 'dest': 'v{}'.format(i), 'type': 'int',
+                           'args': [used, used]})
+        else:
+            instrs.append({'op': 'const', 'dest': 'v', 'type': 'int', 'value': i})
+        if i == n - 1:
+            instrs.append({'op': 'ret'})
+        elif rng.random() < 0.5:
+            instrs.append({'op': 'jmp', 'labels': ['b{}'.format(i + 1)]})
+        else:
+            if rng.random() < back:
+                other = rng.randint(max(0, i - window), i)
+            else:
+                other = rng.randint(i + 1, min(n - 1, i + window))
+            instrs.append({'op': 'br', 'args': ['c'],
+                           'labels': ['b{}'.format(i + 1), 'b{}'.format(other)]})
+    return {'name': 'f{}'.format(n), 'instrs': instrs}
+
+
+def switch_func(n, depth=1):
+    """A function with an n-way switch, lowered to a chain of compare-and-branch
+    blocks that each enter one case; all cases meet at a single join. With
+    depth > 1 every case contains a smaller switch of its own.
+    """
+    instrs = []
+    count = [0]
+
+    def fresh():
+        count[0] += 1
+        return 'l{}'.format(count[0])
+
+    def switch(entry, join, n, depth):
+        instrs.append({'label': entry})
+        for i in range(n):
+            case, rest = fresh(), fresh()
+            instrs.append({'op': 'br', 'args': ['c'], 'labels': [case, rest]})
+            instrs.append({'label': case})
+            if depth > 1:
+                inner = fresh()
+                instrs.append({'op': 'jmp', 'labels': [inner]})
+                switch(inner, join, max(1, n // 4), depth - 1)
+            else:
+                instrs.append({'op': 'const', 'dest': 'v', 'type': 'int', 'value': i})
+                instrs.append({'op': 'jmp', 'labels': [join]})
+            instrs.append({'label': rest})
+        instrs.append({'op': 'jmp', 'labels': [join]})
+
+    switch(fresh(), 'join', n, depth)
+    instrs.append({'label': 'join'})
+    instrs.append({'op': 'ret'})
+    return {'name': 'switch{}'.format(n), 'instrs': instrs}
+
+
+def chain_func(n, nested=False):
+    """main with n blocks that each increment x. Straight-line, the blocks
+    simply jump to the next one; nested, each block either enters the next
+    one or leaves to its own join block, so the joins nest n deep:
+    if (c) { if (c) { ... } }.
+    """
+    instrs = [
+        {'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+        {'op': 'const', 'dest': 'c', 'type': 'bool', 'value': True},
+    ]
+    for i in range(n):
+        instrs.append({'label': 'b{}'.format(i)})
+        instrs.append({'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 'one']})
+        if i == n - 1:
+            instrs.append({'op': 'jmp', 'labels': ['j{}'.format(i) if nested else 'done']})
+        elif nested:
+            instrs.append({'op': 'br', 'args': ['c'],
+                           'labels': ['b{}'.format(i + 1), 'j{}'.format(i)]})
+        else:
+            instrs.append({'op': 'jmp', 'labels': ['b{}'.format(i + 1)]})
+    if nested:
+        for i in reversed(range(n)):
+            instrs.append({'label': 'j{}'.format(i)})
+            instrs.append({'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 'one']})
+            instrs.append({'op': 'jmp', 'labels': ['j{}'.format(i - 1) if i else 'done']})
+    instrs.append({'label': 'done'})
+    instrs.append({'op': 'print', 'args': ['x']})
+    return {'name': 'main', 'instrs': instrs}
+
+
+def run_chain(func):
+    """The lines chain_func's main prints. Runs only the ops chain_func and
+    the SSA round trip produce, phis included, so a conversion can be checked
+    without brili.
+    """
+    instrs = func['instrs']
+    at = {instr['label']: i for i, instr in enumerate(instrs) if 'label' in instr}
+    env = {}
+    printed = []
+    label = came_from = None
+    i = 0
+    while i < len(instrs):
+        instr = instrs[i]
+        i += 1
+        if 'label' in instr:
+            label, came_from = instr['label'], label
+            continue
+        op = instr['op']
+        args = [env[a] for a in instr.get('args', [])]
+        if op == 'const':
+            env[instr['dest']] = instr['value']
+        elif op == 'id':
+            env[instr['dest']] = args[0]
+        elif op == 'add':
+            env[instr['dest']] = args[0] + args[1]
+        elif op == 'phi':
+            env[instr['dest']] = env[instr['args'][instr['labels'].index(came_from)]]
+        elif op == 'print':
+            printed.append(' '.join(str(a).lower() for a in args))
+        elif op == 'jmp':
+            i = at[instr['labels'][0]]
+        elif op == 'br':
+            i = at[instr['labels'][0 if args[0] else 1]]
+        elif op == 'ret':
+            break
+        else:
+            raise ValueError('run_chain: unexpected op {}'.format(op))
+    return printed
+
+
+def temps_func(n, seed=0, temps=8):
+    """random_func's CFG, but every block recomputes `temps` temporaries from x
+    and folds them back into x, the way lowered expressions do. Only x is live
+    across blocks; the temporaries are dead at every join.
+    """
+    func = random_func(n, seed)
+    instrs = [
+        {'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+        {'op': 'const', 'dest': 'c', 'type': 'bool', 'value': False},
+    ]
+    for instr in func['instrs']:
+        if instr.get('op') != 'const':
+            instrs.append(instr)
+            continue
+        prev = 'x'
+        for k in range(temps):
+            instrs.append({'op': 'add', 'dest': 't{}'.format(k), 'type': 'int',
+                           'args': [prev, 'one']})
+            prev = 't{}'.format(k)
+        instrs.append({'op': 'add', 'dest': 'x', 'type': 'int', 'args': [prev, 'x']})
+    func['instrs'] = instrs
+    return func
+
+
+def consts_func(n):
+    """A chain of n blocks, each computing from constants a value it adds
+    to x and a condition that is always false, guarding a block that is
+    never run. The function's argument m is added in as well, so x is only
+    known at run time.
+    """
+    instrs = [
+        {'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+        {'op': 'const', 'dest': 'zero', 'type': 'int', 'value': 0},
+    ]
+    for i in range(n):
+        nxt = 'b{}'.format(i + 1)
+        instrs += [
+            {'label': 'b{}'.format(i)},
+            {'op': 'const', 'dest': 'k', 'type': 'int', 'value': i},
+            {'op': 'mul', 'dest': 't', 'type': 'int', 'args': ['k', 'one']},
+            {'op': 'add', 'dest': 't', 'type': 'int', 'args': ['t', 'one']},
+            {'op': 'lt', 'dest': 'c', 'type': 'bool', 'args': ['t', 'zero']},
+            {'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 'm']},
+            {'op': 'br', 'args': ['c'], 'labels': ['d{}'.format(i), nxt]},
+            {'label': 'd{}'.format(i)},
+            {'op': 'print', 'args': ['t']},
+            {'op': 'jmp', 'labels': [nxt]},
+        ]
+    instrs += [{'label': 'b{}'.format(n)}, {'op': 'print', 'args': ['x']}]
+    return {'name': 'main', 'args': [{'name': 'm', 'type': 'int'}],
+            'instrs': instrs}
+
+
+def exprs_func(n):
+    """A chain of n blocks, each recomputing a + b, b * a and a == b from the
+    function's arguments (operands in either order) and adding them into x;
+    only the first block's computations are needed.
+    """
+    instrs = [{'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0}]
+    for i in range(n):
+        nxt = 'b{}'.format(i + 1)
+        first, second = ('a', 'b') if i % 2 else ('b', 'a')
+        instrs += [
+            {'label': 'b{}'.format(i)},
+            {'op': 'add', 'dest': 's', 'type': 'int', 'args': [first, second]},
+            {'op': 'mul', 'dest': 'p', 'type': 'int', 'args': [second, first]},
+            {'op': 'add', 'dest': 't', 'type': 'int', 'args': ['s', 'p']},
+            {'op': 'eq', 'dest': 'c', 'type': 'bool', 'args': [first, second]},
+            {'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 't']},
+            {'op': 'br', 'args': ['c'], 'labels': ['d{}'.format(i), nxt]},
+            {'label': 'd{}'.format(i)},
+            {'op': 'print', 'args': ['t']},
+            {'op': 'jmp', 'labels': [nxt]},
+        ]
+    instrs += [{'label': 'b{}'.format(n)}, {'op': 'print', 'args': ['x']}]
+    return {'name': 'main',
+            'args': [{'name': 'a', 'type': 'int'}, {'name': 'b', 'type': 'int'}],
+            'instrs': instrs}
+
+
+def dead_func(n):
+    """A chain of n diamonds, each branching on the function's argument m to
+    compute y two ways; y is carried along but never printed, only x is.
+    """
+    instrs = [
+        {'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'y', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+    ]
+    for i in range(n):
+        nxt = 'b{}'.format(i + 1)
+        instrs += [
+            {'label': 'b{}'.format(i)},
+            {'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 'm']},
+            {'op': 'lt', 'dest': 'c', 'type': 'bool', 'args': ['y', 'm']},
+            {'op': 'br', 'args': ['c'], 'labels': ['l{}'.format(i), 'r{}'.format(i)]},
+            {'label': 'l{}'.format(i)},
+            {'op': 'add', 'dest': 'y', 'type': 'int', 'args': ['y', 'one']},
+            {'op': 'jmp', 'labels': [nxt]},
+            {'label': 'r{}'.format(i)},
+            {'op': 'mul', 'dest': 'y', 'type': 'int', 'args': ['y', 'm']},
+            {'op': 'jmp', 'labels': [nxt]},
+        ]
+    instrs += [{'label': 'b{}'.format(n)}, {'op': 'print', 'args': ['x']}]
+    return {'name': 'main', 'args': [{'name': 'm', 'type': 'int'}],
+            'instrs': instrs}
+
+
+def ivs_func(n):
+    """A chain of n counted loops, each adding i * m and i * 4 + 1 into x
+    for i from 0 to 9.
+    """
+    instrs = [
+        {'op': 'const', 'dest': 'x', 'type': 'int', 'value': 0},
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+        {'op': 'const', 'dest': 'four', 'type': 'int', 'value': 4},
+        {'op': 'const', 'dest': 'ten', 'type': 'int', 'value': 10},
+    ]
+    for k in range(n):
+        head, body, nxt = 'h{}'.format(k), 'l{}'.format(k), 'b{}'.format(k + 1)
+        instrs += [
+            {'label': 'b{}'.format(k)},
+            {'op': 'const', 'dest': 'i', 'type': 'int', 'value': 0},
+            {'label': head},
+            {'op': 'lt', 'dest': 'c', 'type': 'bool', 'args': ['i', 'ten']},
+            {'op': 'br', 'args': ['c'], 'labels': [body, nxt]},
+            {'label': body},
+            {'op': 'mul', 'dest': 'p', 'type': 'int', 'args': ['i', 'm']},
+            {'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 'p']},
+            {'op': 'mul', 'dest': 'q', 'type': 'int', 'args': ['four', 'i']},
+            {'op': 'add', 'dest': 'q', 'type': 'int', 'args': ['q', 'one']},
+            {'op': 'add', 'dest': 'x', 'type': 'int', 'args': ['x', 'q']},
+            {'op': 'add', 'dest': 'i', 'type': 'int', 'args': ['i', 'one']},
+            {'op': 'jmp', 'labels': [head]},
+        ]
+    instrs += [{'label': 'b{}'.format(n)}, {'op': 'print', 'args': ['x']}]
+    return {'name': 'main', 'args': [{'name': 'm', 'type': 'int'}],
+            'instrs': instrs}
+
+
+def vars_func(n, nvars, seed=0, per_block=4):
+    """random_func's CFG, where every block assigns per_block of nvars
+    variables, chosen at random.
+    """
+    rng = random.Random(seed)
+    func = random_func(n, seed)
+    instrs = [{'op': 'const', 'dest': 'c', 'type': 'bool', 'value': False}]
+    for instr in func['instrs']:
+        if instr.get('op') != 'const':
+            instrs.append(instr)
+            continue
+        for k in range(per_block):
+            instrs.append({'op': 'const', 'dest': 'v{}'.format(rng.randrange(nvars)),
+                           'type': 'int', 'value': k})
+    func['instrs'] = instrs
+    return func
+
+
+def compile_prog(prog, ssa='minimal', stats=None, passes=()):
+    """Run the whole driver pipeline on prog, returning the LLVM text."""
+    if stats is None:
+        stats = {}
+    module = Module(prog.get('structs', []))
+    out = TextSink()
+    for func in to_ssa(prog, ssa, stats)['functions']:
+        for name in passes:
+            PASSES[name](func, stats)
+        func['name'] = '__' + func['name']
+        emit_func(func, Context(func, module), out)
+    return out.getvalue()
+
+
+def timed(fn, *args, clock=time.perf_counter):
+    start = clock()
+    result = fn(*args)
+    return clock() - start, result
+
+
+# ------------------------------------------------------------------------------
+# Dominators: idom-array engine vs. the previous set-based fixpoint
+# ------------------------------------------------------------------------------
+
+def set_dominators(g):
+    """The set-intersection fixpoint plus cubic idom search that Dominators
+    used before, kept here as the baseline."""
+    doms = [set([0])]
+    for i in range(1, g.n):
+        doms.append(set(range(g.n)))
+
+    order = g.rpo(order=[0])
+
+    changed = True
+    while changed:
+        changed = False
+        for i in order[1:]:
+            d = set(range(g.n))
+            for p in g.preds[i]:
+                d &= doms[p]
+            d.add(i)
+            if d != doms[i]:
+                changed = True
+                doms[i] = d
+
+    dt_parent = [None]
+    for i in range(1, g.n):
+        for j in doms[i]:
+            if i != j:
+                immed_dom = True
+                for k in range(g.n):
+                    if k != j and k != i and j in doms[k] and k in doms[i]:
+                        immed_dom = False
+                        break
+                if immed_dom:
+                    dt_parent.append(j)
+                    break
+    return dt_parent
+
+
+def bench_dominators(args):
+    print('{:>8} {:>12} {:>12} {:>12}'.format('blocks', 'idom (s)', 'us/block', 'sets (s)'))
+    for n in args.sizes or [1000, 5000, 10000, 20000, 50000]:
+        func = random_func(n, args.seed)
+        g = CFG(func)
+        t, d = timed(Dominators, func, g)
+
+        old = '-'
+        if n <= args.baseline_max:
+            t_old, parents = timed(set_dominators, g)
+            assert parents == [None] + list(d.idom[1:]), 'idom mismatch'
+            old = '{:.3f}'.format(t_old)
+
+        print('{:>8} {:>12.3f} {:>12.2f} {:>12}'.format(n, t, t / n * 1e6, old))
+
+
+# ------------------------------------------------------------------------------
+# Dominance frontier: idom walk-up vs. the previous union of dominator sets
+# ------------------------------------------------------------------------------
+
+def set_frontier(g, doms):
+    """The dominator-set based frontier Dominators used before."""
+    frontier = []
+    for i in range(g.n):
+        frontier.append(set())
+
+    for i, d in enumerate(doms):
+        pre_doms = set()
+        for p in g.preds[i]:
+            pre_doms |= doms[p]
+        pre_doms -= d - {i}
+        for p in pre_doms:
+            frontier[p].add(i)
+    return frontier
+
+
+def bench_frontier(args):
+    print('{:>8} {:>8} {:>12} {:>12}'.format('cases', 'blocks', 'walk (s)', 'sets (s)'))
+    for n in args.sizes or [1000, 5000, 10000, 20000, 50000]:
+        func = switch_func(n, args.depth)
+        g = CFG(func)
+        d = Dominators(func, g)
+        t, frontier = timed(idom_frontier, g.preds, d.idom)
+
+        old = '-'
+        if n <= args.baseline_max:
+            doms = d.doms
+            t_old, old_frontier = timed(set_frontier, g, doms)
+            assert frontier == old_frontier, 'frontier mismatch'
+            old = '{:.3f}'.format(t_old)
+
+        print('{:>8} {:>8} {:>12.3f} {:>12}'.format(n, g.n, t, old))
+
+
+# ------------------------------------------------------------------------------
+# Loop-nesting forest
+# ------------------------------------------------------------------------------
+
+def bench_loops(args):
+    print('{:>8} {:>8} {:>8} {:>12} {:>12}'.format(
+        'blocks', 'loops', 'depth', 'forest (s)', 'us/block'))
+    for n in args.sizes or [1000, 5000, 10000, 20000, 50000]:
+        func = random_func(n, args.seed, back=0.3)
+        g = CFG(func)
+        tree = Dominators(func, g).tree
+        t, forest = timed(loop_forest, g, tree)
+        print('{:>8} {:>8} {:>8} {:>12.3f} {:>12.2f}'.format(
+            n, len(forest.loops), max(forest.depth), t, t / n * 1e6))
+
+
+# ------------------------------------------------------------------------------
+# Dataflow: bit-vector solver vs. the dict-based run_worklist
+# ------------------------------------------------------------------------------
+
+def bench_dataflow(args):
+    print('{:>8} {:>14} {:>12} {:>12} {:>12}'.format(
+        'blocks', 'run_worklist', 'reaching', 'live', 'avail'))
+    for n in args.sizes or [1000, 5000, 10000, 20000, 50000]:
+        func = random_func(n, args.seed, ssa=True)
+
+        old = '-'
+        if n <= args.baseline_max:
+            t_old, _ = timed(run_worklist, func, rd_init, rd_xfer, rd_merge)
+            old = '{:.3f}'.format(t_old)
+
+        t_rd, _ = timed(reaching_definitions, func)
+        t_live, _ = timed(liveness, func)
+        t_avail, _ = timed(available_expressions, func)
+
+        print('{:>8} {:>14} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+            n, old, t_rd, t_live, t_avail))
+
+
+# ------------------------------------------------------------------------------
+# Stress: very long chains of blocks through the whole pipeline, at the default
+# recursion limit
+# ------------------------------------------------------------------------------
+
+def bench_stress(args):
+    print('{:>8} {:>8} {:>12}'.format('blocks', 'shape', 'compile (s)'))
+    for n in args.sizes or [100000]:
+        for nested in (False, True):
+            prog = {'functions': [chain_func(n, nested)]}
+            expected = run_chain(prog['functions'][0])
+            t, _ = timed(compile_prog, prog)
+
+            # Check the SSA form itself, not just that compiling it finished:
+            # every var is assigned once, and it runs the same both in SSA
+            # and once brought back out of it.
+            ssa = to_ssa({'functions': [chain_func(n, nested)]})
+            func = ssa['functions'][0]
+            dests = [instr['dest'] for instr in func['instrs'] if 'dest' in instr]
+            assert len(dests) == len(set(dests)), 'not SSA'
+            assert run_chain(func) == expected, 'to_ssa changed the output'
+            func = from_ssa(ssa)['functions'][0]
+            assert not any(instr.get('op') == 'phi' for instr in func['instrs']), \
+                'phi left after from_ssa'
+            assert run_chain(func) == expected, 'from_ssa changed the output'
+
+            print('{:>8} {:>8} {:>12.3f}'.format(n, 'nested' if nested else 'chain', t))
+
+
+# ------------------------------------------------------------------------------
+# Phis: minimal vs. pruned SSA, on the given Bril json files or on generated
+# functions full of block-local temporaries
+# ------------------------------------------------------------------------------
+
+def bench_phis(args):
+    progs = []
+    for fname in args.files:
+        with open(fname) as f:
+            progs.append((os.path.basename(fname), json.load(f)))
+    if not progs:
+        for n in args.sizes or [100, 1000, 5000]:
+            progs.append(('temps{}'.format(n),
+                          {'functions': [temps_func(n, args.seed)]}))
+
+    print('{:>16} {:>8} {:>8} {:>8} {:>6} {:>10} {:>12}'.format(
+        'program', 'ssa', 'phis', 'pruned', 'local', 'LLVM (KB)', 'compile (s)'))
+    for name, prog in progs:
+        for ssa in ('minimal', 'semi', 'pruned'):
+            stats = {}
+            t, text = timed(compile_prog, copy.deepcopy(prog), ssa, stats)
+            print('{:>16} {:>8} {:>8} {:>8} {:>6} {:>10.1f} {:>12.4f}'.format(
+                name, ssa, stats['phis'], stats['pruned'], stats['local'],
+                len(text) / 1024, t))
+
+
+# ------------------------------------------------------------------------------
+# Placement: the stamp-array worklist vs. the list-scanning loop it replaced,
+# with thousands of variables spread over the blocks
+# ------------------------------------------------------------------------------
+
+def list_placement(n, frontier, defs):
+    """The phi placement to_ssa used before, kept here as the baseline.
+    Mutates defs."""
+    phis = [{} for i in range(n)]
+    for v,vdefs in defs.items():
+        for d in vdefs:
+            for b in frontier[d]:
+                if v not in phis[b]:
+                    phis[b][v] = {'op':'phi', 'args':[], 'labels':[]}
+                if b not in defs[v]:
+                    defs[v].append(b)
+    return phis
+
+
+def bench_placement(args):
+    print('{:>8} {:>8} {:>8} {:>12} {:>12}'.format(
+        'blocks', 'vars', 'phis', 'stamps (s)', 'list (s)'))
+    for n in args.sizes or [1000, 5000, 10000, 20000]:
+        func = vars_func(n, args.vars, args.seed)
+        g = CFG(func)
+        frontier = Dominators(func, g).frontier
+
+        defs = {}
+        for b, block in enumerate(g.blocks):
+            for instr in block:
+                if 'dest' in instr:
+                    defs.setdefault(instr['dest'], []).append(b)
+
+        t, phis = timed(place_phis, g.n, frontier, defs)
+        count = sum(len(p) for p in phis)
+
+        old = '-'
+        if n <= args.baseline_max:
+            t_old, old_phis = timed(list_placement, g.n, frontier,
+                                    {v: list(d) for v, d in defs.items()})
+            assert [set(p) for p in old_phis] == [set(p) for p in phis]
+            old = '{:.3f}'.format(t_old)
+
+        print('{:>8} {:>8} {:>8} {:>12.3f} {:>12}'.format(
+            n, args.vars, count, t, old))
+
+
+# ------------------------------------------------------------------------------
+# Emit: LLVM emission into the sinks emit_func can write to, vs. the
+# print-per-line emission it replaced
+# ------------------------------------------------------------------------------
+
+class PrintSink:
+    """Prints each line as it is emitted, as emit_func used to; kept here as
+    the baseline."""
+    def write(self, s):
+        print(s[:-1])
+
+
+def bench_emit(args):
+    sinks = [('print', PrintSink), ('list', TextSink), ('StringIO', io.StringIO),
+             ('file', lambda: open(os.devnull, 'w', buffering=1 << 20))]
+
+    print('{:>8} {:>10} {:>10}'.format('blocks', 'sink', 'emit (s)'))
+    for n in args.sizes or [1000, 10000, 50000]:
+        func = to_ssa({'functions': [temps_func(n, args.seed)]})['functions'][0]
+        module = Module()
+        for name, make in sinks:
+            # emit_func consumes the phis' args, so each run gets a fresh copy
+            f = copy.deepcopy(func)
+            ctxt = Context(f, module)
+            out = make()
+            with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+                t, _ = timed(emit_func, f, ctxt, out)
+                if name == 'file':
+                    t_close, _ = timed(out.close)
+                    t += t_close
+            print('{:>8} {:>10} {:>10.3f}'.format(n, name, t))
+
+
+# ------------------------------------------------------------------------------
+# Dispatch: the per-op emitter table vs. the if/elif chain it replaced, over a
+# straight-line SSA function of about a million instructions
+# ------------------------------------------------------------------------------
+
+def mixed_func(n):
+    """A function already in SSA form with about n instructions, in blocks of
+    nine mixing arithmetic, comparisons, calls, prints and branches."""
+    instrs = [
+        {'op': 'const', 'dest': 'one', 'type': 'int', 'value': 1},
+        {'op': 'const', 'dest': 'v0', 'type': 'int', 'value': 0},
+    ]
+    for i in range(max(1, n // 9)):
+        v, w = 'v{}'.format(i), 'v{}'.format(i + 1)
+        c, d = 'c{}'.format(i), 'd{}'.format(i)
+        instrs += [
+            {'label': 'b{}'.format(i)},
+            {'op': 'add', 'dest': 'a' + v, 'type': 'int', 'args': [v, 'one']},
+            {'op': 'mul', 'dest': 'm' + v, 'type': 'int', 'args': ['a' + v, v]},
+            {'op': 'sub', 'dest': w, 'type': 'int', 'args': ['m' + v, 'one']},
+            {'op': 'lt', 'dest': c, 'type': 'bool', 'args': [w, v]},
+            {'op': 'not', 'dest': d, 'type': 'bool', 'args': [c]},
+            {'op': 'call', 'dest': 'r' + v, 'type': 'int', 'funcs': ['f'], 'args': [w, 'one']},
+            {'op': 'print', 'args': [w, d]},
+            {'op': 'br', 'args': [d], 'labels': ['b{}'.format(i + 1), 'b{}'.format(i + 1)]},
+        ]
+    instrs += [{'label': 'b{}'.format(max(1, n // 9))}, {'op': 'ret', 'args': []}]
+    return {'name': 'f', 'instrs': instrs}
+
+
+def old_ttype(briltype):
+    if briltype == 'int':
+        return 'i64'
+    elif briltype == 'bool':
+        return 'i1'
+    elif is_ptr_type(briltype):
+        return old_ttype(briltype['ptr']) + '*'
+    else:
+        return '%' + briltype
+
+
+def old_format_args(ctxt, args, show_types=False):
+    alist = []
+    for a in args:
+        t = ctxt.types[a]
+        if a in ctxt.constants:
+            a = ctxt.constants[a]
+            if is_ptr_type(t) and not a:
+                a = 'null'
+        elif a in ctxt.canonical:
+            a = '%' + ctxt.canonical[a]
+        else:
+            a = '%' + a
+        s = old_ttype(t) + ' ' + str(a) if show_types else str(a)
+        alist.append(s)
+    return ', '.join(alist)
+
+
+def old_emit_instr(instr, ctxt, out):
+    """The if/elif chain emit_instr used before, trimmed to the ops mixed_func
+    uses; kept here as the baseline."""
+    write = out.write
+    args = instr['args'] if 'args' in instr else []
+    if 'op' in instr:
+        if 'dest' in instr:
+            if instr['op'] == 'call':
+                write('  %{} = call {} @__{}({})\n'.format(
+                    instr['dest'], old_ttype(instr['type']), instr['funcs'][0],
+                    old_format_args(ctxt, args, show_types=True)))
+            elif instr['op'] == 'not':
+                write('  %{} = xor i1 1, {}\n'.format(instr['dest'],
+                                                    old_format_args(ctxt, args)))
+            elif instr['op'] in OPS:
+                write('  %{} = {} {} {}\n'.format(
+                    instr['dest'], OPS[instr['op']],
+                    old_ttype(ctxt.types[args[0]]), old_format_args(ctxt, args)))
+        else:
+            if instr['op'] == 'br':
+                write('  br i1 {}, label %{}, label %{}\n'.format(
+                    old_format_args(ctxt, args), instr['labels'][0], instr['labels'][1]))
+            elif instr['op'] == 'jmp':
+                write('  br label %{}\n'.format(instr['labels'][0]))
+            elif instr['op'] == 'ret':
+                r = old_format_args(ctxt, args, show_types=True)
+                if not r or ctxt.mainfunc:
+                    r = 'void'
+                write('  ret {}\n'.format(r))
+            elif instr['op'] == 'call':
+                write('  call void @__{}({})\n'.format(
+                    instr['funcs'][0], old_format_args(ctxt, args, show_types=True)))
+            elif instr['op'] == 'print':
+                s = []
+                for a in args:
+                    t = ctxt.types[a]
+                    s.append('  call void @print_{}({})'.format(
+                        t, old_format_args(ctxt, [a], show_types=True)))
+                write("\n  call void @print_space()\n".join(s) + '\n')
+                write('  call void @print_newline()\n')
+    else:
+        write(instr['label'] + ':\n')
+
+
+def old_emit_func(f, ctxt, out):
+    for instr in f['instrs']:
+        old_emit_instr(instr, ctxt, out)
+
+
+class OldContext:
+    """The Context the chain used, which only collects types, constants and
+    copies, every operand being formatted at its use; kept as the baseline."""
+    def __init__(self, func, module=None):
+        types = {}
+        consts = {}
+        canon = {}
+        for i in func['instrs']:
+            if 'dest' in i:
+                if i['op'] == 'phi':
+                    types[i['dest']] = types[i['args'][0]]
+                else:
+                    types[i['dest']] = i['type']
+                    if i['op'] == 'id':
+                        if i['args'][0] in consts:
+                            consts[i['dest']] = consts[i['args'][0]]
+                        elif i['args'][0] in canon:
+                            canon[i['dest']] = canon[i['args'][0]]
+                        else:
+                            canon[i['dest']] = i['args'][0]
+            if 'value' in i:
+                if i['type'] == 'bool':
+                    consts[i['dest']] = 1 if i['value'] else 0
+                else:
+                    consts[i['dest']] = i['value']
+        self.types = types
+        self.constants = consts
+        self.canonical = canon
+        self.mainfunc = func['name'] == '__main'
+
+
+def bench_dispatch(args):
+    print('{:>10} {:>10} {:>12} {:>12} {:>12} {:>12} {:>12}'.format(
+        'instrs', 'emitter', 'Context (s)', 'emit (s)', 'total (s)',
+        'ns / instr', 'speedup'))
+    emitters = (('chain', OldContext, old_emit_func),
+                ('table', Context, emit_func))
+    for n in args.sizes or [1000000]:
+        func = mixed_func(n)
+        count = len(func['instrs'])
+
+        # Each emitter is timed end to end, building its own Context, in CPU
+        # time so other processes don't skew the comparison. The two alternate
+        # and each keeps its best of five runs, since one run of either is
+        # noisy.
+        times = {name: [] for name, _, _ in emitters}
+        texts = {}
+        for k in range(5):
+            for name, context, emit in emitters:
+                gc.collect()
+                t_ctxt, ctxt = timed(context, func, Module(), clock=time.process_time)
+                out = TextSink()
+                t, _ = timed(emit, func, ctxt, out, clock=time.process_time)
+                times[name].append((t_ctxt + t, t_ctxt, t))
+                texts[name] = out.getvalue()
+        times = {name: min(ts) for name, ts in times.items()}
+        # emit_func also writes the function's header and footer
+        assert texts['table'].endswith(texts['chain'] + '\n}\n\n')
+
+        for name, _, _ in emitters:
+            total, t_ctxt, t = times[name]
+            print('{:>10} {:>10} {:>12.3f} {:>12.3f} {:>12.3f} {:>12.0f} {:>12.2f}'.format(
+                count, name, t_ctxt, t, total, total / count * 1e9,
+                times['chain'][0] / total))
+
+
+# ------------------------------------------------------------------------------
+# Passes: the optional SSA optimizations, each on its own and all together, on
+# the given Bril json files or on generated constant-heavy functions
+# ------------------------------------------------------------------------------
+
+def bench_passes(args):
+    progs = []
+    for fname in args.files:
+        with open(fname) as f:
+            progs.append((os.path.basename(fname), json.load(f)))
+    if not progs:
+        for n in args.sizes or [100, 1000, 10000]:
+            progs.append(('consts{}'.format(n), {'functions': [consts_func(n)]}))
+            progs.append(('exprs{}'.format(n), {'functions': [exprs_func(n)]}))
+            progs.append(('dead{}'.format(n), {'functions': [dead_func(n)]}))
+            progs.append(('ivs{}'.format(n), {'functions': [ivs_func(n)]}))
+
+    configs = [('none', [])] + [(name, [name]) for name in PASSES]
+    if len(PASSES) > 1:
+        configs.append(('all', list(PASSES)))
+
+    print('{:>16} {:>12} {:>10} {:>12}  {}'.format(
+        'program', 'passes', 'LLVM ops', 'compile (s)', 'stats'))
+    for name, prog in progs:
+        for config, passes in configs:
+            stats = {}
+            t, text = timed(compile_prog, copy.deepcopy(prog), 'minimal', stats, passes)
+            ops = sum(1 for line in text.splitlines() if line.startswith('  '))
+            counts = ', '.join('{}: {}'.format(k, v) for k, v in stats.items()
+                               if k not in ('phis', 'pruned', 'local'))
+            print('{:>16} {:>12} {:>10} {:>12.4f}  {}'.format(
+                name, config, ops, t, counts))
+
+
+BENCHMARKS = {
+    'dominators': bench_dominators,
+    'frontier': bench_frontier,
+    'loops': bench_loops,
+    'dataflow': bench_dataflow,
+    'stress': bench_stress,
+    'phis': bench_phis,
+    'placement': bench_placement,
+    'emit': bench_emit,
+    'dispatch': bench_dispatch,
+    'passes': bench_passes,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compiler pass benchmarks.')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('files', nargs='*',
+                        help='Bril json programs to run on (phis and passes only)')
+    parser.add_argument('--sizes', type=int, nargs='+')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=1,
+                        help='nesting depth of the switch CFGs')
+    parser.add_argument('--baseline-max', type=int, default=2000,
+                        help='largest size to also run the old implementation on')
+    parser.add_argument('--vars', type=int, default=5000,
+                        help='number of distinct variables (placement only)')
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -112,16 +112,32 @@ class CFG:
 
         colors = [WHITE] * self.n
 
-        def dfs_visit(node):
-            if colors[node] == WHITE:
-                colors[node] = GRAY
-                if pre:
-                    pre(node)
-                for v in edges[node]:
-                    dfs_visit(v)
-                colors[node] = BLACK
-                if post:
-                    post(node)
+        # Uses an explicit stack of (node, index of next edge) rather than
+        # recursion, so long chains of blocks don't hit the recursion limit.
+        def dfs_visit(root):
+            if colors[root] != WHITE:
+                return
+
+            colors[root] = GRAY
+            if pre:
+                pre(root)
+            stack = [(root, 0)]
+
+            while stack:
+                node, k = stack[-1]
+                if k < len(edges[node]):
+                    stack[-1] = (node, k + 1)
+                    v = edges[node][k]
+                    if colors[v] == WHITE:
+                        colors[v] = GRAY
+                        if pre:
+                            pre(v)
+                        stack.append((v, 0))
+                else:
+                    stack.pop()
+                    colors[node] = BLACK
+                    if post:
+                        post(node)
 
         for i in order:
             dfs_visit(i)
@@ -129,17 +145,20 @@ class CFG:
                 next_tree()
 
     # Return the indices in reverse-post-order.
-    def rpo(self):
+    # order is passed through to dfs; use order=[0] to only number the blocks
+    # reachable from the entry.
+    def rpo(self, order=None):
         visited = []
 
         def post_visit(i):
             visited.append(i)
 
-        self.dfs(post=post_visit)
+        self.dfs(order=order, post=post_visit)
         visited.reverse()
         return visited
 
-    # Unused first attempt. Computes SCCs in the graph.
+    # Unused first attempt. Computes SCCs in the graph. See loop_forest for
+    # the natural loops of a function.
     def natural_loops(self):
 
         sccs = []
@@ -193,6 +212,184 @@ class CFG:
             print("{} {}".format(i, n))
 
 
+# ------------------------------------------------------------------------------
+# Natural loops and the loop-nesting forest
+#
+# An edge p -> h is a back edge when h dominates p; the natural loop of h is
+# h plus every block that reaches one of its back edges without going through
+# h. Loops sharing a header are merged into one. Cycles that can be entered at
+# more than one block (irreducible ones) have no back edge in this sense and
+# are not loops here.
+# ------------------------------------------------------------------------------
+
+class Loop:
+    """A natural loop.
+    header: its header block
+    latches: the blocks with a back edge to the header
+    blocks: the blocks whose innermost loop it is
+    body: all of its blocks, nested loops' included (built on first access)
+    exits: the (inside, outside) edges leaving it
+    preheader: the block entering the header from outside, if there is
+               exactly one and the header is its only successor; else None
+    parent: the loop it is nested in directly, or None
+    children: the loops nested in it directly
+    depth: 1 for an outermost loop, one more for each level of nesting
+    pre / post: its interval in a DFS of the forest; a loop nests inside
+                another iff its interval nests inside the other's
+    """
+    def __init__(self, header):
+        self.header = header
+        self.latches = []
+        self.blocks = [header]
+        self.exits = []
+        self.preheader = None
+        self.parent = None
+        self.children = []
+        self.depth = 1
+        self.pre = -1
+        self.post = -1
+        self._body = None
+
+    def nests_in(self, other):
+        """True iff this loop is other or nested in it, at any depth."""
+        return other.pre <= self.pre and self.post <= other.post
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = set()
+            stack = [self]
+            while stack:
+                loop = stack.pop()
+                self._body.update(loop.blocks)
+                stack.extend(loop.children)
+        return self._body
+
+
+class LoopForest:
+    """The loops of a function, nested as a forest.
+    loops: every Loop, each after the loop it is nested in
+    roots: the outermost loops
+    loop_of: block -> its innermost Loop, or None
+    depth: block -> number of loops it is in (0 outside every loop)
+    """
+    def __init__(self, loops, loop_of):
+        self.loops = loops
+        self.roots = [l for l in loops if l.parent is None]
+        self.loop_of = loop_of
+        self.depth = [0 if l is None else l.depth for l in loop_of]
+
+    def in_loop(self, b, loop):
+        """True iff block b is in loop (or a loop nested in it)."""
+        inner = self.loop_of[b]
+        return inner is not None and inner.nests_in(loop)
+
+
+# g: the CFG
+# tree: its DominatorTree (as in Dominators(func, g).tree)
+#
+# Headers are visited in postorder of the dominator tree, so a loop is built
+# after every loop nested in it. The walk back from the latches steps over a
+# nested loop in one go, from its outermost enclosing loop found so far
+# straight to that loop's header's entries; `outer` finds that loop, with path
+# compression. Each block is placed once, so the whole is near-linear in the
+# size of the CFG.
+def loop_forest(g, tree):
+    loop_of = [None] * g.n
+
+    # loop -> a loop found so far that it is nested in (itself if none);
+    # outermost() follows these to the outermost one
+    outer = {}
+
+    def outermost(l):
+        path = []
+        while outer[l] is not l:
+            path.append(l)
+            l = outer[l]
+        for p in path:
+            outer[p] = l
+        return l
+
+    # Postorder of the dominator tree
+    headers = []
+    stack = [(tree.root, False)]
+    while stack:
+        b, done = stack.pop()
+        if done:
+            headers.append(b)
+            continue
+        stack.append((b, True))
+        for c in tree.children(b):
+            stack.append((c, False))
+
+    found = []
+    for h in headers:
+        latches = [p for p in g.preds[h] if tree.dominates(h, p)]
+        if not latches:
+            continue
+
+        loop = Loop(h)
+        loop.latches = latches
+        loop_of[h] = loop
+        outer[loop] = loop
+        found.append(loop)
+
+        work = [p for p in latches if p != h]
+        while work:
+            b = work.pop()
+            inner = loop_of[b]
+            if inner is None:
+                loop_of[b] = loop
+                loop.blocks.append(b)
+                work.extend(p for p in g.preds[b] if tree.reachable(p))
+                continue
+
+            inner = outermost(inner)
+            if inner is loop:
+                continue
+            inner.parent = loop
+            loop.children.append(inner)
+            outer[inner] = loop
+            work.extend(p for p in g.preds[inner.header]
+                        if tree.reachable(p) and not tree.dominates(inner.header, p))
+
+    # Outer loops were found last. Number the forest depth-first, so that
+    # membership in a loop is an O(1) interval check.
+    found.reverse()
+    count = 0
+    stack = [(l, False) for l in reversed(found) if l.parent is None]
+    while stack:
+        loop, done = stack.pop()
+        if done:
+            loop.post = count
+            count += 1
+            continue
+        if loop.parent is not None:
+            loop.depth = loop.parent.depth + 1
+        loop.pre = count
+        count += 1
+        stack.append((loop, True))
+        stack.extend((c, False) for c in reversed(loop.children))
+    forest = LoopForest(found, loop_of)
+
+    # An edge leaves every loop from b's innermost one out to the first one
+    # holding its target, so the exits cost no more than their number.
+    for b in range(g.n):
+        for s in g.edges[b]:
+            loop = loop_of[b]
+            while loop is not None and not forest.in_loop(s, loop):
+                loop.exits.append((b, s))
+                loop = loop.parent
+
+    for loop in found:
+        entries = [p for p in g.preds[loop.header]
+                   if tree.reachable(p) and not forest.in_loop(p, loop)]
+        if len(entries) == 1 and g.edges[entries[0]] == [loop.header]:
+            loop.preheader = entries[0]
+
+    return forest
+
+
 # ------------------------------------------------------------------------------
 # Dataflow functions for SSA Reaching Definitions
 #   Since we assume SSA, we can map from varname->single block defining
@@ -0,0 +1,250 @@
+import heapq
+from cfg import CFG
+
+# ------------------------------------------------------------------------------
+# Bit-vector dataflow framework
+#
+# Dataflow facts are sets over a finite universe (variables, definitions,
+# expressions). A BitIndex numbers the universe so that each set is stored as
+# a plain Python int, making meet and transfer a handful of bitwise ops.
+# ------------------------------------------------------------------------------
+
+class BitIndex:
+    """Numbers items so that sets of them can be stored as int bitsets.
+    items: bit -> item
+    bits: item -> bit
+    """
+    def __init__(self, items=()):
+        self.items = []
+        self.bits = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self.bits:
+            self.bits[item] = len(self.items)
+            self.items.append(item)
+        return self.bits[item]
+
+    def __len__(self):
+        return len(self.items)
+
+    def mask(self, items):
+        m = 0
+        for item in items:
+            m |= 1 << self.bits[item]
+        return m
+
+    def decode(self, bits):
+        """Return the list of items in the bitset, in bit order."""
+        result = []
+        while bits:
+            low = bits & -bits
+            result.append(self.items[low.bit_length() - 1])
+            bits ^= low
+        return result
+
+
+# ------------------------------------------------------------------------------
+# Solver
+# g: the CFG
+# gen, kill: per-block bitsets; the transfer function of block b is
+#            gen[b] | (x & ~kill[b])
+# forward: direction of the problem
+# union: meet is union if true (may problems), intersection otherwise (must
+#        problems)
+# boundary: value flowing into the entry (forward) or out of the exits
+#           (backward)
+# top: the initial value of every block, and the identity of intersection;
+#      the universe for must problems
+# extra: optional per-block bitsets or'ed into the meet result, for facts
+#        that belong to a single edge (e.g. phi uses)
+#
+# Returns (in_b, out_b), in program order regardless of direction.
+#
+# The worklist is a heap keyed on RPO position (reverse RPO for backward
+# problems) with a membership bitmap, so each block is queued at most once at
+# a time and is processed after the blocks that feed it.
+# ------------------------------------------------------------------------------
+
+def solve(g, gen, kill, forward=True, union=True, boundary=0, top=0, extra=None):
+    n = g.n
+
+    order = g.rpo()
+    if forward:
+        preds, succs = g.preds, g.edges
+        at_boundary = [b == 0 for b in range(n)]
+    else:
+        order.reverse()
+        preds, succs = g.edges, g.preds
+        at_boundary = [not g.edges[b] for b in range(n)]
+
+    priority = [0] * n
+    for k, b in enumerate(order):
+        priority[b] = k
+
+    met = [top] * n          # result of the meet over incoming edges
+    xfer = [top] * n         # result of the transfer function
+
+    worklist = sorted((priority[b], b) for b in range(n))  # already a heap
+    queued = bytearray([1]) * n
+
+    while worklist:
+        _, b = heapq.heappop(worklist)
+        queued[b] = 0
+
+        if at_boundary[b]:
+            v = boundary
+        else:
+            v = 0 if union else top
+
+        if union:
+            for p in preds[b]:
+                v |= xfer[p]
+        else:
+            for p in preds[b]:
+                v &= xfer[p]
+
+        if extra is not None:
+            v |= extra[b]
+
+        met[b] = v
+        new = gen[b] | (v & ~kill[b])
+
+        if new != xfer[b]:
+            xfer[b] = new
+            for s in succs[b]:
+                if not queued[s]:
+                    queued[s] = 1
+                    heapq.heappush(worklist, (priority[s], s))
+
+    if forward:
+        return (met, xfer)
+    return (xfer, met)
+
+
+# ------------------------------------------------------------------------------
+# Problems
+# Each takes a function (as loaded from json) and optionally its CFG, and
+# returns (index, in_b, out_b) where index is the BitIndex of the universe.
+# ------------------------------------------------------------------------------
+
+def instr_uses(instr):
+    """The variables read by a (non-phi) instruction."""
+    if 'args' not in instr:
+        return []
+    if instr.get('op') == 'getmbr':  # second arg is a member name
+        return instr['args'][:1]
+    return instr['args']
+
+
+# Reaching definitions. A definition is (block, position in block, var);
+# function arguments are definitions at position -1 of block 0.
+def reaching_definitions(func, g=None):
+    if g is None:
+        g = CFG(func)
+
+    index = BitIndex()
+    defs_of = {}  # var -> mask of all its definitions
+
+    def define(d):
+        bit = 1 << index.add(d)
+        defs_of[d[2]] = defs_of.get(d[2], 0) | bit
+
+    for arg in func.get('args', []):
+        define((0, -1, arg['name']))
+    boundary = index.mask(index.items)
+
+    for b, block in enumerate(g.blocks):
+        for i, instr in enumerate(block):
+            if 'dest' in instr:
+                define((b, i, instr['dest']))
+
+    gen = [0] * g.n
+    kill = [0] * g.n
+    for b, block in enumerate(g.blocks):
+        for i, instr in enumerate(block):
+            if 'dest' in instr:
+                var = instr['dest']
+                gen[b] = (gen[b] & ~defs_of[var]) | (1 << index.bits[(b, i, var)])
+                kill[b] |= defs_of[var]
+
+    in_b, out_b = solve(g, gen, kill, forward=True, union=True, boundary=boundary)
+    return (index, in_b, out_b)
+
+
+# Live variables. A phi's arguments are live out of the predecessor named by
+# the matching label, not live into the phi's own block.
+def liveness(func, g=None):
+    if g is None:
+        g = CFG(func)
+
+    index = BitIndex()
+    for arg in func.get('args', []):
+        index.add(arg['name'])
+    for block in g.blocks:
+        for instr in block:
+            if 'dest' in instr:
+                index.add(instr['dest'])
+            for a in instr_uses(instr):
+                index.add(a)
+
+    block_of = {name: b for b, name in enumerate(g.names)}
+
+    gen = [0] * g.n
+    kill = [0] * g.n
+    phi_uses = [0] * g.n
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            if instr.get('op') == 'phi':
+                for a, lbl in zip(instr['args'], instr['labels']):
+                    phi_uses[block_of[lbl]] |= 1 << index.bits[a]
+            else:
+                for a in instr_uses(instr):
+                    bit = 1 << index.bits[a]
+                    if not kill[b] & bit:
+                        gen[b] |= bit
+            if 'dest' in instr:
+                kill[b] |= 1 << index.bits[instr['dest']]
+
+    in_b, out_b = solve(g, gen, kill, forward=False, union=True, extra=phi_uses)
+    return (index, in_b, out_b)
+
+
+# Ops whose result depends only on their arguments.
+PURE_OPS = {'add', 'mul', 'sub', 'div', 'eq', 'lt', 'gt', 'le', 'ge',
+            'and', 'or', 'not'}
+
+
+# Available expressions. An expression is (op, arg, ...).
+def available_expressions(func, g=None):
+    if g is None:
+        g = CFG(func)
+
+    index = BitIndex()
+    uses_of = {}  # var -> mask of the expressions reading it
+    for block in g.blocks:
+        for instr in block:
+            if 'dest' in instr and instr['op'] in PURE_OPS:
+                e = (instr['op'],) + tuple(instr['args'])
+                if e not in index.bits:
+                    bit = 1 << index.add(e)
+                    for a in instr['args']:
+                        uses_of[a] = uses_of.get(a, 0) | bit
+
+    gen = [0] * g.n
+    kill = [0] * g.n
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            if 'dest' not in instr:
+                continue
+            if instr['op'] in PURE_OPS:
+                gen[b] |= 1 << index.bits[(instr['op'],) + tuple(instr['args'])]
+            killed = uses_of.get(instr['dest'], 0)
+            gen[b] &= ~killed
+            kill[b] |= killed
+
+    universe = (1 << len(index)) - 1
+    in_b, out_b = solve(g, gen, kill, forward=True, union=False,
+                        boundary=0, top=universe)
+    return (index, in_b, out_b)
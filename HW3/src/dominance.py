@@ -1,86 +1,293 @@
 import sys
 import json
+from array import array
 from cfg import *
-from functools import reduce
 
-class Dominators:
-
-    def __init__(self, func):
-        g = CFG(func)
-
-        # First compute dominators
-        # IMPORTANT: This computes, for each block, the set of blocks that dominate
-        # it, not the other way around
-        self.doms = []
-        self.doms.append(set([0])) # Entry block is special, it's its own dominator
-        for i in range(1,g.n):
-            self.doms.append(set(range(g.n)))
-
-        order = g.rpo()
+def idom_frontier(preds, idom, root=0):
+    """Dominance frontier of every block, given the predecessor lists and the
+    immediate dominators (-1 for the root, block 0 by default, and
+    unreachable blocks).
+
+    Walks up the dominator tree from each predecessor of a block until
+    reaching the block's idom; every block passed on the way has the block in
+    its frontier. A walk can stop early at a block that already has it, since
+    an earlier walk went on from there to the idom. The cost is proportional
+    to the size of the result.
+    """
+    frontier = []
+    for i in range(len(preds)):
+        frontier.append(set())
+
+    for i in range(len(preds)):
+        if i != root and idom[i] == -1:  # unreachable
+            continue
+        for p in preds[i]:
+            if p != root and idom[p] == -1:
+                continue
+            runner = p
+            while runner != -1 and runner != idom[i]:
+                if i in frontier[runner]:
+                    break
+                frontier[runner].add(i)
+                runner = idom[runner]
+
+    return frontier
+
+
+def iterative_idom(order, preds, n):
+    """Immediate dominators by the iterative idom-array algorithm of Cooper,
+    Harvey and Kennedy ("A Simple, Fast Dominance Algorithm").
+
+    order: the blocks reachable from the root in RPO, the root first
+    preds: block -> list of predecessors
+    n: the number of blocks
+
+    Returns block -> immediate dominator (-1 for the root and unreachable
+    blocks).
+    """
+    root = order[0]
+
+    # Only blocks reachable from the root take part; their RPO number orders
+    # the intersection walk below.
+    rpo_num = [-1] * n
+    for k, b in enumerate(order):
+        rpo_num[b] = k
+
+    def intersect(a, b):
+        while a != b:
+            while rpo_num[a] > rpo_num[b]:
+                a = idom[a]
+            while rpo_num[b] > rpo_num[a]:
+                b = idom[b]
+        return a
+
+    # The root is temporarily its own idom so intersect() stops there.
+    idom = [-1] * n
+    idom[root] = root
+
+    changed = True
+    while changed:
+        changed = False
+        for i in order[1:]:
+            new_idom = -1
+            for p in preds[i]:
+                if idom[p] == -1:  # not processed yet (or unreachable)
+                    continue
+                if new_idom == -1:
+                    new_idom = p
+                else:
+                    new_idom = intersect(p, new_idom)
+
+            if idom[i] != new_idom:
+                idom[i] = new_idom
+                changed = True
+
+    idom[root] = -1
+    return idom
+
+
+class DominatorTree:
+    """The dominator tree, kept in flat int arrays rather than per-block sets.
+
+    idom: block -> immediate dominator (-1 for the root and unreachable blocks)
+    pre / post: block -> pre- and post-order number in a DFS of the tree (-1
+                for unreachable blocks)
+
+    a dominates b iff b's [pre, post] interval nests inside a's, so dominance
+    queries are O(1) and the whole structure is O(n) memory.
+    """
+
+    def __init__(self, idom, root=0):
+        n = len(idom)
+        self.root = root
+        self.idom = array('i', idom)
+
+        # Children in CSR form: the children of b are
+        # kids[first[b]:first[b+1]], in increasing block order.
+        self.first = array('i', [0]) * (n + 1)
+        for p in idom:
+            if p != -1:
+                self.first[p + 1] += 1
+        for b in range(n):
+            self.first[b + 1] += self.first[b]
+
+        self.kids = array('i', [0]) * self.first[n]
+        fill = self.first[:n]
+        for b, p in enumerate(idom):
+            if p != -1:
+                self.kids[fill[p]] = b
+                fill[p] += 1
+
+        self.pre = array('i', [-1]) * n
+        self.post = array('i', [-1]) * n
+
+        if n:
+            pre_count = 0
+            post_count = 0
+            self.pre[root] = pre_count
+            pre_count += 1
+            stack = [(root, self.first[root])]
+            while stack:
+                b, k = stack[-1]
+                if k < self.first[b + 1]:
+                    stack[-1] = (b, k + 1)
+                    c = self.kids[k]
+                    self.pre[c] = pre_count
+                    pre_count += 1
+                    stack.append((c, self.first[c]))
+                else:
+                    stack.pop()
+                    self.post[b] = post_count
+                    post_count += 1
+
+    def children(self, b):
+        return self.kids[self.first[b]:self.first[b + 1]]
+
+    def reachable(self, b):
+        return self.pre[b] != -1
+
+    def dominates(self, a, b):
+        """True iff block a dominates block b (every block dominates itself)."""
+        return (self.pre[a] != -1 and self.pre[b] != -1
+                and self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a])
+
+    def strictly_dominates(self, a, b):
+        return a != b and self.dominates(a, b)
 
-        changed = True
-        while changed:
-            changed = False
-            for i in order[1:]: # no one can dominate 0 except 0
-                d = {i}
-                if g.preds[i]:
-                    d |= reduce(set.intersection, [self.doms[p] for p in g.preds[i]], set(range(g.n)))
 
-                if d != self.doms[i]:
-                    changed = True
-                    self.doms[i] = d
+class Dominators:
+    """Dominator information for a function, computed with the iterative
+    idom-array algorithm of Cooper, Harvey and Kennedy ("A Simple, Fast
+    Dominance Algorithm").
 
-        # Compute the "other way around" (from above), that is, for each block, the
-        # set of blocks this block dominates
-        self.dom_by = []
-        for i in range(g.n):
-            self.dom_by.append(set())
+    idom: block -> immediate dominator (-1 for the entry and unreachable blocks)
+    tree: the DominatorTree built from idom, for O(1) dominance queries
+    dom_tree: parent -> [children]; the entry is the only child of None
+    frontier: block -> set of blocks in its dominance frontier
+    doms / dom_by: the full dominator sets, built on first access only
+    """
 
-        for i,d in enumerate(self.doms):
-            for mbr in d:
-                self.dom_by[mbr].add(i)
+    def __init__(self, func, g=None):
+        if g is None:
+            g = CFG(func)
 
+        self.n = g.n
 
+        idom = iterative_idom(g.rpo(order=[0]), g.preds, g.n)
+        self.tree = DominatorTree(idom)
+        self.idom = self.tree.idom
 
         # Compute the dominance tree
-        dt_parent = [None]
-
+        self.dom_tree = {None: [0]}
         for i in range(1, g.n):
-            for j in self.doms[i]:
-                if i != j:  # j strictly dominates i
-                    immed_dom = True
-                    for k in range(g.n):
-                        if k != j and k != i and j in self.doms[k] and k in self.doms[i]:
-                            immed_dom = False
-                            break
-                    if immed_dom:
-                        dt_parent.append(j)
-                        break
-
-        self.dom_tree = {}
-        for i,p in enumerate(dt_parent):
-            if p in self.dom_tree:
-                self.dom_tree[p].append(i)
-            else:
-                self.dom_tree[p] = [i]
-
-        # Compute dominance frontier
-        self.frontier = []
-        for i in range(g.n):
-            self.frontier.append(set())
-
-        for i,d in enumerate(self.doms):
-            # Union of dominators for this node's preds
-            pre_doms = reduce(set.union, [self.doms[p] for p in g.preds[i]], set())
-            # Subtract out strict dominators for this node
-            pre_doms = pre_doms.difference(self.doms[i].difference(set([i])))
-
-            # This node is in the frontier for the remaining nodes:
-            for p in pre_doms:
-                self.frontier[p].add(i)
-
-
-
+            p = idom[i]
+            if p != -1:
+                if p in self.dom_tree:
+                    self.dom_tree[p].append(i)
+                else:
+                    self.dom_tree[p] = [i]
+
+        self.frontier = idom_frontier(g.preds, idom)
+
+        self._doms = None
+        self._dom_by = None
+
+    # IMPORTANT: This is, for each block, the set of blocks that dominate it,
+    # not the other way around
+    @property
+    def doms(self):
+        if self._doms is None:
+            self._doms = []
+            for i in range(self.n):
+                d = set()
+                j = i
+                while j != -1:
+                    d.add(j)
+                    j = self.idom[j]
+                self._doms.append(d)
+        return self._doms
+
+    # The "other way around" (from above), that is, for each block, the set
+    # of blocks this block dominates
+    @property
+    def dom_by(self):
+        if self._dom_by is None:
+            self._dom_by = []
+            for i in range(self.n):
+                self._dom_by.append(set())
+
+            for i, d in enumerate(self.doms):
+                for mbr in d:
+                    self._dom_by[mbr].add(i)
+        return self._dom_by
+
+
+class PostDominators:
+    """Post-dominator information for a function: the dominators of its
+    reverse CFG, rooted at a virtual exit block numbered g.n.
+
+    Every block without successors (ending in a ret, or the end of the
+    function) flows into the exit. So does one block of each region that
+    can never reach it (an infinite loop).
+
+    ipdom: block -> immediate post-dominator (g.n for the blocks only the
+           exit post-dominates, -1 for the exit itself)
+    tree: the DominatorTree built from ipdom, for O(1) queries
+    frontier: block -> set of blocks in its reverse dominance frontier,
+              i.e. the blocks whose branch decides whether it runs (the
+              blocks it is control dependent on)
+    """
+
+    def __init__(self, func, g=None):
+        if g is None:
+            g = CFG(func)
+
+        self.n = g.n
+        exit = g.n
+
+        # The reverse CFG, plus the exit; preds there are succs in g.
+        succs = [list(p) for p in g.preds] + [[]]
+        preds = [list(e) for e in g.edges] + [[]]
+        for b in range(g.n):
+            if not g.edges[b]:
+                succs[exit].append(b)
+                preds[b].append(exit)
+
+        # Postorder of the reverse CFG from the exit. Blocks left over can't
+        # reach the exit; the last of them (by block order) is linked to it
+        # and the walk resumes from there, until every block is numbered.
+        visited = [False] * (g.n + 1)
+        post = []
+
+        def visit(root):
+            visited[root] = True
+            stack = [(root, 0)]
+            while stack:
+                b, k = stack[-1]
+                if k < len(succs[b]):
+                    stack[-1] = (b, k + 1)
+                    s = succs[b][k]
+                    if not visited[s]:
+                        visited[s] = True
+                        stack.append((s, 0))
+                else:
+                    stack.pop()
+                    post.append(b)
+
+        visit(exit)
+        for b in reversed(range(g.n)):
+            if not visited[b]:
+                succs[exit].append(b)
+                preds[b].append(exit)
+                visit(b)
+                # the exit is numbered again, after its new successors
+                post.remove(exit)
+                post.append(exit)
+
+        ipdom = iterative_idom(post[::-1], preds, g.n + 1)
+        self.tree = DominatorTree(ipdom, root=exit)
+        self.ipdom = self.tree.idom
+        self.frontier = idom_frontier(preds, ipdom, root=exit)
 
 
 def main():
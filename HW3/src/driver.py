@@ -1,64 +1,253 @@
 from cfg import *
 from ssa_to_llvm import *
-from ssa_construct import to_ssa
+from ssa_construct import to_ssa, from_ssa
+from sccp import sccp
+from gvn import gvn
+from adce import adce
+from licm import licm
+from rotate import rotate
+from strength import strength_reduce
+from unroll import unroll, UNROLL_FACTOR, UNROLL_BUDGET
+from stream import stream_program
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import collections
+import contextlib
+import functools
 import json
 
 
-def main():
-    """ Read a bril program from stdin, convert to ssa, then emit LLVM by function.
+# Optimizations that can run on each function's SSA form, by name. Each is
+# called as f(func, stats), where stats is the dict to_ssa counts phis in;
+# pass_functions binds the options of those that take any.
+PASSES = {
+    'sccp': sccp,
+    'gvn': gvn,
+    'adce': adce,
+    'licm': licm,
+    'rotate': rotate,
+    'strength': strength_reduce,
+    'unroll': unroll,
+}
+
+
+def pass_list(names):
+    """ Parse a comma-separated list of PASSES, for argparse.
     """
-    f = None
-    fname = ''
+    passes = [name for name in names.split(',') if name]
+    for name in passes:
+        if name not in PASSES:
+            raise argparse.ArgumentTypeError(
+                'unknown pass {!r} (choose from {})'.format(name, ', '.join(PASSES)))
+    return passes
 
-    if len(sys.argv) <= 1:
-        f = sys.stdin
-        fname = 'stdin'
-    else:
-        f = open(sys.argv[1])
-        fname = sys.argv[1]
 
-    prog = to_ssa(json.load(f))
-    if 'structs' not in prog:
-        prog['structs'] = []
+def pass_functions(names, unroll_factor=UNROLL_FACTOR, unroll_budget=UNROLL_BUDGET):
+    """ The functions to run for a list of PASSES names, with the options of
+        those that take any bound, so each is called as f(func, stats).
+    """
+    bound = {
+        'unroll': functools.partial(unroll, factor=unroll_factor, budget=unroll_budget),
+    }
+    return [bound.get(name, PASSES[name]) for name in names]
 
-    main_args = []
 
-    print(PROG_HDR.format(fname, fname))
+def emit_function(func, module, out):
+    """ Emit func (already in SSA) to the sink out.
+    """
+    if (func['name'] == 'main'):
+        if 'type' in func:
+            func.pop('type') # We wouldn't actually return the value anyway
+    func['name'] = '__' + func['name'] # Avoid name collisions in C world
 
-    # Compute struct size for allocation,
-    # Build mbr offset reference, and
-    # Emit LLVM declaration.
-    for struct in prog['structs']:
-        name = struct['name']
-        size = 0
+    emit_func(func, Context(func, module), out)
 
-        struct_mbr_offsets[name] = {}
 
-        mbrs = []
-        for i, mbr in enumerate(struct['mbrs']):
-            size += sizeof(mbr['type'])
+def optimize_function(func, ssa='minimal', passes=(), stats=None):
+    """ Convert func to ssa and run the given passes (as from pass_functions)
+        on it in order.
+    """
+    func = to_ssa({'functions': [func]}, ssa, stats)['functions'][0]
+    for f in passes:
+        f(func, stats)
+    return func
 
-            struct_mbr_offsets[name][mbr['name']] = i
 
-            mbrs.append(ttype(mbr['type']))
+def compile_function(func, module, ssa='minimal', passes=()):
+    """ Convert func to ssa, run the given passes on it in order and emit it,
+        returning the LLVM text and the counts from to_ssa and the passes.
+        This is the unit of work handed to each process under --jobs.
+    """
+    stats = {}
+    func = optimize_function(func, ssa, passes, stats)
+
+    out = TextSink()
+    emit_function(func, module, out)
+    return (out.getvalue(), stats)
+
+
+def emit_program(items, name, out, ssa='minimal', stats=None, jobs=1, passes=()):
+    """ Emit the LLVM module for a bril program to the sink out.
+        items: the program's top-level (key, value) pairs, with each function
+               as its own ('function', func) pair (as from stream_program)
+        name: the module name
+        stats: optional dict; its counts are incremented as by to_ssa and the
+               passes
+        passes: the passes to run on each function, in order (as from
+                pass_functions)
+    """
+    if stats is None:
+        stats = {}
 
-        struct_sizes[name] = size
-        print('%{} = type {{ {} }}'.format(name, ', '.join(mbrs)))
+    out.write(PROG_HDR.format(name, name) + '\n')
 
+    module = Module()
+    main_args = []
+    seen_function = False
+
+    def write(result):
+        text, func_stats = result
+        out.write(text)
+        for k, v in func_stats.items():
+            stats[k] = stats.get(k, 0) + v
+
+    # Under --jobs, functions are compiled out of order but their text is
+    # written in input order. At most `window` are in flight at once, so
+    # streaming still only holds a bounded number of functions in memory.
+    # The pool is shut down however the loop ends, errors included.
+    window = 4 * jobs
+    pending = collections.deque()
+
+    with ProcessPoolExecutor(jobs) if jobs > 1 else contextlib.nullcontext() as pool:
+        for key, value in items:
+            if key == 'structs':
+                if seen_function:
+                    sys.exit('error: --stream needs "structs" before "functions"')
+                for struct in value:
+                    out.write(module.add_struct(struct) + '\n')
+
+            elif key == 'function':
+                seen_function = True
+                if value['name'] == 'main' and 'args' in value:
+                    main_args = value['args']
+
+                if pool is None:
+                    write(compile_function(value, module, ssa, passes))
+                    continue
+
+                pending.append(pool.submit(compile_function, value, module, ssa, passes))
+                if len(pending) >= window:
+                    write(pending.popleft().result())
+
+        while pending:
+            write(pending.popleft().result())
+
+    emit_main(main_args, out)
+
+
+def program_items(prog):
+    """ The (key, value) pairs emit_program takes, for a loaded program.
+    """
+    items = [('structs', prog.get('structs', []))]
+    items += [('function', func) for func in prog['functions']]
+    return items
 
-    # Iterate and emit functions
-    for func in prog['functions']:
 
-        if (func['name'] == 'main'):
-            if 'args' in func:
-                main_args = func['args']
-            if 'type' in func:
-                func.pop('type') # We wouldn't actually return the value anyway
-        func['name'] = '__' + func['name'] # Avoid name collisions in C world
+def compile_program(prog, name='stdin', ssa='minimal', stats=None, passes=()):
+    """ Compile prog, a whole bril program, returning the LLVM module text.
+    """
+    out = TextSink()
+    emit_program(program_items(prog), name, out, ssa, stats, passes=passes)
+    return out.getvalue()
 
-        emit_func(func, Context(func))
 
-    emit_main(main_args)
+def main():
+    """ Read a bril program from stdin, convert to ssa, then emit LLVM by function.
+    """
+    parser = argparse.ArgumentParser(description='Translate Bril to LLVM IR.')
+    parser.add_argument('file', nargs='?', help='Bril JSON input (default: stdin)')
+    parser.add_argument('--output', '-o', metavar='FILE',
+                        help='write the LLVM IR to FILE (default: stdout)')
+    parser.add_argument('--stream', action='store_true',
+                        help='decode, convert and emit one function at a time')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+                        help='compile functions in N worker processes')
+    parser.add_argument('--ssa', choices=['minimal', 'semi', 'pruned'], default='minimal',
+                        help='place phis at every join (minimal), only for vars '
+                             'used across blocks (semi), or only where the var '
+                             'is live (pruned)')
+    parser.add_argument('--passes', type=pass_list, default=[], metavar='LIST',
+                        help='comma-separated optimizations to run on the SSA '
+                             'form, in order: ' + ', '.join(PASSES))
+    parser.add_argument('--unroll-factor', type=int, default=UNROLL_FACTOR, metavar='N',
+                        help='copies of the body the unroll pass makes when it '
+                             'cannot unroll a loop fully (default: %(default)s)')
+    parser.add_argument('--unroll-budget', type=int, default=UNROLL_BUDGET, metavar='N',
+                        help='most instructions a loop may hold once unrolled '
+                             '(default: %(default)s)')
+    parser.add_argument('--bril', action='store_true',
+                        help='write the SSA form (after --passes) as Bril JSON '
+                             'instead of LLVM IR, e.g. to profile with brili -p')
+    parser.add_argument('--roundtrip', action='store_true',
+                        help='with --bril, take the SSA form back out of SSA '
+                             'before writing it')
+    parser.add_argument('--no-coalesce', dest='coalesce', action='store_false',
+                        help='with --roundtrip, give every phi arg its own copy '
+                             'instead of merging non-interfering names')
+    parser.add_argument('--stats', action='store_true',
+                        help='report the number of phis placed and pruned, and '
+                             'of block-local vars, on stderr (and what each '
+                             'pass did, and the copies --roundtrip left)')
+    args = parser.parse_args()
+    if args.roundtrip and not args.bril:
+        parser.error('--roundtrip needs --bril: LLVM IR is only emitted from SSA')
+    passes = pass_functions(args.passes, args.unroll_factor, args.unroll_budget)
+
+    # Streamed items are read lazily, so the input stays open until the last
+    # function is emitted. stdin and stdout are not ours to close.
+    if args.file is None:
+        infile = contextlib.nullcontext(sys.stdin)
+        fname = 'stdin'
+    else:
+        infile = open(args.file)
+        fname = args.file
+
+    stats = {'phis': 0, 'pruned': 0, 'local': 0}
+    with infile as f:
+        if args.stream:
+            # Structs have to be known before any function using them is emitted,
+            # so in this mode they must come before the functions in the input.
+            items = stream_program(f)
+        else:
+            items = program_items(json.load(f))
+
+        # Each function's text reaches the output in a single write
+        if args.output is None:
+            outfile = contextlib.nullcontext(sys.stdout)
+        else:
+            outfile = open(args.output, 'w', buffering=1 << 20)
+
+        with outfile as out:
+            if args.bril:
+                prog = {'functions': []}
+                for key, value in items:
+                    if key == 'function':
+                        value = optimize_function(value, args.ssa, passes, stats)
+                        if args.roundtrip:
+                            value = from_ssa({'functions': [value]}, args.coalesce,
+                                             stats)['functions'][0]
+                        prog['functions'].append(value)
+                    else:
+                        prog[key] = value
+                json.dump(prog, out)
+                out.write('\n')
+            else:
+                emit_program(items, fname, out, args.ssa, stats, args.jobs, passes)
+            out.flush()
+
+    if args.stats:
+        print(', '.join('{}: {}'.format(k, v) for k, v in stats.items()),
+              file=sys.stderr)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,133 @@
+from cfg import CFG
+from dominance import Dominators
+
+# ------------------------------------------------------------------------------
+# Dominator-tree global value numbering on the SSA form built by to_ssa.
+#
+# The blocks are walked in a preorder of the dominator tree with a scoped hash
+# table from expression keys, (op, type, args), to the var that first computed
+# them; an entry is dropped once the walk leaves the subtree of its block, so
+# any var found in the table dominates the current block. Args in keys are
+# replaced by the var holding their value first, and sorted for commutative
+# ops, so e.g. `add a b` and `add b a` (or `add c b`, after `c: int = id a`)
+# share a key.
+#
+# A computation whose key is already in the table is redundant: it is deleted
+# and its uses read the var holding the value instead. Phis whose args all hold
+# the same value are deleted the same way, as are phis repeating another phi of
+# their block. Copies are kept (the emitter folds them away) but read through,
+# except copies of the function's args, which Context needs to type them.
+# ------------------------------------------------------------------------------
+
+# Ops with no side effects whose result depends only on their args (and type)
+PURE = {'add', 'mul', 'sub', 'div', 'eq', 'lt', 'gt', 'le', 'ge', 'and',
+        'or', 'not', 'ptradd', 'isnull'}
+
+COMMUTATIVE = {'add', 'mul', 'eq', 'and', 'or'}
+
+
+# func: a function in SSA form, every block labeled (as to_ssa leaves it)
+# stats: optional dict; its 'redundant' count is incremented with the number
+#        of instructions deleted.
+def gvn(func, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('redundant', 0)
+
+    g = CFG(func)
+    domins = Dominators(func, g)
+
+    params = set(arg['name'] for arg in func.get('args', []))
+
+    # var -> the var holding its value, for the vars found redundant
+    leader = {}
+    # var -> the var it is a copy of
+    copy_of = {}
+    table = {}
+
+    def value(a):
+        return leader.get(a) or copy_of.get(a) or a
+
+    def key(instr, b):
+        op = instr['op']
+        if op == 'const':
+            return ('const', instr['type'], instr['value'])
+        if op == 'phi':
+            # only a phi of the same block has the same value
+            return ('phi', b) + tuple(sorted(zip(instr['labels'],
+                                                 map(value, instr['args']))))
+        if op in PURE:
+            args = [value(a) for a in instr['args']]
+            if op in COMMUTATIVE:
+                args.sort()
+            return (op, str(instr.get('type'))) + tuple(args)
+        return None
+
+    # b: index of block. Returns the keys it added to the table, so they can
+    # be dropped once b's dominator subtree is done.
+    def number(b):
+        added = []
+        for instr in g.blocks[b]:
+            if 'dest' not in instr:
+                continue
+            dest = instr['dest']
+            op = instr['op']
+
+            if op == 'id':
+                a = value(instr['args'][0])
+                if a not in params:
+                    copy_of[dest] = a
+                continue
+
+            if op == 'phi':
+                args = set(value(a) for a in instr['args']) - {dest}
+                if len(args) == 1:
+                    leader[dest] = args.pop()
+                    continue
+
+            k = key(instr, b)
+            if k is None:
+                continue
+            if k in table:
+                leader[dest] = table[k]
+            else:
+                table[k] = dest
+                added.append(k)
+        return added
+
+    # Walk the dominator tree with an explicit stack, as to_ssa does.
+    work = [(0, None)]
+    while work:
+        b, added = work.pop()
+
+        if added is not None:
+            for k in added:
+                del table[k]
+            continue
+
+        work.append((b, number(b)))
+        for child in reversed(domins.tree.children(b)):
+            work.append((child, None))
+
+    # Leaders are never redundant themselves, but a phi's leader may have been
+    # read before its own leader was known (through a back edge).
+    def resolve(a):
+        while a in leader:
+            a = leader[a]
+        return a
+
+    newinstrs = []
+    for block in g.blocks:
+        for instr in block:
+            if 'dest' in instr and instr['dest'] in leader:
+                stats['redundant'] += 1
+                continue
+            if 'args' in instr:
+                if instr.get('op') == 'getmbr': # second arg is a member name
+                    instr['args'] = [resolve(instr['args'][0])] + instr['args'][1:]
+                else:
+                    instr['args'] = [resolve(a) for a in instr['args']]
+            newinstrs.append(instr)
+
+    func['instrs'] = newinstrs
+    return func
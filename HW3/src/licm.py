@@ -0,0 +1,165 @@
+from cfg import CFG, loop_forest
+from dominance import Dominators
+
+# ------------------------------------------------------------------------------
+# Loop-invariant code motion on the SSA form built by to_ssa.
+#
+# First every loop is given a preheader: a block that only jumps to the
+# header, and is the only way into the loop. Where one is missing, a block
+# is added just before the header and the loop's entries are redirected to
+# it; header phis then get their value from outside through a single
+# argument, merged by a new phi in the preheader if there were several.
+#
+# Then, innermost loops first, every instruction of a loop whose args are all
+# defined outside of it (or by instructions already hoisted) moves to the end
+# of its preheader. Only PURE ops move, since they may end up running when
+# the loop body would not: a div only when it divides by a constant that can
+# neither trap nor overflow. Moving into an inner loop's preheader puts an
+# instruction in the outer loop, which may then hoist it further out.
+# ------------------------------------------------------------------------------
+
+# Ops that can run speculatively: no side effects, no traps, and a result
+# that depends only on their args (and type)
+PURE = {'const', 'id', 'add', 'mul', 'sub', 'eq', 'lt', 'gt', 'le', 'ge',
+        'and', 'or', 'not', 'ptradd', 'isnull'}
+
+
+# func: a function in SSA form, every block labeled (as to_ssa leaves it)
+# Returns the number of blocks added.
+def add_preheaders(func):
+    g = CFG(func)
+    domins = Dominators(func, g)
+    forest = loop_forest(g, domins.tree)
+
+    labels = set(g.names)
+    dests = set(instr['dest'] for instr in func['instrs'] if 'dest' in instr)
+
+    def fresh(base, used):
+        name = base
+        k = 0
+        while name in used:
+            k += 1
+            name = '{}.{}'.format(base, k)
+        used.add(name)
+        return name
+
+    # header block -> preheader block to insert before it
+    before = {}
+    for loop in forest.loops:
+        h = loop.header
+        # The entry block can't be given a block ahead of it
+        if loop.preheader is not None or h == 0:
+            continue
+
+        entries = set(p for p in g.preds[h]
+                      if domins.tree.reachable(p) and not forest.in_loop(p, loop))
+        hlabel = g.names[h]
+        plabel = fresh(hlabel + '.preheader', labels)
+        entry_labels = set(g.names[p] for p in entries)
+
+        for p in entries:
+            end = g.blocks[p][-1]
+            end['labels'] = [plabel if l == hlabel else l for l in end['labels']]
+
+        pre = [{'label': plabel}]
+        for instr in g.blocks[h]:
+            if instr.get('op') != 'phi':
+                continue
+            inside = [(a, l) for a, l in zip(instr['args'], instr['labels'])
+                      if l not in entry_labels]
+            outside = [(a, l) for a, l in zip(instr['args'], instr['labels'])
+                       if l in entry_labels]
+            if len(set(a for a, l in outside)) == 1:
+                arg = outside[0][0]
+            else:
+                arg = fresh(instr['dest'] + '.pre', dests)
+                phi = {'op': 'phi', 'dest': arg,
+                       'args': [a for a, l in outside],
+                       'labels': [l for a, l in outside]}
+                if 'type' in instr:
+                    phi['type'] = instr['type']
+                pre.append(phi)
+            # the value from outside first: Context types a phi by its first
+            # arg, which has to be defined earlier in the function
+            instr['args'] = [arg] + [a for a, l in inside]
+            instr['labels'] = [plabel] + [l for a, l in inside]
+        pre.append({'op': 'jmp', 'labels': [hlabel]})
+        before[h] = pre
+
+    if not before:
+        return 0
+
+    newinstrs = []
+    for b, block in enumerate(g.blocks):
+        newinstrs += before.get(b, [])
+        newinstrs += block
+    func['instrs'] = newinstrs
+    return len(before)
+
+
+# func: a function in SSA form, every block labeled (as to_ssa leaves it)
+# stats: optional dict; its 'preheaders' and 'hoisted' counts are incremented
+#        with the blocks added and the instructions moved out of loops.
+def licm(func, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('preheaders', 0)
+    stats.setdefault('hoisted', 0)
+
+    stats['preheaders'] += add_preheaders(func)
+
+    g = CFG(func)
+    domins = Dominators(func, g)
+    forest = loop_forest(g, domins.tree)
+
+    # var -> block defining it (function args have none)
+    def_block = {}
+    consts = {}
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            if 'dest' in instr:
+                def_block[instr['dest']] = b
+                if instr['op'] == 'const':
+                    consts[instr['dest']] = instr['value']
+
+    rpo_num = {b: k for k, b in enumerate(g.rpo(order=[0]))}
+
+    def movable(instr, loop):
+        op = instr.get('op')
+        if op == 'div':
+            d = consts.get(instr['args'][1])
+            if d is None or d == 0 or d == -1:
+                return False
+        elif op not in PURE:
+            return False
+        for a in instr.get('args', []):
+            b = def_block.get(a)
+            if b is not None and forest.in_loop(b, loop):
+                return False
+        return True
+
+    for loop in reversed(forest.loops):
+        if loop.preheader is None:
+            continue
+        pre = g.blocks[loop.preheader]
+        hoisted = []
+
+        # Defs come before their (non-phi) uses in RPO, so a single pass sees
+        # an instruction's args hoisted before the instruction itself.
+        for b in sorted(loop.body, key=rpo_num.__getitem__):
+            kept = []
+            for instr in g.blocks[b]:
+                if 'dest' in instr and movable(instr, loop):
+                    hoisted.append(instr)
+                    def_block[instr['dest']] = loop.preheader
+                else:
+                    kept.append(instr)
+            g.blocks[b] = kept
+
+        # before the jmp into the header, unless the preheader falls through
+        at = len(pre) - 1 if pre[-1].get('op') == 'jmp' else len(pre)
+        pre[at:at] = hoisted
+        stats['hoisted'] += len(hoisted)
+
+    func['instrs'] = [instr for block in g.blocks for instr in block]
+    return func
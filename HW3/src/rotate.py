@@ -0,0 +1,251 @@
+from cfg import CFG, loop_forest
+from dominance import Dominators
+
+# ------------------------------------------------------------------------------
+# Loop rotation on the SSA form built by to_ssa: a while loop, whose header
+# tests the condition and whose latch jumps back to it unconditionally,
+# becomes a guarded do-while loop, so an iteration takes one conditional
+# branch rather than a branch and a jump.
+#
+# The header's code is copied into its preheader, as a guard deciding whether
+# to enter the loop at all, and moved to the end of the latch, where it
+# decides whether to go around again; the block after the header becomes the
+# loop's new header. Every var the header defined now has two defs, so the
+# new header and the exit merge the two with a phi where the var is used
+# below them; the header's own phis just move to the new header. Consts are
+# moved to the preheader instead of being copied.
+#
+# Only loops of that simple shape are rotated: a preheader, a single latch
+# ending in a jmp, the header as the only block leaving the loop, and a body
+# and exit that the header is the only way into. The header may hold at most
+# ROTATE_LIMIT instructions to copy.
+# ------------------------------------------------------------------------------
+
+ROTATE_LIMIT = 16
+
+
+def var_types(func):
+    """var -> type, for every var of func (in SSA form); a phi without a
+    type has that of its args.
+    """
+    types = {a['name']: a['type'] for a in func.get('args', [])}
+    phis = []
+    for instr in func['instrs']:
+        if 'dest' in instr:
+            if 'type' in instr:
+                types[instr['dest']] = instr['type']
+            else:
+                phis.append(instr)
+
+    changed = True
+    while changed:
+        changed = False
+        for phi in phis:
+            if phi['dest'] in types:
+                continue
+            for a in phi['args']:
+                if a in types:
+                    types[phi['dest']] = types[a]
+                    changed = True
+                    break
+    return types
+
+
+# func: a function in SSA form, every block labeled (as to_ssa leaves it)
+# stats: optional dict; its 'rotated' count is incremented with the number of
+#        loops rotated.
+def rotate(func, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('rotated', 0)
+
+    types = var_types(func)
+    names = set(types)
+
+    def fresh(base):
+        name = base
+        k = 0
+        while name in names:
+            k += 1
+            name = '{}.{}'.format(base, k)
+        names.add(name)
+        return name
+
+    # Loops are rotated in rounds. Within a round, a loop is only rotated if
+    # no loop nested in it or around it was, and none of the blocks it
+    # changes have changed, so the CFG and loop forest of the round still
+    # hold for it. A rotated loop never has the shape again, so this ends.
+    while True:
+        g = CFG(func)
+        domins = Dominators(func, g)
+        forest = loop_forest(g, domins.tree)
+        block_of = {name: b for b, name in enumerate(g.names)}
+
+        # var -> instructions using it
+        uses = {}
+        for block in g.blocks:
+            for instr in block:
+                for a in instr.get('args', []):
+                    uses.setdefault(a, []).append(instr)
+
+        def add_uses(instr):
+            for a in instr.get('args', []):
+                uses.setdefault(a, []).append(instr)
+
+        def rename(instr, old, new):
+            instr['args'] = [new if a == old else a for a in instr['args']]
+            uses.setdefault(new, []).append(instr)
+
+        touched = set()
+        busy = set()
+        removed = set()
+        count = 0
+
+        # innermost loops first
+        for loop in reversed(forest.loops):
+            if id(loop) in busy:
+                continue
+            h = loop.header
+            p = loop.preheader
+            if p is None or len(loop.latches) != 1 or loop.latches[0] == h:
+                continue
+            latch = loop.latches[0]
+            if set(g.preds[h]) != {p, latch}:
+                continue
+            if any(b != h for b, s in loop.exits):
+                continue
+
+            hblock = g.blocks[h]
+            end = hblock[-1]
+            if end.get('op') != 'br' or g.blocks[latch][-1].get('op') != 'jmp':
+                continue
+            if g.blocks[p][-1].get('op') != 'jmp':
+                continue
+            succs = [block_of[l] for l in end['labels']]
+            inside = [s for s in succs if forest.in_loop(s, loop)]
+            if len(inside) != 1 or inside[0] == h:
+                continue
+            body = inside[0]
+            exit = succs[1 - succs.index(body)]
+            if g.preds[body] != [h] or g.preds[exit] != [h]:
+                continue
+            if any(instr.get('op') == 'phi' for instr in g.blocks[exit]):
+                continue
+            if touched & {p, h, body, exit, latch}:
+                continue
+
+            phis = [instr for instr in hblock if instr.get('op') == 'phi']
+            consts = [instr for instr in hblock if instr.get('op') == 'const']
+            code = [instr for instr in hblock[1:-1]
+                    if instr.get('op') not in ('phi', 'const')]
+            if len(code) > ROTATE_LIMIT:
+                continue
+
+            # Rotate it
+            touched |= {p, h, body, exit, latch}
+            l = loop.parent
+            while l is not None:
+                busy.add(id(l))
+                l = l.parent
+            removed.add(h)
+            count += 1
+
+            plabel = g.names[p]
+            llabel = g.names[latch]
+            defs = set(instr['dest'] for instr in code if 'dest' in instr)
+            phi_defs = set(instr['dest'] for instr in phis)
+            in_body = set(id(instr) for b in loop.body if b != h
+                          for instr in g.blocks[b])
+            in_header = set(id(instr) for instr in hblock)
+
+            # The value of each header def in the guard, and at the end of
+            # the latch. A header phi's value at the end of the latch is its
+            # latch arg as the body sees it.
+            guard = {}
+            latch_value = {}
+            in_loop = {}
+
+            def body_name(v):
+                if v not in defs:
+                    return v
+                if v not in in_loop:
+                    in_loop[v] = fresh(v + '.rot')
+                return in_loop[v]
+
+            for phi in phis:
+                args = dict(zip(phi['labels'], phi['args']))
+                guard[phi['dest']] = args[plabel]
+                latch_value[phi['dest']] = args[llabel]
+            for phi in phis:
+                latch_value[phi['dest']] = body_name(latch_value[phi['dest']])
+
+            # The guard: consts and a copy of the code, then the header's
+            # branch
+            pblock = g.blocks[p]
+            pblock.pop()
+            pblock += consts
+            for instr in code + [end]:
+                copy = dict(instr)
+                copy['args'] = [guard.get(a, a) for a in instr.get('args', [])]
+                if 'dest' in instr:
+                    copy['dest'] = guard[instr['dest']] = fresh(instr['dest'] + '.guard')
+                    types[copy['dest']] = instr['type']
+                if 'labels' in instr:
+                    copy['labels'] = list(instr['labels'])
+                if not copy['args']:
+                    del copy['args']
+                pblock.append(copy)
+                add_uses(copy)
+
+            # Uses in the body read the merged value; uses after the loop the
+            # one merged at the exit
+            for v in list(defs) + sorted(phi_defs):
+                outside = []
+                for instr in uses.get(v, []):
+                    if id(instr) in in_body:
+                        if v in defs:
+                            rename(instr, v, body_name(v))
+                    elif id(instr) not in in_header:
+                        outside.append(instr)
+                if outside:
+                    v_exit = fresh(v + '.exit')
+                    types[v_exit] = types[v]
+                    g.blocks[exit].insert(1, {
+                        'op': 'phi', 'dest': v_exit, 'type': types[v],
+                        'args': [guard[v], latch_value.get(v, v)],
+                        'labels': [plabel, llabel]})
+                    add_uses(g.blocks[exit][1])
+                    for instr in outside:
+                        rename(instr, v, v_exit)
+
+            # The header's code moves to the end of the latch, reading its
+            # phis' values there
+            lblock = g.blocks[latch]
+            lblock.pop()
+            for instr in code + [end]:
+                if 'args' in instr:
+                    for v in set(instr['args']) & phi_defs:
+                        rename(instr, v, latch_value[v])
+            lblock += code + [end]
+
+            # The header's phis, and the merged defs, start the new header
+            bblock = g.blocks[body]
+            for phi in phis:
+                phi['args'] = [guard[phi['dest']], latch_value[phi['dest']]]
+                phi['labels'] = [plabel, llabel]
+                phi['type'] = types[phi['dest']]
+                add_uses(phi)
+            merged = [{'op': 'phi', 'dest': v_body, 'type': types[v],
+                       'args': [guard[v], v], 'labels': [plabel, llabel]}
+                      for v, v_body in in_loop.items()]
+            for phi in merged:
+                types[phi['dest']] = phi['type']
+                add_uses(phi)
+            bblock[1:1] = phis + merged
+
+        if not count:
+            return func
+
+        stats['rotated'] += count
+        func['instrs'] = [instr for b, block in enumerate(g.blocks)
+                          if b not in removed for instr in block]
@@ -0,0 +1,137 @@
+"""Run the test programs through the driver under each set of passes.
+
+Usage: python3 run_tests.py [test.bril ...]   (default: ../tests/*.bril)
+
+run_test_case.sh only runs the default pipeline, which runs no pass. Here
+each program is compiled with every flag set in CONFIGS, its LLVM IR run
+with lli and the output compared with brili's on the original program. The
+--roundtrip configs take the SSA form back out of SSA as Bril, which brili
+runs instead. A test's arguments are the ones on its `# ARGS:` line. Needs
+bril2json, brili and lli on the PATH.
+
+With --copies, also prints the copies from_ssa leaves in each program with
+and without coalescing.
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+
+from driver import PASSES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Driver flags to compile each test with: no passes, each pass on its own,
+# and all of them in order. Unroll also runs with other factors, as which
+# copy a partially unrolled loop leaves from depends on trips % factor
+CONFIGS = [[]] + [['--passes', name] for name in PASSES] + [
+    ['--passes', 'unroll', '--unroll-factor', '2'],
+    ['--passes', 'unroll', '--unroll-factor', '3'],
+    ['--passes', 'rotate,strength'],
+    ['--passes', 'rotate,unroll'],
+    ['--passes', ','.join(PASSES)],
+    ['--bril', '--roundtrip'],
+    ['--bril', '--roundtrip', '--no-coalesce'],
+    ['--bril', '--roundtrip', '--passes', ','.join(PASSES)],
+]
+
+
+def run(cmd, stdin):
+    """ Run cmd on the text stdin, returning (returncode, stdout, stderr).
+    """
+    p = subprocess.run(cmd, input=stdin, capture_output=True, text=True)
+    return p.returncode, p.stdout, p.stderr
+
+
+def test_args(path):
+    """ The arguments on the `# ARGS:` first line of the test at path.
+    """
+    with open(path) as f:
+        first = f.readline()
+    if first.startswith('# ARGS:'):
+        return first[len('# ARGS:'):].split()
+    return []
+
+
+# path: a .bril test program
+# configs: lists of driver flags to compile it with
+#
+# Returns a message for each config whose output differs from brili's, or
+# that fails to compile or run.
+def check(path, configs):
+    with open(path) as f:
+        code, prog, err = run(['bril2json'], f.read())
+    if code:
+        return ['bril2json: ' + err.strip()]
+    args = test_args(path)
+    code, expected, err = run(['brili'] + args, prog)
+    if code:
+        return ['brili: ' + err.strip()]
+
+    failures = []
+    for flags in configs:
+        what = ' '.join(flags) or '(no flags)'
+        driver = [sys.executable, os.path.join(HERE, 'driver.py')] + flags
+        code, ll, err = run(driver, prog)
+        if code:
+            failures.append('{}: driver: {}'.format(what, err.strip()))
+            continue
+        runner = ['brili'] if '--bril' in flags else ['lli', '-']
+        code, got, err = run(runner + args, ll)
+        if code:
+            failures.append('{}: {}: {}'.format(what, runner[0], err.strip()))
+        elif got != expected:
+            failures.append('{}: output differs from brili'.format(what))
+    return failures
+
+
+# path: a .bril test program
+#
+# Returns the driver's --stats counts, by name, for each of coalescing and
+# not when taking path's SSA form back out of SSA.
+def copy_counts(path):
+    with open(path) as f:
+        _, prog, _ = run(['bril2json'], f.read())
+    counts = []
+    for flags in [], ['--no-coalesce']:
+        driver = [sys.executable, os.path.join(HERE, 'driver.py'),
+                  '--bril', '--roundtrip', '--stats'] + flags
+        _, _, err = run(driver, prog)
+        stats = dict(item.split(': ') for item in err.strip().split(', '))
+        counts.append(stats)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the test programs under each set of passes.')
+    parser.add_argument('tests', nargs='*',
+                        help='.bril programs (default: the tests directory)')
+    parser.add_argument('--copies', action='store_true',
+                        help='also report the copies left by from_ssa with and '
+                             'without coalescing')
+    args = parser.parse_args()
+
+    tests = args.tests or sorted(glob.glob(os.path.join(HERE, '..', 'tests', '*.bril')))
+    failed = 0
+    for path in tests:
+        failures = check(path, CONFIGS)
+        for message in failures:
+            print('FAIL {} {}'.format(os.path.basename(path), message))
+        failed += bool(failures)
+
+    print('{} of {} tests passed under {} configs'.format(
+        len(tests) - failed, len(tests), len(CONFIGS)))
+
+    if args.copies:
+        print()
+        print('{:>24} {:>8} {:>10} {:>22}'.format(
+            'program', 'copies', 'coalesced', 'copies (no coalescing)'))
+        for path in tests:
+            on, off = copy_counts(path)
+            print('{:>24} {:>8} {:>10} {:>22}'.format(
+                os.path.basename(path), on['copies'], on['coalesced'], off['copies']))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
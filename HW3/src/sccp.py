@@ -0,0 +1,206 @@
+from cfg import CFG
+
+# ------------------------------------------------------------------------------
+# Sparse conditional constant propagation (Wegman and Zadeck) on the SSA form
+# built by to_ssa.
+#
+# Every var has a lattice value: TOP (no value seen yet), a constant (a Python
+# int or bool), or BOTTOM (varies at run time). Values only move down, from
+# TOP to a constant to BOTTOM. Two worklists drive the propagation: CFG edges
+# that have just become executable, and the uses of vars whose value has just
+# changed. A block is only evaluated once some edge into it is executable, a
+# phi only meets the args on executable edges, and a branch on a constant only
+# makes the taken edge executable.
+#
+# Afterwards, every var with a constant value is turned into a const, branches
+# on constants become jumps, and blocks that never became executable are
+# removed.
+# ------------------------------------------------------------------------------
+
+TOP = ('top',)
+BOTTOM = ('bottom',)
+
+def same(a, b):
+    """True iff lattice values a and b are equal (True and 1 are not)"""
+    return a is b or (type(a) is type(b) and a == b)
+
+def meet(a, b):
+    if a is TOP:
+        return b
+    if b is TOP or same(a, b):
+        return a
+    return BOTTOM
+
+def wrap(n):
+    """n as a signed 64-bit int, the way Bril (and LLVM's i64) overflow"""
+    return (n + (1 << 63)) % (1 << 64) - (1 << 63)
+
+def divide(a, b):
+    # Bril's div truncates toward zero, as LLVM's sdiv does. Division by zero
+    # is left to fail at run time.
+    if b == 0:
+        return BOTTOM
+    q = abs(a) // abs(b)
+    return wrap(q if (a < 0) == (b < 0) else -q)
+
+# Bril op -> function computing it on constant args
+FOLD = {
+    'add': lambda a, b: wrap(a + b),
+    'sub': lambda a, b: wrap(a - b),
+    'mul': lambda a, b: wrap(a * b),
+    'div': divide,
+    'eq':  lambda a, b: a == b,
+    'lt':  lambda a, b: a < b,
+    'gt':  lambda a, b: a > b,
+    'le':  lambda a, b: a <= b,
+    'ge':  lambda a, b: a >= b,
+    'and': lambda a, b: a and b,
+    'or':  lambda a, b: a or b,
+    'not': lambda a: not a,
+    'id':  lambda a: a,
+}
+
+
+# func: a function in SSA form, every block labeled (as to_ssa leaves it)
+# stats: optional dict; its 'folded', 'branches' and 'unreachable' counts are
+#        incremented with the instructions turned into consts, the branches
+#        turned into jumps, and the blocks removed.
+def sccp(func, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('folded', 0)
+    stats.setdefault('branches', 0)
+    stats.setdefault('unreachable', 0)
+
+    g = CFG(func)
+    block_of = {name: b for b, name in enumerate(g.names)}
+
+    # var -> lattice value (TOP if missing); args and vars with no def at all
+    # are only known at run time
+    value = {}
+    for arg in func.get('args', []):
+        value[arg['name']] = BOTTOM
+
+    # var -> [(block, instr) using it]
+    uses = {}
+    defined = set(value)
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            for a in instr.get('args', []):
+                uses.setdefault(a, []).append((b, instr))
+            if 'dest' in instr:
+                defined.add(instr['dest'])
+    for a in uses:
+        if a not in defined:
+            value[a] = BOTTOM
+
+    executable = [False] * g.n
+    edges = set()       # executable (pred, succ) edges
+    flow = [(None, 0)]  # edges that just became executable
+    work = []           # uses of vars whose value just changed
+
+    def evaluate(instr):
+        op = instr['op']
+        if op == 'const':
+            if instr.get('type') in ('int', 'bool'):
+                return instr['value']
+            return BOTTOM
+        if op not in FOLD:
+            return BOTTOM
+        args = [value.get(a, TOP) for a in instr['args']]
+        if any(v is BOTTOM for v in args):
+            return BOTTOM
+        if any(v is TOP for v in args):
+            return TOP
+        return FOLD[op](*args)
+
+    # b: the (executable) block holding instr
+    def visit(b, instr):
+        op = instr.get('op')
+        if op == 'phi':
+            v = TOP
+            for a, lbl in zip(instr['args'], instr['labels']):
+                if (block_of[lbl], b) in edges:
+                    v = meet(v, value.get(a, TOP))
+        elif 'dest' in instr:
+            v = evaluate(instr)
+        elif op == 'br':
+            c = value.get(instr['args'][0], TOP)
+            if c is TOP:
+                return
+            for k, lbl in enumerate(instr['labels']):
+                if c is BOTTOM or bool(c) == (k == 0):
+                    flow.append((b, block_of[lbl]))
+            return
+        elif op == 'jmp':
+            flow.append((b, block_of[instr['labels'][0]]))
+            return
+        else:
+            return
+
+        if not same(v, value.get(instr['dest'], TOP)):
+            value[instr['dest']] = v
+            work.extend(uses.get(instr['dest'], []))
+
+    while flow or work:
+        while flow:
+            p, b = flow.pop()
+            if p is not None:
+                if (p, b) in edges:
+                    continue
+                edges.add((p, b))
+
+            block = g.blocks[b]
+            if executable[b]:
+                # only the phis can see the new edge
+                for instr in block:
+                    if instr.get('op') == 'phi':
+                        visit(b, instr)
+                continue
+
+            executable[b] = True
+            for instr in block:
+                visit(b, instr)
+            if block[-1].get('op') not in ('br', 'jmp', 'ret'):
+                for s in g.edges[b]:
+                    flow.append((b, s))
+
+        while work:
+            b, instr = work.pop()
+            if executable[b]:
+                visit(b, instr)
+
+    # Rewrite the function with what's known
+    newinstrs = []
+    for b, block in enumerate(g.blocks):
+        if not executable[b]:
+            stats['unreachable'] += 1
+            continue
+
+        for instr in block:
+            op = instr.get('op')
+            v = value.get(instr['dest'], TOP) if 'dest' in instr else TOP
+            if v is not TOP and v is not BOTTOM and op != 'const':
+                newinstrs.append({'op': 'const', 'dest': instr['dest'],
+                                  'type': 'bool' if isinstance(v, bool) else 'int',
+                                  'value': v})
+                stats['folded'] += 1
+                continue
+
+            if op == 'phi':
+                pairs = [(a, lbl) for a, lbl in zip(instr['args'], instr['labels'])
+                         if (block_of[lbl], b) in edges]
+                instr['args'] = [a for a, lbl in pairs]
+                instr['labels'] = [lbl for a, lbl in pairs]
+
+            elif op == 'br':
+                c = value.get(instr['args'][0], TOP)
+                if c is not TOP and c is not BOTTOM:
+                    instr = {'op': 'jmp',
+                             'labels': [instr['labels'][0 if c else 1]]}
+                    stats['branches'] += 1
+
+            newinstrs.append(instr)
+
+    func['instrs'] = newinstrs
+    return func
@@ -1,12 +1,103 @@
 import sys
 import json
 from dominance import Dominators
+from dataflow import liveness, instr_uses
 from cfg import *
 from functools import reduce
 
 TERM = 'jmp', 'br', 'ret'
 
-def to_ssa(prog):
+# Returns the set of "global names" of g: vars used before being defined in
+# some block. Any other var is local to each block that uses it.
+def global_names(g):
+    names = set()
+    for block in g.blocks:
+        defined = set()
+        for instr in block:
+            if 'args' in instr:
+                args = instr['args']
+                if instr.get('op') == 'getmbr':  # second arg is a member name
+                    args = args[:1]
+                for arg in args:
+                    if arg not in defined:
+                        names.add(arg)
+            if 'dest' in instr:
+                defined.add(instr['dest'])
+    return names
+
+
+# ------------------------------------------------------------------------------
+# Phi placement (``Step one'' of the Lesson 5 notes), as Cytron et al.'s
+# worklist algorithm.
+# n: number of blocks
+# frontier: block -> blocks in its dominance frontier
+# defs: var -> blocks defining it
+# only: if given, the set of vars that may get phis
+# live: if given, (bits, live_in), where live_in[b] is the live-in bitset of
+#       block b over the var -> bit numbering bits; phis are only placed where
+#       their var is live
+# stats: dict whose 'pruned' count is incremented for each phi skipped as dead
+#
+# Returns, for each block, a map from var -> phi instruction (with dest, args
+# and labels still to be filled in by renaming).
+#
+# has_already[b] and work[b] hold the number of the last var that got a phi
+# at b, or that put b on the worklist, so they never have to be cleared and
+# each var costs time linear in its iterated dominance frontier.
+# ------------------------------------------------------------------------------
+
+def place_phis(n, frontier, defs, only=None, live=None, stats=None):
+    phis = [{} for i in range(n)]
+    has_already = [0] * n
+    work = [0] * n
+
+    for k, (v, vdefs) in enumerate(defs.items(), 1):
+        if only is not None and v not in only:
+            continue
+        if live is not None:
+            v_bit = 1 << live[0][v]
+
+        worklist = []
+        for d in vdefs:
+            if work[d] != k:
+                work[d] = k
+                worklist.append(d)
+
+        while worklist:
+            for b in frontier[worklist.pop()]:
+                if has_already[b] == k:
+                    continue
+                has_already[b] = k
+
+                # v is dead on entry to b: a phi there would be dead too,
+                # and b doesn't count as a new definition of v.
+                if live is not None and not live[1][b] & v_bit:
+                    if stats is not None:
+                        stats['pruned'] += 1
+                    continue
+
+                phis[b][v] = {'op':'phi', 'args':[], 'labels':[]}
+
+                if work[b] != k:
+                    work[b] = k
+                    worklist.append(b)
+
+    return phis
+
+
+# ssa: 'minimal' places a phi at every iterated dominance frontier of a
+#      variable's definitions; 'semi' only does so for global names; 'pruned'
+#      only where the variable is also live on entry to the block.
+# stats: optional dict; its 'phis', 'pruned' and 'local' counts are
+#        incremented with the number of phis emitted, the number skipped as
+#        dead, and the number of vars renamed locally.
+def to_ssa(prog, ssa='minimal', stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('phis', 0)
+    stats.setdefault('pruned', 0)
+    stats.setdefault('local', 0)
+
     for func in prog['functions']:
 
         # Add dummy id operations for each argument.
@@ -72,22 +163,23 @@ def to_ssa(prog):
                     else:
                         defs[instr['dest']] = [i]
 
-        # for each block, these are the phis we'll add at the end. Each has a
-        # map from orig.var -> to a map that will become the instruction itself,
-        phis = []
-        for i in range(g.n):
-            phis.append({})
+        # For semi-pruned SSA, the vars that may need a phi. Every use of any
+        # other var follows a def in the same block, so those are renamed
+        # within the block and skip the frontier iteration and the stacks.
+        globals_ = None
+        if ssa == 'semi':
+            globals_ = global_names(g)
+            stats['local'] += len(defs.keys() - globals_)
 
-        # Following pseudocode from Lesson 5 notes
-        # ``Step one''
-        for v,vdefs in defs.items():
-            for d in vdefs:
-                for b in domins.frontier[d]:
-                    if v not in phis[b]:
-                        phis[b][v] = {'op':'phi', 'args':[], 'labels':[]} # will handle dest/args later
+        # For pruned SSA, the live-in bitset of each block
+        live = None
+        if ssa == 'pruned':
+            live_index, live_in, _ = liveness(func, g)
+            live = (live_index.bits, live_in)
 
-                    if b not in defs[v]:
-                        defs[v].append(b)
+        # for each block, these are the phis we'll add at the end. Each has a
+        # map from orig.var -> to a map that will become the instruction itself,
+        phis = place_phis(g.n, domins.frontier, defs, globals_, live, stats)
 
         # ``Step two''
         stack = {}
@@ -102,19 +194,24 @@ def to_ssa(prog):
                 stack[arg['name']] = [arg['name']]
 
 
-        def new_name(ogvar):
+        def new_name(ogvar, push=True):
             n = ogvar + '_' + str(next_name[ogvar])
             next_name[ogvar] += 1
-            stack[ogvar].append(n)
+            if push:
+                stack[ogvar].append(n)
             return n
 
-        # b: index of block
+        # b: index of block. Returns the map from vars to count of names
+        # pushed, so they can be popped once b's dominator subtree is done.
         def rename(b):
 
 
             # map from vars to count of names pushed (so we can pop them)
             push_count = {}
 
+            # current names of the block-local vars
+            local = {}
+
             for v,p in phis[b].items():
                 p['dest'] = new_name(v)
 
@@ -124,15 +221,22 @@ def to_ssa(prog):
                 if 'args' in instr:
                     newargs = []
                     if 'op' in instr and instr['op'] == 'getmbr':
-                        newargs.append(stack[instr['args'][0]][-1])
+                        arg = instr['args'][0]
+                        newargs.append(local[arg] if arg in local else stack[arg][-1])
                         newargs.append(instr['args'][1])
                     else:
                         for arg in instr['args']:
-                            newargs.append(stack[arg][-1])
+                            newargs.append(local[arg] if arg in local else stack[arg][-1])
                     instr['args'] = newargs
 
+                # a local var only needs its name for the rest of the block
+                if 'dest' in instr and globals_ is not None and instr['dest'] not in globals_:
+                    name = new_name(instr['dest'], push=False)
+                    local[instr['dest']] = name
+                    instr['dest'] = name
+
                 # replace destination with new name (and push onto stack)
-                if 'dest' in instr:
+                elif 'dest' in instr:
                     name = new_name(instr['dest'])
                     if instr['dest'] in push_count:
                         push_count[instr['dest']] += 1
@@ -154,16 +258,26 @@ def to_ssa(prog):
                         phis[s][v]['args'].append(stack[v][-1])
                         phis[s][v]['labels'].append(g.names[b])
 
-            if b in domins.dom_tree:
-                for b_dom in domins.dom_tree[b]:
-                    rename(b_dom)
-
-            # pop all the names
-            for var,count in push_count.items():
-                for j in range(count):
-                    stack[var].pop()
+            return push_count
+
+        # Walk the dominator tree with an explicit stack rather than
+        # recursion. A block's push counts stay on the stack beneath its
+        # children, so its names are popped only after its whole subtree has
+        # been renamed.
+        work = [(0, None)]
+        while work:
+            b, push_count = work.pop()
+
+            if push_count is not None:
+                # pop all the names
+                for var,count in push_count.items():
+                    for j in range(count):
+                        stack[var].pop()
+                continue
 
-        rename(0)
+            work.append((b, rename(b)))
+            for b_dom in reversed(domins.tree.children(b)):
+                work.append((b_dom, None))
 
 
         # Add labels to blocks missing labels, and add jumps to blocks that fall
@@ -177,6 +291,7 @@ def to_ssa(prog):
                 # don't need a phi if only one label or arg
                 if len(set(p['labels'])) > 1 and len(set(p['args'])) > 1: 
                     b.insert(1, p)
+                    stats['phis'] += 1
 
             # Add a jmp if missing
             if i > 0 and ('op' not in g.blocks[i-1][-1] or g.blocks[i-1][-1]['op'] not in TERM):
@@ -195,49 +310,276 @@ def to_ssa(prog):
 
     return prog
 
-def from_ssa(prog):
+# ------------------------------------------------------------------------------
+# Copy coalescing for SSA destruction.
+# Each phi's dest is merged with its args into a single name wherever the two
+# names' live ranges don't interfere, so the copies between them vanish.
+#
+# In SSA form, two names can only interfere if the def of one dominates the
+# def of the other; they do iff the dominating one is still live just after
+# the other's def. Live-out blocks (see web_live_out) and a per-block last use
+# answer that.
+#
+# Returns the map from var -> the name of its class, for merged vars only.
+# ------------------------------------------------------------------------------
+
+# Most (members of a) * (members of d) interference tests coalesce_webs runs for
+# one phi arg; a bigger merge is left alone and its phi keeps its copy.
+COALESCE_LIMIT = 4096
+
+# site: var -> (block, position) of its def, as in coalesce_webs
+# uses: var -> blocks with a non-phi use of it
+# phi_uses: var -> blocks it is a phi arg from
+# Returns var -> set of blocks it is live out of, for each var in site. Each
+# var's range is found by walking back from its uses to its def, so the cost
+# is the size of the ranges, not blocks * vars as a bit vector per block
+# would be: in a long chain of blocks every block has names of its own.
+def web_live_out(g, site, uses, phi_uses):
+    live_out = {}
+    for v, (d, _) in site.items():
+        out = live_out[v] = set()
+        live_in = set()
+        work = []
+        for b in uses.get(v, ()):
+            if b != d and b not in live_in:
+                live_in.add(b)
+                work.append(b)
+        for b in phi_uses.get(v, ()):
+            out.add(b)
+            if b != d and b not in live_in:
+                live_in.add(b)
+                work.append(b)
+        while work:
+            for p in g.preds[work.pop()]:
+                out.add(p)
+                if p != d and p not in live_in:
+                    live_in.add(p)
+                    work.append(p)
+    return live_out
+
+
+def coalesce_webs(func, g):
+    domins = Dominators(func, g)
+
+    # var -> (block, position) of its def. Phis all define at -1, ahead of
+    # the block's instructions, and args at -2 in the entry.
+    params = [arg['name'] for arg in func.get('args', [])]
+    site = {name: (0, -2) for name in params}
+    last_use = [{} for b in range(g.n)]
+    uses = {}
+    phi_uses = {}
+    phis = []
+    block_of = {name: b for b, name in enumerate(g.names)}
+    for b, block in enumerate(g.blocks):
+        for i, instr in enumerate(block):
+            if instr.get('op') == 'phi':
+                site[instr['dest']] = (b, -1)
+                phis.append(instr)
+                for a, lbl in zip(instr['args'], instr['labels']):
+                    phi_uses.setdefault(a, []).append(block_of[lbl])
+                continue
+            for a in instr_uses(instr):
+                last_use[b][a] = i
+                uses.setdefault(a, []).append(b)
+            if 'dest' in instr:
+                site[instr['dest']] = (b, i)
+
+    # Only the vars of phi webs are ever asked about
+    web = set()
+    for phi in phis:
+        web.add(phi['dest'])
+        web.update(a for a in phi['args'] if a in site)
+    live_out = web_live_out(g, {v: site[v] for v in web}, uses, phi_uses)
+
+    def live_after(v, b, i):
+        return b in live_out[v] or last_use[b].get(v, -3) > i
+
+    def interfere(x, y):
+        (bx, ix), (by, iy) = site[x], site[y]
+        if bx == by and ix == iy:
+            return True
+        if domins.tree.dominates(bx, by) and (bx != by or ix < iy):
+            return live_after(x, by, iy)
+        if domins.tree.dominates(by, bx):
+            return live_after(y, bx, ix)
+        return False
+
+    parent = {}
+    members = {}
+
+    def find(v):
+        while v in parent:
+            v = parent[v]
+        return v
+
+    for phi in phis:
+        for arg in phi['args']:
+            if arg not in site:
+                continue
+            a, d = find(arg), find(phi['dest'])
+            if a == d or (a in params and d in params):
+                continue
+            in_a, in_d = members.get(a, [a]), members.get(d, [d])
+            if len(in_a) * len(in_d) > COALESCE_LIMIT:
+                continue
+            if any(interfere(x, y) for x in in_a for y in in_d):
+                continue
+
+            # params keep their names, since the signature refers to them
+            if a in params:
+                a, d, in_a, in_d = d, a, in_d, in_a
+            parent[a] = d
+            members[d] = in_d + in_a
+            members.pop(a, None)
+
+    return {v: find(v) for v in parent}
+
+
+# copies: list of (dest, src) pairs that happen in parallel (as all the phis of
+#         a block do on one edge)
+# types: var -> type, for the id instructions
+# fresh: returns a new temp name
+# Returns the copies as a list of id instructions in an order where no copy
+# overwrites a var a later one reads. Cycles (e.g. a swap) go through a temp.
+def sequentialize(copies, types, fresh):
+    pending = {}
+    for d, s in copies:
+        if d != s:
+            pending[d] = s
+    readers = {}
+    for s in pending.values():
+        readers[s] = readers.get(s, 0) + 1
+
+    def copy(d, s):
+        instr = {'op': 'id', 'dest': d, 'args': [s]}
+        if s in types:
+            instr['type'] = types[s]
+        return instr
+
+    out = []
+    while pending:
+        ready = [d for d in pending if not readers.get(d)]
+        if not ready:
+            # every pending dest is still read by another copy: save one
+            # away so its readers take it from the temp instead
+            d = next(iter(pending))
+            t = fresh()
+            if d in types:
+                types[t] = types[d]
+            out.append(copy(t, d))
+            for d2, s in pending.items():
+                if s == d:
+                    pending[d2] = t
+            readers[t], readers[d] = readers[d], 0
+            continue
+        for d in ready:
+            s = pending.pop(d)
+            out.append(copy(d, s))
+            readers[s] -= 1
+
+    return out
+
+
+# Replaces each phi with copies on its incoming edges. A copy goes at the end of
+# the pred if that's its only successor, else at the start of the phi's block
+# if that has only one pred; otherwise the edge is critical and is split with a
+# new block holding the copies.
+# coalesce: merge non-interfering phi webs first (see coalesce_webs)
+# stats: optional dict; its 'copies', 'coalesced' and 'blocks' counts are
+#        incremented with the copies emitted, the copies removed by
+#        coalescing, and the blocks added to split edges.
+def from_ssa(prog, coalesce=True, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('copies', 0)
+    stats.setdefault('coalesced', 0)
+    stats.setdefault('blocks', 0)
 
     for func in prog['functions']:
 
         g = CFG(func)
 
-        # First compute a map from label -> block idx
-        # Note: we assume every block in SSA form has a label (is this true?)
+        # Every block in SSA form has a label (to_ssa adds any missing ones)
         block_by_label = {}
-        term = []
         for i,b in enumerate(g.blocks):
             block_by_label[b[0]['label']] = i
 
-            # also temporarily save the TERM instruction (so when we add id's we
-            # can just tack them on the end)... this is a bit awkward
-            if 'op' in b[-1] and b[-1]['op'] in TERM:
-                term.append(b.pop())
-            else:
-                term.append(None)
-        
-        # print(term)
-
+        names = coalesce_webs(func, g) if coalesce else {}
+        for b in g.blocks:
+            for instr in b:
+                if 'dest' in instr:
+                    instr['dest'] = names.get(instr['dest'], instr['dest'])
+                if 'args' in instr:
+                    n = 1 if instr.get('op') == 'getmbr' else len(instr['args'])
+                    instr['args'] = [names.get(a, a) for a in instr['args'][:n]] + \
+                                    instr['args'][n:]
+
+        # HW3 phis carry no type; they take the type of their args
+        types = {}
+        for arg in func.get('args', []):
+            types[arg['name']] = arg['type']
+        for b in g.blocks:
+            for instr in b:
+                if 'dest' in instr and 'type' in instr:
+                    types[instr['dest']] = instr['type']
+        changed = True
+        while changed:
+            changed = False
+            for b in g.blocks:
+                for instr in b:
+                    if instr.get('op') == 'phi' and instr['dest'] not in types:
+                        for a in instr['args']:
+                            if a in types:
+                                types[instr['dest']] = types[a]
+                                changed = True
+                                break
+
+        temps = [0]
+        def fresh():
+            temps[0] += 1
+            return '__copy' + str(temps[0])
+
+        new_blocks = []
         for i,b in enumerate(g.blocks):
-            if len(b) == 1:
+            phis = [instr for instr in b if instr.get('op') == 'phi']
+            if not phis:
                 continue
+            b[:] = [instr for instr in b if instr.get('op') != 'phi']
+
+            # the parallel copies on each incoming edge, by pred label
+            edge_copies = {}
+            for p in phis:
+                for arg, lbl in zip(p['args'], p['labels']):
+                    edge_copies.setdefault(lbl, {})[p['dest']] = arg
+
+            for lbl, copies in edge_copies.items():
+                stats['coalesced'] += sum(1 for d, s in copies.items() if d == s)
+                seq = sequentialize(list(copies.items()), types, fresh)
+                if not seq:
+                    continue
+                stats['copies'] += len(seq)
+
+                j = block_by_label[lbl]
+                pred = g.blocks[j]
+                if len(set(g.edges[j])) == 1:
+                    at = len(pred) - 1 if pred[-1].get('op') in TERM else len(pred)
+                    pred[at:at] = seq
+                elif len(g.preds[i]) == 1:
+                    b[1:1] = seq
+                else:
+                    name = '{}.{}'.format(lbl, g.names[i])
+                    while name in block_by_label:
+                        name += '_'
+                    block_by_label[name] = None
+                    pred[-1]['labels'] = [name if l == g.names[i] else l
+                                          for l in pred[-1]['labels']]
+                    new_blocks.append([{'label': name}] + seq +
+                                      [{'op': 'jmp', 'labels': [g.names[i]]}])
+                    stats['blocks'] += 1
 
-            j = 1
-            while j < len(b) and 'op' in b[j] and b[j]['op'] == 'phi':
-                for k in range(len(b[j]['args'])):
-                    inst = {'op': 'id', 'dest': b[j]['dest'],
-                            'args':[b[j]['args'][k]]}
-                    g.blocks[block_by_label[b[j]['labels'][k]]].append(inst)
-
-                j += 1
-        
-        # write changes, omitting phis
         newinstr = []
-        for i,b in enumerate(g.blocks):
-            for inst in b:
-                if not ('op' in inst and inst['op'] == 'phi'):
-                    newinstr.append(inst)
-            if term[i]:
-                newinstr.append(term[i])
+        for b in g.blocks + new_blocks:
+            newinstr += b
 
         func['instrs'] = newinstr
 
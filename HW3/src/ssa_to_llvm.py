@@ -107,34 +107,90 @@ def is_ptr_type(t):
     """Decide whether the Bril type t is a pointer"""
     return (isinstance(t, dict) and 'ptr' in t)
 
+# Bril type -> LLVM type, filled in by ttype. Struct names are their own
+# keys; a ptr type, being a dict, is keyed by (the type it finally points
+# to, how many ptrs deep).
+TTYPES = {'int': 'i64', 'bool': 'i1'}
+
 def ttype(briltype):
     """Given a Bril type, return a string for the corresponding LLVM type"""
-    if briltype == 'int':
-        return 'i64'
-    elif briltype == 'bool':
-        return 'i1'
+    key = briltype
+    if is_ptr_type(key):
+        depth = 0
+        while is_ptr_type(key):
+            key = key['ptr']
+            depth += 1
+        key = (key, depth)
+
+    t = TTYPES.get(key)
+    if t is None:
+        if isinstance(key, tuple):
+            t = ttype(key[0]) + '*' * key[1]
+        else: # name of a struct
+            t = '%' + key
+        TTYPES[key] = t
+    return t
+
+class Operands(dict):
+    """ name -> LLVM operand, holding only the vars whose operand isn't their
+    own %name (constants and copies); any other var's is made on lookup.
+    """
+    def __missing__(self, a):
+        return '%' + a
+
+class Module:
+    """ Module-level information shared by every function.
+    sizes: type -> size in bytes, for int, bool and each struct
+    struct_mbr_offsets: struct name -> mbr name -> mbr offset idx
+
+    Kept in an object rather than globals so that each module (and each
+    worker process under driver.py --jobs) has its own copy.
+    """
+    def __init__(self, structs=()):
+        self.sizes = {'int': 8, 'bool': 1}
+        self.struct_mbr_offsets = {}
+        for struct in structs:
+            self.add_struct(struct)
+
+    def add_struct(self, struct):
+        """ Compute struct size for allocation and build mbr offset reference.
+            Returns the LLVM declaration.
+        """
+        name = struct['name']
+        size = 0
+
+        self.struct_mbr_offsets[name] = {}
 
-    elif is_ptr_type(briltype):
-        return ttype(briltype['ptr']) + '*'
+        mbrs = []
+        for i, mbr in enumerate(struct['mbrs']):
+            size += self.sizeof(mbr['type'])
 
-    else: # name of a struct
-        return '%' + briltype
+            self.struct_mbr_offsets[name][mbr['name']] = i
 
-# name -> size in bytes (maybe a global isn't the best choice here...)
-struct_sizes = {}
+            mbrs.append(ttype(mbr['type']))
 
-# struct name -> mbr name -> mbr offset idx
-struct_mbr_offsets = {}
+        self.sizes[name] = size
+        return '%{} = type {{ {} }}'.format(name, ', '.join(mbrs))
 
-def sizeof(briltype):
-    if briltype == 'bool':
-        return 1
-    elif is_ptr_type(briltype):
-        return 8
-    elif briltype in struct_sizes:
-        return struct_sizes[briltype]
-    else: #int
-        return 8
+    def sizeof(self, briltype):
+        if is_ptr_type(briltype):
+            return 8
+        return self.sizes.get(briltype, 8)
+
+
+class TextSink:
+    """ A sink collecting emitted text as a list of strings, joined once by
+    getvalue().
+
+    The emit_* functions write to any object with a write(str) method, so an
+    io.StringIO or a file opened with a large buffer works as a sink too.
+    """
+    def __init__(self):
+        self.parts = []
+        self.write = self.parts.append
+
+    def getvalue(self):
+        return ''.join(self.parts)
 
 
 class Context:
@@ -143,14 +199,16 @@ class Context:
     constants: name -> const value -- const values for bril constants
     canonical: name -> name        -- canonical var. names for bril `id` copies
     is_main: bool                  -- true iff this is the main func
+    module: Module                 -- struct layouts of the enclosing module
+    values: name -> str            -- LLVM operand for each var (Operands)
     """
-    def __init__(self, func):
+    def __init__(self, func, module=None):
         types = {}
         consts = {}
         canon = {}
         for i in func['instrs']:
             if 'dest' in i:
-                if i['op'] == 'phi':
+                if i['op'] == 'phi' and 'type' not in i:
                     types[i['dest']] = types[i['args'][0]]
                 else:
                     types[i['dest']] = i['type']
@@ -171,22 +229,26 @@ class Context:
         self.canonical = canon
         self.mainfunc = func['name'] == '__main'
         self.next_int = 0
+        self.module = module if module is not None else Module()
+
+        # Constants and copies have their LLVM operand worked out once here;
+        # every other var is its own %name. Formatting those up front only
+        # moved the cost of the emit into building the Context.
+        values = Operands()
+        for a, c in consts.items():
+            values[a] = 'null' if is_ptr_type(types[a]) and not c else str(c)
+        for a, c in canon.items():
+            values[a] = '%' + c
+        self.values = values
+
+    def typed_value(self, a):
+        """ The LLVM type and operand of var a, as an instruction takes them """
+        return ttype(self.types[a]) + ' ' + self.values[a]
 
     def format_args(self, args, show_types=False):
-        alist = []
-        for a in args:
-            t = self.types[a]
-            if a in self.constants:
-                a = self.constants[a]
-                if is_ptr_type(t) and not a:
-                    a = 'null'
-            elif a in self.canonical:
-                a = '%' + self.canonical[a]
-            else:
-                a = '%' + a
-            s = ttype(t) + ' ' + str(a) if show_types else str(a)
-            alist.append(s)
-        return ', '.join(alist)
+        if show_types:
+            return ', '.join(map(self.typed_value, args))
+        return ', '.join(map(self.values.__getitem__, args))
 
     def new_var(self, t):
         v = 'z' + str(self.next_int)
@@ -194,119 +256,150 @@ class Context:
         self.types[v] = t
         return v
 
-def emit_instr(instr, ctxt):
-    """Emit LLVM instruction(s) implementing instr, a bril instruction"""
-    args = instr['args'] if 'args' in instr else []
+# ------------------------------------------------------------------------------
+# Per-op emitters. Each is called as f(instr, ctxt, write), where write takes
+# the text to emit; EMITTERS maps each Bril op to its emitter.
+# ------------------------------------------------------------------------------
+
+# VALUE operations
+
+def emit_call(instr, ctxt, write):
+    args = instr.get('args', [])
+    if 'dest' in instr:
+        write('  %{} = call {} @__{}({})\n'.format(instr['dest'],
+                                                 ttype(instr['type']),
+                                                 instr['funcs'][0],
+                                                 ctxt.format_args(args, show_types=True)))
+    else: # void call
+        write('  call void @__{}({})\n'.format(instr['funcs'][0],
+                                             ctxt.format_args(args, show_types=True)))
+
+def emit_not(instr, ctxt, write):
+    write('  %{} = xor i1 1, {}\n'.format(instr['dest'], ctxt.values[instr['args'][0]]))
+
+def emit_binop(instr, ctxt, write):
+    args = instr['args']
+    write('  %{} = {} {} {}, {}\n'.format(instr['dest'],
+                                        OPS[instr['op']],
+                                        ttype(ctxt.types[args[0]]),
+                                        ctxt.values[args[0]],
+                                        ctxt.values[args[1]]))
+
+def emit_phi(instr, ctxt, write):
+    args = instr['args']
+    s = '  %{} = phi {} '.format(instr['dest'], ttype(ctxt.types[args[0]]))
+    pairs = []
+    while args:
+        (a, lbl) = (args.pop(), instr['labels'].pop())
+        pairs.append('[ {}, %{} ]'.format(ctxt.values[a], lbl))
+    write(s + ', '.join(pairs) + '\n')
+
+def emit_alloc(instr, ctxt, write):
+    new_var = ctxt.new_var('int')
+    write('  %{} = mul i64 {}, {}\n'.format(new_var,
+                                          ctxt.values[instr['args'][0]],
+                                          ctxt.module.sizeof(instr['type']['ptr'])))
+
+    ptr = ctxt.new_var(None) # the type is a lie! (but we'll never query for it)
+    write('  %{} = call i8* @malloc({})\n'.format(ptr, ctxt.typed_value(new_var)))
+    write('  %{} = bitcast i8* %{} to {}\n'.format(instr['dest'],
+                                                 ptr,
+                                                 ttype(instr['type'])))
+
+def emit_load(instr, ctxt, write):
+    write('  %{} = load {}, {}\n'.format(instr['dest'],
+                                       ttype(instr['type']),
+                                       ctxt.typed_value(instr['args'][0])))
+
+def emit_ptradd(instr, ctxt, write):
+    write('  %{} = getelementptr inbounds {}, {}\n'.format(instr['dest'],
+                                                         ttype(instr['type']['ptr']),
+                                                         ctxt.format_args(instr['args'], show_types=True)))
+
+def emit_getmbr(instr, ctxt, write):
+    args = instr['args']
+    struct = ctxt.types[args[0]]['ptr']
+    write('  %{} = getelementptr inbounds {}, {}, i64 0, i32 {}\n'.format(
+                                            instr['dest'],
+                                            ttype(struct),
+                                            ctxt.typed_value(args[0]),
+                                            ctxt.module.struct_mbr_offsets[struct][args[1]]))
+
+def emit_isnull(instr, ctxt, write):
+    new_var = ctxt.new_var('int')
+    write('  %{} = ptrtoint {} to i64\n'.format(new_var,
+                                              ctxt.typed_value(instr['args'][0])))
+    write('  %{} = icmp eq i64 0, %{}\n'.format(instr['dest'],
+                                              new_var))
+
+# EFFECT operations
+
+def emit_br(instr, ctxt, write):
+    write('  br i1 {}, label %{}, label %{}\n'.format(ctxt.values[instr['args'][0]],
+                                                    instr['labels'][0],
+                                                    instr['labels'][1]))
+
+def emit_jmp(instr, ctxt, write):
+    write('  br label %{}\n'.format(instr['labels'][0]))
+
+def emit_ret(instr, ctxt, write):
+    r = ctxt.format_args(instr.get('args', []), show_types=True)
+    if not r or ctxt.mainfunc:
+        r = 'void'
+    write('  ret {}\n'.format(r))
+
+def emit_print(instr, ctxt, write):
+    s = []
+    for a in instr.get('args', []):
+        s.append('  call void @print_{}({})'.format(ctxt.types[a], ctxt.typed_value(a)))
+    write("\n  call void @print_space()\n".join(s) + '\n') # Spaces between args
+    write('  call void @print_newline()\n')           # Newline at end
+
+def emit_free(instr, ctxt, write):
+    byte_ptr = ctxt.new_var(None) # the type is a lie! (but we'll never query for it)
+    write('  %{} = bitcast {} to i8*\n'.format(byte_ptr,
+                                             ctxt.typed_value(instr['args'][0])))
+    write('  call void @free(i8* %{})\n'.format(byte_ptr))
+
+def emit_store(instr, ctxt, write):
+    write('  store {}\n'.format(ctxt.format_args(reversed(instr['args']), show_types=True)))
+
+# const and id emit nothing: Context folds them into their uses.
+EMITTERS = {
+    'call': emit_call,
+    'not': emit_not,
+    'phi': emit_phi,
+    'alloc': emit_alloc,
+    'load': emit_load,
+    'ptradd': emit_ptradd,
+    'getmbr': emit_getmbr,
+    'isnull': emit_isnull,
+    'br': emit_br,
+    'jmp': emit_jmp,
+    'ret': emit_ret,
+    'print': emit_print,
+    'free': emit_free,
+    'store': emit_store,
+}
+for op in OPS:
+    EMITTERS[op] = emit_binop
 
 
+def emit_instr(instr, ctxt, out):
+    """Emit LLVM instruction(s) implementing instr, a bril instruction, to the
+    sink out"""
     if 'op' in instr:
-
-        # VALUE operations:
-        if 'dest' in instr:
-            if instr['op'] == 'call':
-                print('  %{} = call {} @__{}({})'.format(instr['dest'],
-                                                         ttype(instr['type']),
-                                                         instr['funcs'][0],
-                                                         ctxt.format_args(args, show_types=True)))
-
-            elif instr['op'] == 'not':
-                print('  %{} = xor i1 1, {}'.format(instr['dest'],
-                                                    ctxt.format_args(args)))
-
-            elif instr['op'] in OPS:
-                print('  %{} = {} {} {}'.format(instr['dest'],
-                                                OPS[instr['op']],
-                                                ttype(ctxt.types[args[0]]),
-                                                ctxt.format_args(args)))
-            elif instr['op'] == 'phi':
-                s = '  %{} = phi {} '.format(instr['dest'], ttype(ctxt.types[args[0]]))
-                pairs = []
-                while args:
-                    (a, lbl) = (args.pop(), instr['labels'].pop())
-                    pairs.append('[ {}, %{} ]'.format(ctxt.format_args([a]), lbl))
-                print(s + ', '.join(pairs))
-
-            elif instr['op'] == 'alloc':
-                new_var = ctxt.new_var('int')
-                print('  %{} = mul i64 {}, {}'.format(new_var,
-                                                      ctxt.format_args(args),
-                                                      sizeof(instr['type']['ptr'])))
-
-                ptr = ctxt.new_var(None) # the type is a lie! (but we'll never query for it)
-                print('  %{} = call i8* @malloc({})'.format(ptr,
-                                                            ctxt.format_args([new_var], show_types=True)))
-                print('  %{} = bitcast i8* %{} to {}'.format(instr['dest'],
-                                                             ptr,
-                                                             ttype(instr['type'])))
-            elif instr['op'] == 'load':
-                print('  %{} = load {}, {}'.format(instr['dest'],
-                                                   ttype(instr['type']),
-                                                   ctxt.format_args(args, show_types=True)))
-
-            elif instr['op'] == 'ptradd':
-                print('  %{} = getelementptr inbounds {}, {}'.format(instr['dest'],
-                                                                     ttype(instr['type']['ptr']),
-                                                                     ctxt.format_args(args, show_types=True)))
-            elif instr['op'] == 'getmbr':
-                struct = ctxt.types[args[0]]['ptr']
-                print('  %{} = getelementptr inbounds {}, {}, i64 0, i32 {}'.format(
-                                                        instr['dest'],
-                                                        ttype(struct),
-                                                        ctxt.format_args(args[:1], show_types=True),
-                                                        struct_mbr_offsets[struct][args[1]]))
-            elif instr['op'] == 'isnull':
-                new_var = ctxt.new_var('int')
-                print('  %{} = ptrtoint {} to i64'.format(new_var,
-                                                          ctxt.format_args(args, show_types=True)))
-                print('  %{} = icmp eq i64 0, %{}'.format(instr['dest'],
-                                                          new_var))
-
-
-
-        # EFFECT operations
-        else:
-            # control: br jmp ret
-            if instr['op'] == 'br':
-                print('  br i1 {}, label %{}, label %{}'.format(ctxt.format_args(args),
-                                                                instr['labels'][0],
-                                                                instr['labels'][1]))
-            elif instr['op'] == 'jmp':
-                print('  br label %{}'.format(instr['labels'][0]))
-
-            elif instr['op'] == 'ret':
-                r = ctxt.format_args(args, show_types=True)
-                if not r or ctxt.mainfunc:
-                    r = 'void'
-                print('  ret {}'.format(r))
-
-            # void call
-            elif instr['op'] == 'call':
-                print('  call void @__{}({})'.format(instr['funcs'][0],
-                                                   ctxt.format_args(args, show_types=True)))
-            # print
-            elif instr['op'] == 'print':
-                s = []
-                for a in args:
-                    t = ctxt.types[a]
-                    s.append('  call void @print_{}({})'.format(t, ctxt.format_args([a], show_types=True)))
-                print("\n  call void @print_space()\n".join(s)) # Spaces between args
-                print('  call void @print_newline()')           # Newline at end
-
-            elif instr['op'] == 'free':
-                byte_ptr = ctxt.new_var(None) # the type is a lie! (but we'll never query for it)
-                print('  %{} = bitcast {} to i8*'.format(byte_ptr,
-                                                         ctxt.format_args(args, show_types=True)))
-                print('  call void @free(i8* %{})'.format(byte_ptr))
-
-            elif instr['op'] == 'store':
-                print('  store {}'.format(ctxt.format_args(reversed(args), show_types=True)))
+        emit = EMITTERS.get(instr['op'])
+        if emit is not None:
+            emit(instr, ctxt, out.write)
 
     # LABEL
     else:
-        print(instr['label'] + ':')
+        out.write(instr['label'] + ':\n')
 
 
-def emit_func(f, ctxt):
+def emit_func(f, ctxt, out):
+    write = out.write
 
     # Translate return type
     rettype = ttype(f['type']) if 'type' in f else 'void'
@@ -319,12 +412,12 @@ def emit_func(f, ctxt):
     args = ', '.join(args)
 
     # Start emitting the fn
-    print(FUN_HDR.format(rettype, f['name'], args), end='')
+    write(FUN_HDR.format(rettype, f['name'], args))
 
     for instr in f['instrs']:
-        emit_instr(instr, ctxt)
+        emit_instr(instr, ctxt, out)
 
-    print(FUN_FTR)
+    write(FUN_FTR + '\n')
 
 
 MAIN = """
@@ -374,9 +467,10 @@ def get_argv(i, t):
   %a{} = trunc i32 %t{}_2 to i1
   """.format(i, i+1, i, i, i, i, i, i)
 
-def emit_main(main_args):
+def emit_main(main_args, out):
     """Process command line args and call bril program's main, i.e., __main
     """
+    write = out.write
     arg_setup = ''
     arg_list = []
     for i, arg in enumerate(main_args):
@@ -385,4 +479,4 @@ def emit_main(main_args):
     arg_list = ', '.join(arg_list)
 
 
-    print(MAIN.format(len(main_args), len(main_args), arg_setup, arg_list))
+    write(MAIN.format(len(main_args), len(main_args), arg_setup, arg_list) + '\n')
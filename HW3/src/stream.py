@@ -0,0 +1 @@
+../../HW2/src/stream.py
\ No newline at end of file
@@ -0,0 +1,362 @@
+from cfg import CFG, loop_forest
+from dominance import Dominators
+from licm import add_preheaders
+from sccp import wrap
+
+# ------------------------------------------------------------------------------
+# Induction variables and strength reduction on the SSA form built by to_ssa.
+#
+# A basic induction variable is a phi at a loop header whose value from the
+# latch is the phi plus (or minus) a loop-invariant step. A derived one is
+# computed from an induction variable by adding, subtracting or multiplying a
+# loop-invariant value, so that it is always a*i + c for a basic i and
+# invariants a and c. Invariants are consts, vars defined outside the loop,
+# or expressions of the two to be computed in the loop's preheader.
+#
+# Every derived variable computed by a mul is then replaced by a phi of its
+# own at the header, starting at a*i0 + c and incremented by a*step right
+# after i is, so the loop does an add where it did a mul.
+#
+# Linear-function test replacement: when the loop's only exit tests i
+# against a const, with a const start and step, the test is made on a
+# reduced variable with a nonzero const a instead, if no value it takes can
+# overflow; i is then deleted if nothing else reads it.
+# ------------------------------------------------------------------------------
+
+INT_MIN = -(1 << 63)
+INT_MAX = (1 << 63) - 1
+
+# (op of `i op n`) -> op of `n op i`, or of `a*i op a*n` when a < 0
+FLIP = {'lt': 'gt', 'le': 'ge', 'gt': 'lt', 'ge': 'le'}
+
+
+# Invariant values are ints, var names, or ('add' | 'sub' | 'mul', x, y)
+# tuples of invariant values. These fold what they can, and put an int first
+# in an add or mul, so equal values tend to be equal tuples.
+
+def inv_add(x, y):
+    if isinstance(x, int) and isinstance(y, int):
+        return wrap(x + y)
+    if x == 0:
+        return y
+    if y == 0:
+        return x
+    if isinstance(y, int):
+        return ('add', y, x)
+    return ('add', x, y)
+
+def inv_sub(x, y):
+    if isinstance(x, int) and isinstance(y, int):
+        return wrap(x - y)
+    if y == 0:
+        return x
+    return ('sub', x, y)
+
+def inv_mul(x, y):
+    if isinstance(x, int) and isinstance(y, int):
+        return wrap(x * y)
+    if x == 0 or y == 0:
+        return 0
+    if x == 1:
+        return y
+    if y == 1:
+        return x
+    if isinstance(y, int):
+        return ('mul', y, x)
+    return ('mul', x, y)
+
+
+# g, forest: the CFG and its loop_forest
+# loop: a Loop of forest with a preheader and a single latch
+# defs: var -> (block, instr) defining it
+# consts: var -> value, for the int consts
+# rpo_num: block -> its position in reverse postorder
+#
+# Returns (basic, derived): basic maps each basic induction variable i to
+# (init, step, next), the invariant it starts at, the invariant added each
+# iteration and the var holding its next value; derived maps every induction
+# variable, basic ones included, to (i, a, c) for its value a*i + c.
+def induction_vars(g, forest, loop, defs, consts, rpo_num):
+    def invariant(v):
+        if v in consts:
+            return consts[v]
+        if v not in defs or not forest.in_loop(defs[v][0], loop):
+            return v
+        return None
+
+    plabel = g.names[loop.preheader]
+    llabel = g.names[loop.latches[0]]
+
+    basic = {}
+    derived = {}
+    for instr in g.blocks[loop.header]:
+        if instr.get('op') != 'phi':
+            continue
+        i = instr['dest']
+        args = dict(zip(instr['labels'], instr['args']))
+        init = invariant(args.get(plabel))
+        nxt = args.get(llabel)
+        if init is None or nxt not in defs:
+            continue
+        inc = defs[nxt][1]
+        if inc['op'] not in ('add', 'sub') or inc.get('type') != 'int':
+            continue
+        if not forest.in_loop(defs[nxt][0], loop):
+            continue
+        x, y = inc['args']
+        if inc['op'] == 'add' and x == i and invariant(y) is not None:
+            step = invariant(y)
+        elif inc['op'] == 'add' and y == i and invariant(x) is not None:
+            step = invariant(x)
+        elif inc['op'] == 'sub' and x == i and invariant(y) is not None:
+            step = inv_sub(0, invariant(y))
+        else:
+            continue
+        basic[i] = (init, step, nxt)
+        derived[i] = (i, 1, 0)
+
+    if not basic:
+        return basic, derived
+
+    # Defs come before their (non-phi) uses in RPO
+    for b in sorted(loop.body, key=rpo_num.__getitem__):
+        for instr in g.blocks[b]:
+            op = instr.get('op')
+            if instr.get('type') != 'int' or op not in ('id', 'add', 'sub', 'mul'):
+                continue
+            if instr['dest'] in derived:
+                continue
+
+            if op == 'id':
+                if instr['args'][0] in derived:
+                    derived[instr['dest']] = derived[instr['args'][0]]
+                continue
+
+            x, y = instr['args']
+            if x in derived and invariant(y) is not None:
+                (i, a, c), k, swapped = derived[x], invariant(y), False
+            elif y in derived and invariant(x) is not None:
+                (i, a, c), k, swapped = derived[y], invariant(x), True
+            else:
+                continue
+
+            if op == 'add':
+                derived[instr['dest']] = (i, a, inv_add(c, k))
+            elif op == 'mul':
+                derived[instr['dest']] = (i, inv_mul(a, k), inv_mul(c, k))
+            elif not swapped:
+                derived[instr['dest']] = (i, a, inv_sub(c, k))
+            else:
+                derived[instr['dest']] = (i, inv_sub(0, a), inv_sub(k, c))
+
+    return basic, derived
+
+
+# g, forest, loop, defs, consts: as for induction_vars
+# domins: the Dominators of g
+# basic: the basic induction variables of loop, from induction_vars
+#
+# Returns (b, test, i, v, op, n) when the loop leaves only from block b, which
+# runs every iteration and ends in a br on test, going around again while
+# `v op n`: v is a basic induction variable i or its next value, op one of
+# FLIP and n a const. Otherwise returns None.
+def loop_test(g, forest, domins, loop, defs, consts, basic):
+    exiting = set(b for b, s in loop.exits)
+    if len(exiting) != 1:
+        return None
+    b = exiting.pop()
+    end = g.blocks[b][-1]
+    if not domins.tree.dominates(b, loop.latches[0]):
+        return None
+    if end.get('op') != 'br' or end['args'][0] not in defs:
+        return None
+    outside = set(g.names[s] for e, s in loop.exits)
+    if end['labels'][0] in outside or end['labels'][1] not in outside:
+        return None
+
+    test = defs[end['args'][0]][1]
+    if test.get('op') not in FLIP:
+        return None
+    x, y = test['args']
+    op = test['op']
+    if y in consts:
+        v, n = x, consts[y]
+    elif x in consts:
+        v, n, op = y, consts[x], FLIP[op]
+    else:
+        return None
+
+    for i, (init, step, nxt) in basic.items():
+        if v in (i, nxt):
+            return b, test, i, v, op, n
+    return None
+
+
+# func: a function in SSA form, every block labeled (as to_ssa leaves it)
+# stats: optional dict; its 'reduced' and 'lftr' counts are incremented with
+#        the muls replaced by induction variables and the loop tests
+#        replaced.
+def strength_reduce(func, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault('reduced', 0)
+    stats.setdefault('lftr', 0)
+
+    add_preheaders(func)
+    g = CFG(func)
+    domins = Dominators(func, g)
+    forest = loop_forest(g, domins.tree)
+
+    defs = {}
+    consts = {}
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            if 'dest' in instr:
+                defs[instr['dest']] = (b, instr)
+                if instr['op'] == 'const' and instr.get('type') == 'int':
+                    consts[instr['dest']] = instr['value']
+    rpo_num = {b: k for k, b in enumerate(g.rpo(order=[0]))}
+    names = set(defs) | set(a['name'] for a in func.get('args', []))
+
+    # base -> the suffix to try next, as bases like 'c.sr' recur
+    suffix = {}
+
+    def fresh(base):
+        k = suffix.get(base, 0)
+        name = '{}.{}'.format(base, k) if k else base
+        while name in names:
+            k += 1
+            name = '{}.{}'.format(base, k)
+        names.add(name)
+        suffix[base] = k + 1
+        return name
+
+    replace = {}    # var -> the var now holding its value
+    deleted = set() # ids of instructions to drop
+    dead_ivs = []   # (phi, increment) of basic IVs that may be left unused
+
+    for loop in reversed(forest.loops):
+        if loop.preheader is None or len(loop.latches) != 1:
+            continue
+        basic, derived = induction_vars(g, forest, loop, defs, consts, rpo_num)
+        if not basic:
+            continue
+
+        pre = g.blocks[loop.preheader]
+        at = len(pre) - 1 if pre[-1].get('op') == 'jmp' else len(pre)
+        hblock = g.blocks[loop.header]
+        plabel = g.names[loop.preheader]
+        llabel = g.names[loop.latches[0]]
+
+        # invariant -> var holding it in the preheader
+        made = {}
+
+        def materialize(x):
+            nonlocal at
+            if isinstance(x, str):
+                return x
+            if x not in made:
+                if isinstance(x, int):
+                    instr = {'op': 'const', 'dest': fresh('c.sr'),
+                             'type': 'int', 'value': x}
+                else:
+                    op, y, z = x
+                    instr = {'op': op, 'dest': fresh(op + '.sr'), 'type': 'int',
+                             'args': [materialize(y), materialize(z)]}
+                pre.insert(at, instr)
+                at += 1
+                defs[instr['dest']] = (loop.preheader, instr)
+                made[x] = instr['dest']
+            return made[x]
+
+        # (i, a, c) -> (phi, next) of the variable reducing it
+        reduced = {}
+
+        def reduce(iv, base):
+            if iv not in reduced:
+                i, a, c = iv
+                init, step, nxt = basic[i]
+                v = fresh(base + '.sr')
+                v_next = fresh(base + '.next')
+                start = materialize(inv_add(inv_mul(a, init), c))
+                phi = {'op': 'phi', 'dest': v, 'type': 'int',
+                       'args': [start, v_next], 'labels': [plabel, llabel]}
+                # after the other phis, which may read the old value (as
+                # brili runs a block's phis one at a time)
+                at_phi = 1
+                while hblock[at_phi].get('op') == 'phi':
+                    at_phi += 1
+                hblock.insert(at_phi, phi)
+                defs[v] = (loop.header, phi)
+                b, inc = defs[nxt]
+                add = {'op': 'add', 'dest': v_next, 'type': 'int',
+                       'args': [v, materialize(inv_mul(a, step))]}
+                block = g.blocks[b]
+                block.insert(block.index(inc) + 1, add)
+                defs[v_next] = (b, add)
+                reduced[iv] = (v, v_next)
+            return reduced[iv]
+
+        for v, iv in derived.items():
+            instr = defs[v][1]
+            if instr.get('op') == 'mul' and id(instr) not in deleted:
+                replace[v] = reduce(iv, v)[0]
+                deleted.add(id(instr))
+                stats['reduced'] += 1
+
+        # Test replacement
+        found = loop_test(g, forest, domins, loop, defs, consts, basic)
+        if found is None:
+            continue
+        b, test, i, v, op, n = found
+        init, step, nxt = basic[i]
+        if not isinstance(init, int) or not isinstance(step, int) or step == 0:
+            continue
+        # i has to move toward n, and the loop stop once past it
+        if (step > 0) != (op in ('lt', 'le')):
+            continue
+        lo, hi = min(init, n) - abs(step), max(init, n) + abs(step)
+        if lo < INT_MIN or hi > INT_MAX:
+            continue
+
+        # a*i + c has to take a different value for each i, so a != 0
+        for (j, a, c), (r, r_next) in reduced.items():
+            if j != i or not isinstance(a, int) or not isinstance(c, int) or a == 0:
+                continue
+            if all(INT_MIN <= a * k + c <= INT_MAX for k in (lo, hi)):
+                break
+        else:
+            continue
+
+        test['args'] = [r if v == i else r_next, materialize(a * n + c)]
+        test['op'] = op if a > 0 else FLIP[op]
+        stats['lftr'] += 1
+        dead_ivs.append((defs[i][1], defs[nxt][1]))
+
+    if not replace and not dead_ivs:
+        return func
+
+    def resolve(a):
+        while a in replace:
+            a = replace[a]
+        return a
+
+    uses = {}
+    for block in g.blocks:
+        for instr in block:
+            if id(instr) in deleted or 'args' not in instr:
+                continue
+            instr['args'] = [resolve(a) for a in instr['args']]
+            for a in set(instr['args']):
+                uses[a] = uses.get(a, 0) + 1
+
+    # A basic IV whose test was replaced is dead if only its own increment
+    # reads it, and only it reads the increment
+    for phi, inc in dead_ivs:
+        if uses.get(phi['dest'], 0) == 1 and uses.get(inc['dest'], 0) == 1:
+            deleted.add(id(phi))
+            deleted.add(id(inc))
+
+    func['instrs'] = [instr for block in g.blocks for instr in block
+                      if id(instr) not in deleted]
+    return func
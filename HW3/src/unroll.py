@@ -0,0 +1,341 @@
+from cfg import CFG, loop_forest
+from dominance import Dominators
+from licm import add_preheaders
+from rotate import var_types
+from strength import INT_MIN, INT_MAX, induction_vars, loop_test
+
+# ------------------------------------------------------------------------------
+# Loop unrolling on the SSA form built by to_ssa, for innermost loops with a
+# preheader, a single latch and a single exit edge (rotated loops included).
+#
+# The loop's blocks are copied, each copy's jump back to the header going to
+# the next copy's header instead, so the header phis of all but the first
+# copy become plain renamings of the previous copy's values. When the trip
+# count is a constant (the loop test compares a basic induction variable
+# with a const start and step against a const, see strength.loop_test), and
+# the whole unrolled loop fits in the budget, the loop is fully unrolled:
+# one copy per iteration, plus the part of one more up to the test that
+# leaves, with every test's outcome known and the loop gone. Otherwise it is
+# unrolled by the factor that fits, the last copy jumping back to the first.
+# If the trip count is known, only the copy the loop leaves from still needs
+# its test; if not, they all do, and a phi at the exit merges the values used
+# after the loop.
+#
+# Blocks of the copies that now have a single predecessor ending in a jmp are
+# merged into it, so a fully unrolled loop is usually straight-line code. The
+# tests whose branches were dropped are left for adce, and the arithmetic on
+# known values for sccp.
+# ------------------------------------------------------------------------------
+
+# Copies of the loop body made when partially unrolling (the driver's
+# --unroll-factor)
+UNROLL_FACTOR = 4
+
+# Most instructions (besides labels and phis) an unrolled loop may hold (the
+# driver's --unroll-budget)
+UNROLL_BUDGET = 200
+
+
+def trip_count(start, step, op, n):
+    """How many times `v op n` holds for v = start, start + step, ... before
+    it first fails, or None if it never does without overflowing.
+    """
+    if step > 0 and op in ('lt', 'le'):
+        last = n if op == 'le' else n - 1
+        if start > last:
+            return 0
+        count = (last - start) // step + 1
+    elif step < 0 and op in ('gt', 'ge'):
+        last = n if op == 'ge' else n + 1
+        if start < last:
+            return 0
+        count = (start - last) // -step + 1
+    else:
+        return None
+    if not INT_MIN <= start + count * step <= INT_MAX:
+        return None
+    return count
+
+
+# func: a function in SSA form, every block labeled (as to_ssa leaves it)
+# stats: optional dict; its 'unrolled' and 'partially_unrolled' counts are
+#        incremented with the loops unrolled fully and by a factor.
+# factor: copies of the body to make when partially unrolling
+# budget: the most instructions an unrolled loop may hold
+def unroll(func, stats=None, factor=UNROLL_FACTOR, budget=UNROLL_BUDGET):
+    if stats is None:
+        stats = {}
+    stats.setdefault('unrolled', 0)
+    stats.setdefault('partially_unrolled', 0)
+
+    add_preheaders(func)
+    g = CFG(func)
+    domins = Dominators(func, g)
+    forest = loop_forest(g, domins.tree)
+    rpo_num = {b: k for k, b in enumerate(g.rpo(order=[0]))}
+
+    defs = {}
+    consts = {}
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            if 'dest' in instr:
+                defs[instr['dest']] = (b, instr)
+                if instr['op'] == 'const' and instr.get('type') == 'int':
+                    consts[instr['dest']] = instr['value']
+
+    types = var_types(func)
+    names = set(types)
+    labels = set(g.names)
+    suffix = {}
+
+    def fresh(base, used):
+        k = suffix.get(base, 0)
+        name = '{}.{}'.format(base, k) if k else base
+        while name in used:
+            k += 1
+            name = '{}.{}'.format(base, k)
+        used.add(name)
+        suffix[base] = k + 1
+        return name
+
+    # var -> instructions using it, copies included
+    uses = {}
+
+    def add_uses(instr):
+        for a in instr.get('args', []):
+            uses.setdefault(a, []).append(instr)
+
+    for block in g.blocks:
+        for instr in block:
+            add_uses(instr)
+
+    # header -> the blocks replacing its loop
+    unrolled = {}
+    dropped = set()
+
+    # Innermost loops don't overlap, so each is unrolled from the CFG as built
+    for loop in forest.loops:
+        h, p = loop.header, loop.preheader
+        if loop.children or p is None or len(loop.latches) != 1:
+            continue
+        latch = loop.latches[0]
+        if len(loop.exits) != 1:
+            continue
+        e, x = loop.exits[0]
+        end = g.blocks[e][-1]
+        if end.get('op') != 'br' or end['labels'][0] == end['labels'][1]:
+            continue
+        stay = end['labels'][1 - end['labels'].index(g.names[x])]
+
+        blocks = [h] + sorted(b for b in loop.body if b != h)
+        size = sum(1 for b in blocks for instr in g.blocks[b]
+                   if 'label' not in instr and instr.get('op') != 'phi')
+
+        # The trip count, as the number of times the test passes
+        trips = None
+        basic = induction_vars(g, forest, loop, defs, consts, rpo_num)[0]
+        found = loop_test(g, forest, domins, loop, defs, consts, basic) if basic else None
+        if found is not None:
+            b, test, i, v, op, n = found
+            init, step, nxt = basic[i]
+            if isinstance(init, int) and isinstance(step, int):
+                start = init + step if v == nxt else init
+                if INT_MIN <= start <= INT_MAX:
+                    trips = trip_count(start, step, op, n)
+
+        if trips is not None and (trips + 1) * size <= budget:
+            copies = trips + 1
+            full = True
+            keep = None
+        else:
+            copies = min(factor, budget // size)
+            if copies < 2:
+                continue
+            full = False
+            # the copy the loop leaves from, if only one can
+            keep = None if trips is None else trips % copies
+
+        # In the last copy of a fully unrolled loop, only the blocks up to
+        # the test run: those reached from the header without passing it
+        if full:
+            last_blocks = set([h, e])
+            stack = [h]
+            while stack:
+                b = stack.pop()
+                if b == e:
+                    continue
+                for s in g.edges[b]:
+                    if s != h and s not in last_blocks:
+                        last_blocks.add(s)
+                        stack.append(s)
+
+        plabel = g.names[p]
+        llabel = g.names[latch]
+        hlabel = g.names[h]
+        phis = [instr for instr in g.blocks[h] if instr.get('op') == 'phi']
+        loop_defs = [instr['dest'] for b in blocks for instr in g.blocks[b]
+                     if 'dest' in instr]
+        originals = set(id(instr) for b in blocks for instr in g.blocks[b])
+
+        # Copy k's labels, and names for the loop's vars
+        lmaps = []
+        for k in range(copies):
+            lmaps.append({g.names[b]: g.names[b] if k == 0 else
+                          fresh('{}.u{}'.format(g.names[b], k), labels)
+                          for b in blocks})
+        maps = []
+        for k in range(copies):
+            vm = {}
+            for phi in phis:
+                args = dict(zip(phi['labels'], phi['args']))
+                if k == 0:
+                    vm[phi['dest']] = args[plabel] if full else phi['dest']
+                else:
+                    vm[phi['dest']] = maps[k - 1].get(args[llabel], args[llabel])
+            for v in loop_defs:
+                if v not in vm:
+                    vm[v] = v if k == 0 else fresh('{}.u{}'.format(v, k), names)
+                    types[vm[v]] = types[v]
+            maps.append(vm)
+
+        def target(l, k):
+            if l == hlabel:
+                return lmaps[(k + 1) % copies][hlabel]
+            return lmaps[k].get(l, l)
+
+        emitted = []
+        copied = set()
+        for k in range(copies):
+            vm, lm = maps[k], lmaps[k]
+            for b in blocks:
+                if full and k == copies - 1 and b not in last_blocks:
+                    continue
+                out = [{'label': lm[g.names[b]]}]
+                for instr in g.blocks[b][1:]:
+                    # the first copy keeps the header phis of a partially
+                    # unrolled loop, patched below once the last is named
+                    if b == h and instr.get('op') == 'phi' and (k or full):
+                        continue
+                    new = dict(instr)
+                    if 'args' in instr:
+                        new['args'] = [vm.get(a, a) for a in instr['args']]
+                    if 'dest' in instr:
+                        new['dest'] = vm[instr['dest']]
+                        if instr['dest'] in consts:
+                            consts[new['dest']] = consts[instr['dest']]
+                    if instr.get('op') == 'phi':
+                        new['labels'] = [lm.get(l, l) for l in instr['labels']]
+                    elif 'labels' in instr:
+                        new['labels'] = [target(l, k) for l in instr['labels']]
+                    if instr is end:
+                        if full:
+                            l = g.names[x] if k == copies - 1 else target(stay, k)
+                            new = {'op': 'jmp', 'labels': [l]}
+                        elif keep is not None and k != keep:
+                            new = {'op': 'jmp', 'labels': [target(stay, k)]}
+                    copied.add(id(new))
+                    add_uses(new)
+                    out.append(new)
+                emitted.append(out)
+
+        if not full:
+            for phi in emitted[0]:
+                if phi.get('op') != 'phi':
+                    continue
+                args = dict(zip(phi['labels'], phi['args']))
+                phi['args'] = [args[plabel],
+                               maps[-1].get(args[llabel], args[llabel])]
+                phi['labels'] = [plabel, lmaps[-1][llabel]]
+                phi['type'] = types[phi['dest']]
+
+        # Values used after the loop: those of the copy leaving it, or a phi
+        # at the exit when any copy may. If the exit has other predecessors,
+        # only its phis can use them.
+        elabel = g.names[e]
+        xblock = g.blocks[x]
+        xphis = [instr for instr in xblock if instr.get('op') == 'phi']
+        leaving = list(range(copies)) if not full and keep is None else \
+            [copies - 1 if full else keep]
+        for phi in xphis:
+            entries = list(zip(phi['args'], phi['labels']))
+            arg = phi['args'][phi['labels'].index(elabel)]
+            phi['args'] = [a for a, l in entries if l != elabel] + \
+                [maps[k].get(arg, arg) for k in leaving]
+            phi['labels'] = [l for a, l in entries if l != elabel] + \
+                [lmaps[k][elabel] for k in leaving]
+            phi['type'] = types[phi['dest']]
+            add_uses(phi)
+        # The uses are all found before any is renamed: a header phi may be
+        # renamed to a later def of the loop, whose uses it would then join
+        skip = originals | copied | set(id(phi) for phi in xphis)
+        outside_uses = {}
+        for v in loop_defs:
+            outside_uses[v] = [instr for instr in uses.get(v, [])
+                               if id(instr) not in skip]
+        for v in loop_defs:
+            outside = outside_uses[v]
+            if not outside:
+                continue
+            if len(leaving) == 1:
+                new = maps[leaving[0]][v]
+            else:
+                new = fresh(v + '.exit', names)
+                types[new] = types[v]
+                phi = {'op': 'phi', 'dest': new, 'type': types[v],
+                       'args': [maps[k][v] for k in leaving],
+                       'labels': [lmaps[k][elabel] for k in leaving]}
+                xblock.insert(1, phi)
+                add_uses(phi)
+                skip.add(id(phi))
+            for instr in outside:
+                instr['args'] = [new if a == v else a for a in instr['args']]
+            uses.setdefault(new, []).extend(outside)
+
+        # Merge blocks into their only predecessor, where it jumps to them
+        pblock = g.blocks[p]
+        by_label = {block[0]['label']: block for block in emitted}
+        preds = {}
+        for block in [pblock] + emitted:
+            for l in block[-1].get('labels', []):
+                preds[l] = preds.get(l, 0) + 1
+        alias = {}
+        merged = set()
+        for block in [pblock] + emitted:
+            if id(block) in merged:
+                continue
+            while block[-1].get('op') == 'jmp':
+                l = block[-1]['labels'][0]
+                succ = by_label.get(l)
+                if succ is None or succ is block or preds[l] != 1 or \
+                        any(instr.get('op') == 'phi' for instr in succ):
+                    break
+                block[-1:] = succ[1:]
+                alias[l] = block[0]['label']
+                merged.add(id(succ))
+
+        def resolve(l):
+            while l in alias:
+                l = alias[l]
+            return l
+
+        for block in emitted + [xblock]:
+            for instr in block:
+                if instr.get('op') == 'phi':
+                    instr['labels'] = [resolve(l) for l in instr['labels']]
+
+        unrolled[h] = [block for block in emitted if id(block) not in merged]
+        dropped |= set(blocks)
+        stats['unrolled' if full else 'partially_unrolled'] += 1
+
+    if not unrolled:
+        return func
+
+    newinstrs = []
+    for b, block in enumerate(g.blocks):
+        if b in unrolled:
+            for new in unrolled[b]:
+                newinstrs += new
+        elif b not in dropped:
+            newinstrs += block
+    func['instrs'] = newinstrs
+    return func